@@ -0,0 +1,193 @@
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .models import Sample, ToolVersion
+from .interfaces import read_import, tool_version_args
+from .importlog import input_fingerprint, is_imported, write_logged_import
+from .engine import run_transaction, begin_write
+from .util import get_or_create, enable_unit_of_work, UNIT_OF_WORK
+
+# columns of a manifest, only method and input_path are mandatory
+MANIFEST_COLUMNS = ["sample_name", "external_id", "method", "input_path",
+        "assembly", "tool_version", "db_version", "mode"]
+MANIFEST_DEFAULTS = {"tool_version": "unknown", "mode": "fasta"}
+
+
+def read_manifest(manifest_file: str) -> pd.DataFrame:
+    """
+    reads batch manifest: tab-separated file with header or json (list of
+    records, file ending .json) with columns as defined in MANIFEST_COLUMNS;
+    one row per import (sample x method), empty fields are set to None
+    """
+    if manifest_file.endswith(".json"):
+        df = pd.read_json(manifest_file, orient="records", dtype=False)
+    else:
+        df = pd.read_csv(manifest_file, sep="\t", dtype=str)
+
+    missing = {"method", "input_path"} - set(df.columns)
+    if missing:
+        raise ValueError(f"manifest is missing mandatory columns: {missing}")
+    for column in MANIFEST_COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+    df = df[MANIFEST_COLUMNS].astype(object).replace([np.nan, ""], [None, None])
+    for column, default in MANIFEST_DEFAULTS.items():
+        df[column] = df[column].fillna(default)
+    return df
+
+
+def _sample_args(sample_name, external_id):
+    return {k: v for k, v in zip(["name", "external_id"],
+        [sample_name, external_id]) if v is not None}
+
+
+def _version_args(row):
+    return tool_version_args(row["method"], row["mode"], row["tool_version"],
+            row["db_version"], row["assembly"])
+
+
+def _result_or_exception(future):
+    try:
+        return future.result()
+    except Exception as e:
+        return e
+
+
+def parse_manifest_rows(manifest_df: pd.DataFrame, workers: int=1,
+        queue_size: int=None):
+    """
+    generator running the parsing stage (read_import) of all manifest rows,
+    yields (index, results) in order of manifest_df; failed parsing yields the
+    exception instead of results
+    workers > 1: parsing is done in a process pool, at most queue_size
+        (default: 2 x workers) parsed results are held back for the writer
+    """
+    if workers <= 1:
+        for i, row in manifest_df.iterrows():
+            try:
+                yield i, read_import(row["input_path"], row["method"],
+                        row["assembly"])
+            except Exception as e:
+                yield i, e
+        return
+
+    queue_size = queue_size or 2 * workers
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for i, row in manifest_df.iterrows():
+            pending.append((i, executor.submit(read_import, row["input_path"],
+                row["method"], row["assembly"])))
+            if len(pending) >= queue_size:
+                i, future = pending.popleft()
+                yield i, _result_or_exception(future)
+        while pending:
+            i, future = pending.popleft()
+            yield i, _result_or_exception(future)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def import_manifest(manifest_df: pd.DataFrame, session: object,
+        commit: str="sample", workers: int=1, queue_size: int=None,
+        replace: bool=False, **kwargs) -> pd.DataFrame:
+    """
+    imports all rows of a manifest using the same session in unit of work mode
+    (enabled if not yet, see util.enable_unit_of_work): Sample and ToolVersion
+    lookups are memoized for the whole batch, rows are grouped by sample (in
+    order of first appearance)
+    commit: "sample" commits after all imports of a sample (one transaction
+        per sample, repeated on deadlocks, see engine.run_transaction),
+        "batch" once at the end; a failing sample is rolled back (with
+        commit="sample") and the batch continues
+    workers: number of processes parsing inputs in parallel, the database is
+        written by the calling process only (see parse_manifest_rows)
+    queue_size: maximum number of parsed inputs waiting to be written
+    replace: delete results of previous imports (see
+        importlog.write_logged_import), otherwise rows whose input files were
+        already imported are skipped without parsing (status "skipped")
+    kwargs: forwarded to write_import (e.g. bulk, chunk_size)
+    returns manifest_df with additional columns "status" and "message"
+    """
+    if commit not in ("sample", "batch"):
+        raise ValueError(f"unknown commit granularity: {commit}")
+    if not session.info.get(UNIT_OF_WORK):
+        enable_unit_of_work(session)
+    manifest_df = manifest_df.copy()
+    manifest_df["status"] = None
+    manifest_df["message"] = None
+
+    # rows whose input files were already imported are not parsed
+    fingerprints = {}
+    for i, row in manifest_df.iterrows():
+        try:
+            fingerprints[i] = input_fingerprint(row["input_path"],
+                    row["method"], row["assembly"])
+        except OSError:
+            # missing input, reported by parsing
+            fingerprints[i] = None
+        if fingerprints[i] and not replace and is_imported(session,
+                _sample_args(row["sample_name"], row["external_id"]),
+                _version_args(row), row["method"], fingerprints[i]):
+            manifest_df.loc[i, "status"] = "skipped"
+    # ends transaction of the lookups (read snapshot)
+    session.rollback()
+
+    # order rows by sample, so parsing runs ahead in the order of writing
+    pending_df = manifest_df[manifest_df["status"].isna()]
+    sample_keys = pd.Series(list(zip(pending_df["sample_name"],
+        pending_df["external_id"])), index=pending_df.index)
+    sample_rows = {key: [] for key in dict.fromkeys(sample_keys)}
+    for i, key in sample_keys.items():
+        sample_rows[key].append(i)
+    parsed = parse_manifest_rows(
+            manifest_df.loc[[i for rows in sample_rows.values() for i in rows]],
+            workers, queue_size)
+
+    for sample_key, indices in sample_rows.items():
+        rows = manifest_df.loc[indices]
+        sample_results = dict(next(parsed) for _ in indices)
+
+        def write_sample(session):
+            for result in sample_results.values():
+                if isinstance(result, Exception):
+                    raise result
+            associated_sample = get_or_create(session, Sample,
+                    **_sample_args(*sample_key))
+            statuses = {}
+            for i, row in rows.iterrows():
+                version = get_or_create(session, ToolVersion,
+                        **_version_args(row))
+                written = write_logged_import(sample_results[i],
+                        associated_sample, session, version, row["method"],
+                        fingerprints[i], input_path=row["input_path"],
+                        replace=replace, **kwargs)
+                statuses[i] = "imported" if written else "skipped"
+            return statuses
+
+        try:
+            if commit == "sample":
+                # rolled back on errors, repeated on deadlocks
+                statuses = run_transaction(session, write_sample)
+            else:
+                # a single write transaction up to the end of the batch
+                begin_write(session)
+                statuses = write_sample(session)
+            for i, status in statuses.items():
+                manifest_df.loc[i, "status"] = status
+        except Exception as e:
+            if commit == "batch":
+                parsed.close()
+                raise
+            manifest_df.loc[rows.index, "status"] = "failed"
+            manifest_df.loc[rows.index, "message"] = repr(e)
+            traceback.print_exception(type(e), e, e.__traceback__)
+    # shuts down the worker processes (instead of on garbage collection)
+    parsed.close()
+
+    session.commit()
+    return manifest_df
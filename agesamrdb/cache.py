@@ -0,0 +1,177 @@
+"""
+on-disk cache of parsed results (see interfaces.read_result): results are
+keyed by method, parser version (io.PARSER_VERSION), read arguments and the
+contents of the input files, so e.g. rebuilding a database from an archive of
+results skips parsing of all inputs parsed before; the cache is enabled by
+environment variable AGESAMRDB_PARSE_CACHE (directory, inherited by worker
+processes), see configure_parse_cache
+"""
+import os
+import json
+import uuid
+import hashlib
+
+import pandas as pd
+
+from .io import PARSER_VERSION, input_files, digest_files
+from .profiling import stage
+
+PARSE_CACHE_ENV = "AGESAMRDB_PARSE_CACHE"
+# maximum size of the cache in MiB
+PARSE_CACHE_SIZE_ENV = "AGESAMRDB_PARSE_CACHE_SIZE"
+PARSE_CACHE_SIZE = 10240
+
+SUFFIX = ".pkl"
+
+
+class ParseCache(object):
+    """
+    parsed results (DataFrames) stored as pickle files in directory; least
+    recently used files are removed if the cache grows beyond max_bytes
+    (checked by scanning the directory after max_bytes / 10 were added since
+    the last scan, files are removed until 90 % of max_bytes are left)
+    pickles are loaded: the directory must only be writable by trusted users
+    """
+
+    def __init__(self, directory: str, max_bytes: int=PARSE_CACHE_SIZE << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.size = self.evict()
+        self.added = 0
+
+    def key(self, inputpath: str, method: str, read_kwargs: dict) -> str:
+        """
+        key of the result of method read from inputpath with read_kwargs
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([method, PARSER_VERSION,
+            sorted(read_kwargs.items())]).encode())
+        digest.update(digest_files(input_files(inputpath, method)).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key: str) -> pd.DataFrame:
+        """
+        cached result (None if not cached), marked as recently used
+        """
+        path = self._path(key)
+        try:
+            df = pd.read_pickle(path)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # incomplete or from an incompatible version of pandas
+            self._remove(path)
+            return None
+        return df
+
+    def put(self, key: str, df: pd.DataFrame):
+        """
+        stores result (written atomically, concurrent writers of the same key
+        store the same result)
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        df.to_pickle(tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        self.size += size
+        self.added += size
+        if self.size > self.max_bytes or self.added > self.max_bytes // 10:
+            self.size = self.evict()
+            self.added = 0
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # removed by another process
+            pass
+
+    def evict(self) -> int:
+        """
+        removes least recently used results beyond max_bytes (down to 90 %)
+        returns size of the cache in bytes
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(e[1] for e in entries)
+        if size <= self.max_bytes:
+            return size
+        entries.sort()
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes * 0.9:
+                break
+            self._remove(path)
+            size -= entry_size
+        return size
+
+    def read(self, inputpath: str, method: str, parse, **read_kwargs):
+        """
+        result of parse(inputpath, method, **read_kwargs), from the cache if
+        the same input files were parsed before
+        """
+        key = self.key(inputpath, method, read_kwargs)
+        with stage("parse_cache:get"):
+            df = self.get(key)
+        if df is not None:
+            return df
+        df = parse(inputpath, method, **read_kwargs)
+        with stage("parse_cache:put"):
+            self.put(key, df)
+        return df
+
+
+_parse_cache = None
+
+
+def get_parse_cache() -> ParseCache:
+    """
+    ParseCache of this process as configured by the environment (see
+    configure_parse_cache), None if caching is disabled
+    """
+    global _parse_cache
+    directory = os.environ.get(PARSE_CACHE_ENV)
+    if not directory:
+        return None
+    max_bytes = int(os.environ.get(PARSE_CACHE_SIZE_ENV, PARSE_CACHE_SIZE)) << 20
+    if _parse_cache is None or (_parse_cache.directory, _parse_cache.max_bytes) \
+            != (directory, max_bytes):
+        _parse_cache = ParseCache(directory, max_bytes)
+    return _parse_cache
+
+
+def configure_parse_cache(directory: str, max_size: int=None):
+    """
+    enables the parse cache in directory (max_size in MiB, default
+    PARSE_CACHE_SIZE) for this process and its worker processes (via the
+    environment); directory None disables it
+    """
+    if directory is None:
+        os.environ.pop(PARSE_CACHE_ENV, None)
+        return None
+    os.environ[PARSE_CACHE_ENV] = os.path.abspath(directory)
+    if max_size is not None:
+        os.environ[PARSE_CACHE_SIZE_ENV] = str(max_size)
+    return get_parse_cache()
+
+
+def parse_cache_from_args(args):
+    """
+    enables the parse cache of the arguments of a script (see
+    cli.add_parse_cache_arguments), if given
+    """
+    if args.parse_cache:
+        return configure_parse_cache(args.parse_cache, args.parse_cache_size)
+    return get_parse_cache()
@@ -0,0 +1,86 @@
+"""
+command line arguments shared by the scripts (only argparse is imported here,
+scripts stay fast to start)
+"""
+
+# arguments of a single import, as used by amrdb_add_results.py and as job of
+# the import service (amrdb_serve.py / amrdb_submit.py)
+IMPORT_JOB_FIELDS = ["input_path", "method", "mode", "tool_version",
+        "db_version", "external_id", "sample_name", "assembly", "bulk",
+        "chunk_size", "replace"]
+
+
+def add_database_arguments(parser):
+    """
+    adds arguments of the database connection (see engine.engine_from_args)
+    """
+    parser.add_argument('-d','--database',dest='database',
+            help="mysql database name or path to sqlite-db [./agres.db]",
+            default="./agres.db")
+    parser.add_argument('-H','--hostname',dest='hostname',
+            help="mysql hostname; if not provided sqlite-db will be used",
+            required=False)
+    parser.add_argument('-u','--user',dest='dbuser', help="mysql database username",
+            required=False)
+    parser.add_argument('-p','--password',dest='mariadbpassword',
+            help="mysql password", required=False)
+
+
+def add_import_arguments(parser):
+    """
+    adds arguments describing a single import (input, sample, tool version)
+    """
+    # input specifications
+    parser.add_argument('-i', '--input_path', dest='input_path',
+            help="path to resfinder output dir or tabular input file", required=True)
+    parser.add_argument('--method', dest='method',
+            help="which tools output should be imported", required=True)
+    parser.add_argument('--mode', dest='mode',
+            help='define which input type was used (fasta/fastq) ' \
+                    + '- only in use for resfinder [fasta]', default='fasta')
+    parser.add_argument('--tool_version', dest='tool_version',
+            help="string to describe the version of the tool used [unknown]",
+            default='unknown')
+    parser.add_argument('--db_version', dest='db_version',
+            help="string to describe database version (optional)", required=False)
+
+    # optional reference to external id or provide a sample_name or both
+    parser.add_argument('--external_id', dest='external_id',
+            help="optional external id for other db", required=False,
+            metavar="INT")
+    parser.add_argument('--sample_name', dest='sample_name',
+            help="optional sample name to be displayed", required=False,
+            metavar="NAME")
+    parser.add_argument('--assembly', dest='assembly',
+            help="imports contig in Fasta-format (dna) to allow visualization",
+            required=False, metavar="FASTA")
+    parser.add_argument('--bulk', dest='bulk', action='store_true',
+            help="write generic results (bakta, isescan, mobtyper, plasmidfinder, "
+            + "phispy, speciesfinder, mlst) in bulk via executemany")
+    parser.add_argument('--chunk_size', dest='chunk_size', type=int,
+            help="rows per executemany in --bulk mode [5000]", default=5000,
+            metavar="INT")
+    parser.add_argument('--replace', dest='replace', action='store_true',
+            help="delete results of a previous import (same sample, tool "
+            + "version and method) instead of skipping identical input files")
+
+
+def add_parse_cache_arguments(parser):
+    """
+    adds arguments of the parse cache (see cache.parse_cache_from_args)
+    """
+    parser.add_argument('--parse_cache', dest='parse_cache', metavar="DIR",
+            help="directory caching parsed results, inputs with the same " \
+            + "contents are not parsed again (e.g. when rebuilding a " \
+            + "database) [$AGESAMRDB_PARSE_CACHE]", required=False)
+    parser.add_argument('--parse_cache_size', dest='parse_cache_size',
+            type=int, help="maximum size of the parse cache in MiB, least " \
+            + "recently used results are removed [10240]", required=False,
+            metavar="INT")
+
+
+def import_job(args):
+    """
+    dict of the import arguments (IMPORT_JOB_FIELDS) of parsed args
+    """
+    return {field: getattr(args, field) for field in IMPORT_JOB_FIELDS}
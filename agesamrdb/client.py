@@ -0,0 +1,92 @@
+"""
+client of the import service (amrdb_serve.py), only uses the standard library
+"""
+import json
+import socket
+from http.client import HTTPConnection
+from urllib.parse import urlsplit
+
+DEFAULT_URL = "http://127.0.0.1:8765"
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """
+    http connection via unix socket
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ServiceError(Exception):
+    pass
+
+
+class ServiceClient(object):
+    """
+    json api of the import service on unix socket socket_path or url
+    """
+
+    def __init__(self, socket_path: str=None, url: str=DEFAULT_URL,
+            timeout: float=None):
+        self.socket_path = socket_path
+        self.url = urlsplit(url)
+        self.timeout = timeout
+
+    def _request(self, method, path, content=None, timeout=None):
+        timeout = timeout or self.timeout
+        if self.socket_path:
+            connection = UnixHTTPConnection(self.socket_path, timeout=timeout)
+        else:
+            connection = HTTPConnection(self.url.hostname, self.url.port,
+                    timeout=timeout)
+        try:
+            body = json.dumps(content) if content is not None else None
+            connection.request(method, path, body=body,
+                    headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            result = json.loads(response.read() or b"{}")
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise ServiceError(result.get("error", response.reason))
+        return result
+
+    def submit(self, job: dict) -> dict:
+        """
+        submits import job (see service.normalize_job), returns its status
+        """
+        return self._request("POST", "/jobs", job)
+
+    def status(self, job_id: int, wait: float=None) -> dict:
+        """
+        status of a job, waits up to wait seconds for the job to finish
+        """
+        path = f"/jobs/{job_id}" + (f"?wait={wait}" if wait else "")
+        return self._request("GET", path,
+                timeout=wait + 30 if wait else None)
+
+    def wait(self, job_id: int, poll: float=60) -> dict:
+        """
+        waits until job is imported, skipped or failed, returns its status
+        """
+        while True:
+            status = self.status(job_id, wait=poll)
+            if status["status"] in ("imported", "skipped", "failed"):
+                return status
+
+    def summary(self) -> dict:
+        return self._request("GET", "/status")
+
+    def reload(self) -> dict:
+        return self._request("POST", "/reload")
+
+    def shutdown(self) -> dict:
+        return self._request("POST", "/shutdown")
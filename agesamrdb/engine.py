@@ -0,0 +1,177 @@
+import time
+import random
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.exc import DBAPIError
+
+from .profiling import stage
+from .reference import clear_reference_indexes
+
+# mysql/mariadb error codes of transactions which can simply be retried
+MYSQL_DEADLOCK = 1213
+MYSQL_LOCK_WAIT_TIMEOUT = 1205
+
+SQLITE_DEFAULTS = {"busy_timeout": 60, "synchronous": "NORMAL",
+        "journal_mode": "WAL"}
+MYSQL_DEFAULTS = {"pool_size": 5, "max_overflow": 10, "pool_recycle": 3600}
+
+# execution option of connections which write (sqlite: transactions take the
+# write lock when they begin), set by run_transaction and write_engine
+WRITE = "agesamrdb_write"
+# execution option of connections which only read (sqlite: transactions never
+# take the write lock, also on a write_engine), e.g.
+# engine.connect().execution_options(**{READ_ONLY: True})
+READ_ONLY = "agesamrdb_read_only"
+
+
+def database_url(database: str, hostname: str=None, user: str=None,
+        password: str=None, port: int=3306) -> URL:
+    """
+    url of a mysql/mariadb database on hostname, or, if no hostname is
+    given, of the sqlite database at path database
+    """
+    if hostname:
+        return URL.create("mysql+mysqlconnector", username=user,
+                password=password, host=hostname, port=port, database=database)
+    return URL.create("sqlite", database=database)
+
+
+def _configure_sqlite(engine, busy_timeout, synchronous, journal_mode):
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        # transactions are started below (pysqlite would only start them
+        # lazily, before the first write)
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        if journal_mode:
+            # readers do not block the writer and vice versa
+            cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+        if synchronous:
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        options = connection.get_execution_options()
+        if options.get(WRITE) and not options.get(READ_ONLY):
+            # take the write lock at the start of a transaction: concurrent
+            # importers wait (up to busy_timeout) instead of failing with
+            # "database is locked" when upgrading a read to a write transaction
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            return
+        # snapshot for readers (e.g. queries, exports), does not block
+        # importers
+        connection.exec_driver_sql("BEGIN")
+
+
+def create_db_engine(url, **kwargs):
+    """
+    engine for url (string or sqlalchemy URL, see database_url) configured for
+    concurrent importers writing to the same database
+    sqlite: WAL journal, write transactions (run_transaction, write_engine)
+        take the write lock when they begin and wait up to busy_timeout
+        seconds for it, all other transactions only read a snapshot until
+        their first write; synchronous=NORMAL (durable with WAL except for
+        the last transactions on power loss)
+    mysql/mariadb: pool of pool_size (+ max_overflow) connections, checked
+        before use and recycled after pool_recycle seconds, isolation level
+        READ COMMITTED (less gap locks, i.e. deadlocks of concurrent inserts)
+    kwargs: overrides of SQLITE_DEFAULTS / MYSQL_DEFAULTS (e.g.
+        busy_timeout=120, journal_mode=None to keep the journal mode) and
+        further arguments of sqlalchemy.create_engine
+    """
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        options = {k: kwargs.pop(k, v) for k, v in SQLITE_DEFAULTS.items()}
+        if not url.database or url.database == ":memory:":
+            options["journal_mode"] = None
+        engine = create_engine(url, **kwargs)
+        _configure_sqlite(engine, **options)
+        return engine
+    if url.get_backend_name() in ("mysql", "mariadb"):
+        options = {k: kwargs.pop(k, v) for k, v in MYSQL_DEFAULTS.items()}
+        kwargs.setdefault("isolation_level", "READ COMMITTED")
+        return create_engine(url, pool_pre_ping=True, **options, **kwargs)
+    return create_engine(url, **kwargs)
+
+
+def engine_from_args(args, **kwargs):
+    """
+    engine of the database arguments of a script (see
+    cli.add_database_arguments)
+    """
+    return create_db_engine(database_url(args.database, args.hostname,
+        args.dbuser, args.mariadbpassword), **kwargs)
+
+
+def write_engine(engine):
+    """
+    engine sharing the connection pool of engine whose transactions take the
+    write lock when they begin (sqlite, see WRITE), for sessions which only
+    write, e.g. of database updates
+    """
+    return engine.execution_options(**{WRITE: True})
+
+
+def begin_write(session):
+    """
+    begins the transaction of session as write transaction (sqlite: takes
+    the write lock, see WRITE); does nothing if a transaction is already in
+    progress
+    """
+    if not session.in_transaction():
+        session.connection(execution_options={WRITE: True})
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    error aborted a transaction which can be retried: deadlock or lock wait
+    timeout (mysql/mariadb), locked database (sqlite)
+    """
+    if not isinstance(error, DBAPIError) or error.orig is None:
+        return False
+    orig = error.orig
+    errno = getattr(orig, "errno", None)
+    if errno is None and orig.args and isinstance(orig.args[0], int):
+        errno = orig.args[0]
+    if errno in (MYSQL_DEADLOCK, MYSQL_LOCK_WAIT_TIMEOUT):
+        return True
+    message = str(orig).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def backoff_delay(attempt: int, backoff: float=0.2, max_delay: float=10.0):
+    """
+    seconds to wait before retry attempt (exponential, with jitter)
+    """
+    return min(backoff * 2 ** attempt, max_delay) * random.uniform(0.5, 1.5)
+
+
+def run_transaction(session, work, retries: int=5, backoff: float=0.2):
+    """
+    runs work(session) in a write transaction (see begin_write) and commits;
+    transactions aborted by a deadlock or a locked database (see
+    is_transient_error) are rolled back and run again (at most retries times,
+    with exponential backoff), other errors are rolled back and raised
+    work has to be repeatable: it must not consume its input (e.g. parse
+    results before, see interfaces.read_import)
+    returns result of work
+    """
+    attempt = 0
+    while True:
+        try:
+            begin_write(session)
+            result = work(session)
+            with stage("commit"):
+                session.commit()
+            return result
+        except Exception as e:
+            session.rollback()
+            # index might contain sequences added in rolled back transaction
+            clear_reference_indexes()
+            if attempt >= retries or not is_transient_error(e):
+                raise
+            time.sleep(backoff_delay(attempt, backoff))
+            attempt += 1
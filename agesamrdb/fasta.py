@@ -0,0 +1,178 @@
+import os
+import mmap
+from collections import OrderedDict
+
+from .profiling import profiled
+
+
+class FastaIndex(object):
+    """
+    random access to sequences of a (large) fasta file, similar to samtools
+    faidx: index (name, length, offset, linebases, linewidth) is read from
+    <fasta>.fai (samtools compatible) or built once and written there if the
+    directory is writable (kept in memory otherwise), regions are fetched
+    from the memory-mapped file; fasta files with irregular line lengths are
+    read sequentially and their sequences are kept in memory instead
+    """
+
+    def __init__(self, fasta_file):
+        self.fasta_file = fasta_file
+        self.sequences = None
+        self.index = self._load_index()
+        self._fh = open(fasta_file, "rb")
+        if os.path.getsize(fasta_file) > 0 and self.sequences is None:
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._mm = b""
+
+    def _load_index(self):
+        fai_file = self.fasta_file + ".fai"
+        if (os.path.exists(fai_file)
+                and os.path.getmtime(fai_file) >= os.path.getmtime(self.fasta_file)):
+            index = {}
+            with open(fai_file) as fh:
+                for line in fh:
+                    name, *values = line.rstrip("\n").split("\t")
+                    index[name] = tuple(int(v) for v in values[:4])
+            return index
+
+        try:
+            index = build_fasta_index(self.fasta_file)
+        except ValueError:
+            # different line lengths: no offsets, sequences are kept in memory
+            self.sequences = dict(read_fasta(self.fasta_file))
+            return {name: (len(sequence), -1, 0, 0)
+                    for name, sequence in self.sequences.items()}
+        directory = os.path.dirname(os.path.abspath(fai_file))
+        if os.access(directory, os.W_OK):
+            _write_fai(fai_file, index)
+        return index
+
+    @property
+    def lengths(self):
+        """
+        dict sequence name -> length
+        """
+        return {name: values[0] for name, values in self.index.items()}
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def fetch(self, name, start=1, end=None):
+        """
+        sequence of region start..end (1-based, inclusive, clipped to the
+        length of the sequence) as str; KeyError if name is not in index
+        """
+        length, offset, linebases, linewidth = self.index[name]
+        start = max(start - 1, 0)
+        end = length if end is None else min(end, length)
+        if end <= start:
+            return ""
+        if self.sequences is not None:
+            return self.sequences[name][start:end]
+        first = offset + (start // linebases) * linewidth + start % linebases
+        last = offset + ((end - 1) // linebases) * linewidth + (end - 1) % linebases
+        data = self._mm[first:last + 1]
+        return data.replace(b"\n", b"").replace(b"\r", b"").decode("ascii")
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._fh.close()
+
+
+def _write_fai(fai_file, index):
+    # written to a temporary file first: concurrent readers never see a
+    # partial index, nothing is left behind if writing fails
+    tmp_file = f"{fai_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "w") as fh:
+            for name, values in index.items():
+                fh.write("\t".join([name] + [str(v) for v in values]) + "\n")
+        os.replace(tmp_file, fai_file)
+    except OSError:
+        # e.g. read-only file system -> index is only kept in memory
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+@profiled("build_fasta_index")
+def build_fasta_index(fasta_file):
+    """
+    scans fasta file once and returns dict name -> (length, offset,
+    linebases, linewidth) as in samtools .fai; sequences need to have
+    equal line lengths (except last line), ValueError otherwise
+    """
+    index = {}
+    name = None
+
+    def finish():
+        if name is not None:
+            index[name] = (length, seq_offset, linebases or 0, linewidth or 0)
+
+    with open(fasta_file, "rb") as fh:
+        offset = 0
+        for line in fh:
+            if line.startswith(b">"):
+                finish()
+                name = line[1:].split()[0].decode() if line[1:].split() else ""
+                seq_offset = offset + len(line)
+                length = 0
+                linebases = linewidth = None
+                last_line_seen = False
+            elif name is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if bases == 0:
+                    last_line_seen = True
+                elif last_line_seen or (linebases is not None and bases > linebases):
+                    raise ValueError(f"different line length in sequence {name}"
+                            + f" of {fasta_file}, random access not possible")
+                else:
+                    if linebases is None:
+                        linebases, linewidth = bases, len(line)
+                    elif bases < linebases:
+                        last_line_seen = True
+                    length += bases
+            offset += len(line)
+        finish()
+    return index
+
+
+# opened indexes of this process, by path and modification time (least
+# recently used are closed beyond FASTA_INDEX_CACHE_SIZE)
+FASTA_INDEX_CACHE_SIZE = 8
+_fasta_indexes = OrderedDict()
+
+
+def get_fasta_index(fasta_file):
+    """
+    returns FastaIndex of fasta_file, opened once per process (as long as the
+    file is not modified), e.g. assembly used for resfinder and amrfinder
+    """
+    key = (os.path.realpath(fasta_file), os.path.getmtime(fasta_file))
+    if key not in _fasta_indexes:
+        _fasta_indexes[key] = FastaIndex(fasta_file)
+        while len(_fasta_indexes) > FASTA_INDEX_CACHE_SIZE:
+            _fasta_indexes.popitem(last=False)[1].close()
+    _fasta_indexes.move_to_end(key)
+    return _fasta_indexes[key]
+
+
+def read_fasta(fasta_file):
+    """
+    generator of (name, sequence) of all records of a (small) fasta file read
+    sequentially, any line lengths
+    """
+    name, lines = None, []
+    with open(fasta_file) as fh:
+        for line in fh:
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(lines)
+                name = line[1:].split()[0] if line[1:].split() else ""
+                lines = []
+            elif name is not None:
+                lines.append(line)
+    if name is not None:
+        yield name, "".join(lines)
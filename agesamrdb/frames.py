@@ -0,0 +1,215 @@
+"""
+bulk read access for analyses across many samples: results of a method are
+read with one sql join per chunk of samples (instead of loading ORM objects)
+into DataFrames with compact dtypes, streamed in chunks of rows
+"""
+import gzip
+from contextlib import contextmanager
+from typing import Iterator
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from .engine import READ_ONLY
+from .models import Sample, ToolVersion, Contig, Phenotype, ResfinderResult, \
+        ResfinderSequence, AmrfinderResult, AmrfinderSequence, \
+        PointfinderResult, AmrfinderPointResult, \
+        resfinder_phenotype_association_table, \
+        amrfinder_phenotype_association_table, \
+        pointfinder_phenotype_association_table, \
+        amrfinder_point_phenotype_association_table
+
+# maximum number of sample ids per IN clause
+ID_CHUNK_SIZE = 500
+# rows per DataFrame when streaming results
+ROW_CHUNK_SIZE = 100000
+
+# dtypes of result columns (other columns are kept as read, e.g. ids)
+CATEGORY_COLUMNS = ["sample_name", "tool_version", "db_version", "gene",
+        "accession", "contig", "orientation", "qc_issues", "method",
+        "mutation", "nuc_change", "phenotype", "class_name"]
+COLUMN_DTYPES = {"external_id": "Int64", "identity": "float32",
+        "coverage": "float32", "ref_pos_start": "Int32", "ref_pos_end": "Int32"}
+
+
+def _hit_columns(model):
+    return [model.identity, model.coverage,
+            Contig.name.label("contig"), model.ref_pos_start, model.ref_pos_end,
+            model.orientation, model.qc_issues]
+
+
+def results_statement(method: str, sample_ids: list=None,
+        tool_version: str=None, db_version: str=None):
+    """
+    select of all results of method (resfinder, amrfinder: acquired genes;
+    pointfinder, amrfinder_point: point mutations) with sample, tool version,
+    contig and phenotypes; one row per result and phenotype (result_id
+    identifies the result), ordered by result
+    """
+    if method in ("resfinder", "amrfinder"):
+        model, sequence_model, association = {
+                "resfinder": (ResfinderResult, ResfinderSequence,
+                    resfinder_phenotype_association_table),
+                "amrfinder": (AmrfinderResult, AmrfinderSequence,
+                    amrfinder_phenotype_association_table)}[method]
+        columns = [sequence_model.name.label("gene"), sequence_model.accession] \
+                + _hit_columns(model)
+        key = association.c.sequence_id
+        joins = [(sequence_model, model.sequence_id == sequence_model.id)]
+        key_target = sequence_model.id
+    elif method == "pointfinder":
+        model, association = PointfinderResult, \
+                pointfinder_phenotype_association_table
+        columns = [model.mutation, model.nuc_change]
+        key = association.c.pointfinder_result_id
+        joins = []
+        key_target = model.id
+    elif method == "amrfinder_point":
+        model, association = AmrfinderPointResult, \
+                amrfinder_point_phenotype_association_table
+        columns = [model.mutation] + _hit_columns(model)
+        key = association.c.amrfinder_point_result_id
+        joins = []
+        key_target = model.id
+    else:
+        raise ValueError(f"unknown method: {method}")
+    if hasattr(model, "method"):
+        columns.append(model.method)
+
+    statement = select(model.id.label("result_id"),
+            Sample.id.label("sample_id"), Sample.name.label("sample_name"),
+            Sample.external_id, ToolVersion.tool_version,
+            ToolVersion.db_version, *columns, Phenotype.phenotype,
+            Phenotype.class_name)\
+        .select_from(model)\
+        .join(Sample, model.sample_id == Sample.id)\
+        .join(ToolVersion, model.version_id == ToolVersion.id)
+    for target, condition in joins:
+        statement = statement.join(target, condition)
+    if hasattr(model, "contig_id"):
+        statement = statement.outerjoin(Contig, model.contig_id == Contig.id)
+    statement = statement.outerjoin(association, key == key_target)\
+        .outerjoin(Phenotype, association.c.phenotype_id == Phenotype.id)
+
+    if sample_ids is not None:
+        statement = statement.where(model.sample_id.in_(sample_ids))
+    if tool_version is not None:
+        statement = statement.where(ToolVersion.tool_version == tool_version)
+    if db_version is not None:
+        statement = statement.where(ToolVersion.db_version == db_version)
+    return statement.order_by(model.id)
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    converts result columns to compact dtypes (see CATEGORY_COLUMNS and
+    COLUMN_DTYPES)
+    """
+    dtypes = {c: "category" for c in CATEGORY_COLUMNS if c in df.columns}
+    dtypes.update({c: t for c, t in COLUMN_DTYPES.items() if c in df.columns})
+    return df.astype(dtypes)
+
+
+def concat_frames(frames: list) -> pd.DataFrame:
+    """
+    concatenates DataFrames of compact_dtypes, categories are merged (instead
+    of falling back to strings)
+    """
+    if not frames:
+        return pd.DataFrame()
+    columns = frames[0].columns
+    categories = [c for c in columns
+            if isinstance(frames[0][c].dtype, pd.CategoricalDtype)]
+    df = pd.concat([f.drop(columns=categories) for f in frames],
+            ignore_index=True)
+    for c in categories:
+        df[c] = union_categoricals([f[c] for f in frames])
+    return df[columns]
+
+
+@contextmanager
+def read_connection(bind):
+    """
+    connection of bind (engine or connection); new connections only read (see
+    engine.READ_ONLY), i.e. do not block importers on sqlite
+    """
+    if isinstance(bind, Engine):
+        with bind.connect() as connection:
+            yield connection.execution_options(**{READ_ONLY: True})
+    else:
+        yield bind
+
+
+def _read_frames(connection, statement, chunk_size):
+    # streamed from server side cursors on mysql/mariadb
+    statement = statement.execution_options(stream_results=True)
+    for df in pd.read_sql(statement, connection, chunksize=chunk_size):
+        # pandas yields an empty frame if there are no results
+        if len(df):
+            yield compact_dtypes(df)
+
+
+def _empty_frame(connection, method):
+    return compact_dtypes(pd.read_sql(results_statement(method).limit(0),
+        connection))
+
+
+def iter_results_frames(bind, method: str, sample_ids: list=None,
+        tool_version: str=None, db_version: str=None,
+        chunk_size: int=ROW_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    generator of DataFrames (at most chunk_size rows each, compact dtypes) of
+    all results of method (see results_statement) of sample_ids (default:
+    all samples) and tool_version / db_version (default: all versions)
+    bind: engine or connection
+    """
+    if sample_ids is None:
+        id_chunks = [None]
+    else:
+        sample_ids = list(dict.fromkeys(sample_ids))
+        id_chunks = [sample_ids[i:i+ID_CHUNK_SIZE]
+                for i in range(0, len(sample_ids), ID_CHUNK_SIZE)]
+    with read_connection(bind) as connection:
+        for ids in id_chunks:
+            yield from _read_frames(connection, results_statement(method,
+                ids, tool_version, db_version), chunk_size)
+
+
+def results_frame(bind, method: str, sample_ids: list=None,
+        tool_version: str=None, db_version: str=None,
+        chunk_size: int=ROW_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    DataFrame of all results of method, see iter_results_frames; strings are
+    categoricals (gene and contig names, phenotypes, ...)
+    """
+    frames = list(iter_results_frames(bind, method, sample_ids, tool_version,
+        db_version, chunk_size))
+    if not frames:
+        with read_connection(bind) as connection:
+            return _empty_frame(connection, method)
+    return concat_frames(frames)
+
+
+def export_results(bind, path: str, method: str, sample_ids: list=None,
+        tool_version: str=None, db_version: str=None,
+        chunk_size: int=ROW_CHUNK_SIZE) -> int:
+    """
+    writes all results of method (see iter_results_frames) as tab-separated
+    file with header (gzip compressed if path ends with .gz) chunk by chunk,
+    the results are not held in memory
+    returns number of written rows
+    """
+    rows = 0
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", newline="") as fh:
+        for df in iter_results_frames(bind, method, sample_ids, tool_version,
+                db_version, chunk_size):
+            df.to_csv(fh, sep="\t", index=False, header=(rows == 0))
+            rows += len(df)
+        if rows == 0:
+            with read_connection(bind) as connection:
+                _empty_frame(connection, method).to_csv(fh, sep="\t",
+                        index=False)
+    return rows
@@ -0,0 +1,157 @@
+from sqlalchemy import select, delete, insert
+from sqlalchemy.exc import IntegrityError
+
+from .models import Sample, ToolVersion, Contig, ImportLog, ResfinderResult, \
+        PointfinderResult, AmrfinderResult, AmrfinderPointResult, BaktaResult, \
+        ISEScanResult, MobTyperResult, PlasmidfinderResult, PhispyResults, \
+        SpeciesfinderResult, MlstResult, pointfinder_phenotype_association_table, \
+        amrfinder_point_phenotype_association_table
+from .interfaces import write_import
+from .io import input_files, digest_files
+from .profiling import profiled
+
+# result tables written by an import of method (resfinder includes
+# pointfinder results of the same output directory)
+METHOD_RESULT_MODELS = {
+        "resfinder": [ResfinderResult, PointfinderResult],
+        "pointfinder": [PointfinderResult],
+        "amrfinder": [AmrfinderResult, AmrfinderPointResult],
+        "bakta": [BaktaResult],
+        "isescan": [ISEScanResult],
+        "mobtyper": [MobTyperResult],
+        "plasmidfinder": [PlasmidfinderResult],
+        "phispy": [PhispyResults],
+        "speciesfinder": [SpeciesfinderResult],
+        "mlst": [MlstResult],
+}
+
+# association tables (and their foreign key) referencing result tables
+RESULT_ASSOCIATIONS = {
+        PointfinderResult: (pointfinder_phenotype_association_table,
+            "pointfinder_result_id"),
+        AmrfinderPointResult: (amrfinder_point_phenotype_association_table,
+            "amrfinder_point_result_id"),
+}
+
+
+@profiled("input_fingerprint")
+def input_fingerprint(inputpath: str, method: str, assembly_path: str=None,
+        chunk_size: int=1 << 20) -> str:
+    """
+    digest (32 hex characters, see io.digest_files) of the contents of all
+    files read by an import (see io.input_files) and of the assembly;
+    independent of the location of the files
+    """
+    paths = input_files(inputpath, method)
+    if assembly_path:
+        paths.append(assembly_path)
+    return digest_files(paths, chunk_size)
+
+
+def find_import(session, associated_sample, version_associated, method: str,
+        fingerprint: str):
+    """
+    ImportLog entry of an import of the same input files (None if not yet
+    imported)
+    """
+    if associated_sample.id is None or version_associated.id is None:
+        return None
+    return session.execute(select(ImportLog).where(
+        ImportLog.sample_id == associated_sample.id,
+        ImportLog.version_id == version_associated.id,
+        ImportLog.method == method,
+        ImportLog.input_fingerprint == fingerprint)).scalars().first()
+
+
+def is_imported(session, sample_args: dict, version_args: dict, method: str,
+        fingerprint: str) -> bool:
+    """
+    input files were imported for sample and tool version (as used by
+    get_or_create), checked before parsing: nothing is created
+    """
+    if all(v is None for v in sample_args.values()):
+        # a new blank sample is created by every import
+        return False
+    associated_sample = session.query(Sample).filter_by(**sample_args).first()
+    version = session.query(ToolVersion).filter_by(**version_args).first()
+    if associated_sample is None or version is None:
+        return False
+    return find_import(session, associated_sample, version, method,
+            fingerprint) is not None
+
+
+@profiled("delete_import", arg="method")
+def delete_import(session, associated_sample, version_associated,
+        method: str) -> int:
+    """
+    deletes all results of method (see METHOD_RESULT_MODELS) of sample and
+    tool version and their ImportLog entries in bulk (contigs are kept)
+    returns number of deleted results
+    """
+    deleted = 0
+    for model in METHOD_RESULT_MODELS[method]:
+        if hasattr(model, "sample_id"):
+            of_sample = model.sample_id == associated_sample.id
+        else:
+            of_sample = model.contig_id.in_(select(Contig.id)
+                    .where(Contig.sample_id == associated_sample.id))
+        condition = (model.version_id == version_associated.id) & of_sample
+        if model in RESULT_ASSOCIATIONS:
+            table, column = RESULT_ASSOCIATIONS[model]
+            session.execute(delete(table).where(
+                table.c[column].in_(select(model.id).where(condition))))
+        result = session.execute(delete(model).where(condition),
+                execution_options={"synchronize_session": False})
+        deleted += max(result.rowcount, 0)
+    session.execute(delete(ImportLog).where(
+        ImportLog.sample_id == associated_sample.id,
+        ImportLog.version_id == version_associated.id,
+        ImportLog.method == method))
+    return deleted
+
+
+def _claim_import(session, associated_sample, version_associated, method: str,
+        fingerprint: str, input_path: str=None) -> bool:
+    """
+    inserts the ImportLog entry of an import in a savepoint, False if a
+    concurrent importer wrote the same input files (unique index
+    ix_import_log_sample_version_method_input) in the meantime
+    """
+    try:
+        with session.begin_nested():
+            session.execute(insert(ImportLog).values(
+                sample_id=associated_sample.id,
+                version_id=version_associated.id, method=method,
+                input_fingerprint=fingerprint, input_path=input_path))
+    except IntegrityError:
+        return False
+    return True
+
+
+def write_logged_import(results: list, associated_sample: Sample,
+        session: object, version_associated: object, method: str,
+        fingerprint: str, input_path: str=None, replace: bool=False,
+        **kwargs) -> bool:
+    """
+    write_import recorded in the import log: an import of the same input files
+    (fingerprint, see input_fingerprint) for sample, tool version and method
+    is skipped; replace: results of a previous import of sample, tool version
+    and method are deleted first (in the same transaction)
+    the ImportLog entry is written before the results, an import of the same
+    input files by a concurrent importer is skipped instead of failing
+    kwargs: forwarded to write_import (e.g. bulk, chunk_size)
+    returns False if the import was skipped
+    """
+    session.flush()
+    if replace:
+        delete_import(session, associated_sample, version_associated, method)
+    elif find_import(session, associated_sample, version_associated, method,
+            fingerprint) is not None:
+        return False
+    if not _claim_import(session, associated_sample, version_associated,
+            method, fingerprint, input_path):
+        return False
+    write_import(results, associated_sample, session, version_associated,
+            **kwargs)
+    session.flush()
+    return True
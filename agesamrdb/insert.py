@@ -1,38 +1,134 @@
+import warnings
+
 import numpy as np
-from Bio import SeqIO
+import pandas as pd
 
-from .util import get_or_create
+from .util import get_or_create, commit_or_flush, insert_many_or_ignore
+from .reference import get_reference_index
+from .fasta import get_fasta_index
+from .profiling import profiled
 from .models import ResfinderSequence, Contig, ResfinderResult, \
         PointfinderResult, SpeciesfinderResult, Phenotype, \
         AmrfinderSequence, AmrfinderPointResult, AmrfinderResult
+from sqlalchemy import insert, inspect, select, update
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import selectinload
+
+# number of rows sent per executemany in bulk mode
+BULK_CHUNK_SIZE = 5000
+# number of values per IN (...) lookup (sqlite limits bound parameters)
+IN_CLAUSE_CHUNK_SIZE = 500
+
+
+def _resolve_foreign_keys(model, kwargs):
+    """
+    translates relationship kwargs (e.g. version_associated=ToolVersion-object)
+    into plain foreign key values (e.g. version_id) usable for core inserts,
+    all other kwargs are passed through unchanged
+    """
+    relationships = inspect(model).relationships
+    values = {}
+    for key, value in kwargs.items():
+        if key in relationships:
+            for local, remote in relationships[key].local_remote_pairs:
+                values[local.key] = getattr(value, remote.key) \
+                        if value is not None else None
+        else:
+            values[key] = value
+    return values
+
 
+def _bulk_insert(session, model, records, chunk_size=BULK_CHUNK_SIZE):
+    """
+    write list of plain parameter dicts with core insert (executemany),
+    chunk_size rows at a time
+    """
+    for start in range(0, len(records), chunk_size):
+        session.execute(insert(model.__table__), records[start:start+chunk_size])
 
-def _get_linked_sequence_and_contig(row, associated_sample, session, method, contig_kwargs=None):
+
+def _contig_lengths(df, contig_name_col="contig_name", contig_len_col="contig_len"):
+    """
+    dict contig name -> length (None if unknown) of all contigs in df
+    """
+    if contig_name_col not in df.columns:
+        return {}
+    df = df[df[contig_name_col].notna()]
+    if contig_len_col not in df.columns:
+        return dict.fromkeys(df[contig_name_col])
+    return {name: (None if length is None or length != length else int(length))
+            for name, length in zip(df[contig_name_col], df[contig_len_col])}
+
+
+def _select_contigs(session, sample_id, names, for_update=False):
+    """
+    existing (id, name, length) of contigs of a sample, by id
+    for_update: locking read, sees contigs committed by concurrent importers
+    (mysql/mariadb, ignored by sqlite)
+    """
+    rows = []
+    for start in range(0, len(names), IN_CLAUSE_CHUNK_SIZE):
+        statement = select(Contig.id, Contig.name, Contig.length).where(
+                Contig.sample_id == sample_id,
+                Contig.name.in_(names[start:start+IN_CLAUSE_CHUNK_SIZE]))
+        if for_update:
+            statement = statement.with_for_update()
+        rows.extend(session.execute(statement))
+    return sorted(rows)
+
+
+@profiled("resolve_contigs")
+def resolve_contigs(session, associated_sample, contigs, create=True):
+    """
+    resolves all contigs of a sample needed by an import at once:
+    existing contigs are fetched by name (IN-query), missing ones are bulk
+    inserted if create is set (contigs inserted by a concurrent importer in
+    the meantime are skipped, see util.insert_many_or_ignore), known lengths
+    are added to existing contigs without length
+    contigs: dict contig name -> length (or None)
+    returns dict contig name -> contig id (missing contigs are not contained
+    if create is not set)
+    """
+    session.flush()
+    names = [name for name in contigs if name]
+    contig_ids = {}
+    add_length = []
+    for contig_id, name, length in _select_contigs(session, associated_sample.id, names):
+        if name in contig_ids:
+            continue # duplicate contig name -> use first entry
+        contig_ids[name] = contig_id
+        if length is None and contigs[name] is not None:
+            add_length.append({"id": contig_id, "length": contigs[name]})
+    if add_length:
+        session.execute(update(Contig), add_length)
+
+    missing = [name for name in names if name not in contig_ids]
+    if create and missing:
+        records = [{"sample_id": associated_sample.id, "name": name,
+            "length": contigs[name]} for name in missing]
+        for start in range(0, len(records), BULK_CHUNK_SIZE):
+            insert_many_or_ignore(session, Contig,
+                    records[start:start+BULK_CHUNK_SIZE])
+        for contig_id, name, length in _select_contigs(session,
+                associated_sample.id, missing, for_update=True):
+            contig_ids.setdefault(name, contig_id)
+    return contig_ids
+
+
+def _get_linked_sequence(row, session, method):
     if method == "resfinder":
         sequence_model = ResfinderSequence
     elif method == "amrfinder":
         sequence_model = AmrfinderSequence
-    if contig_kwargs:
-        associated_contig = get_or_create(session, Contig, 
-                sample_associated=associated_sample, **contig_kwargs)
-    else:
-        associated_contig = None
-    sequence = session.query(sequence_model).filter_by(accession=row["accession"])
-    if sequence.count() > 1:
-        exact_matches = sequence.filter_by(crc32_hash=row["crc32_hash"])
-        if exact_matches.count() != 1:
-            # no perfect match -> use first with accession (original entry)
-            sequence = sequence.first()
-        else:
-            sequence = exact_matches.first()
-    else:
-        sequence = sequence.first()
-    if not sequence:
+    # multiples per accession are handled by seq_fingerprint, if there is no
+    # perfect match -> use first with accession (original entry)
+    sequence_id = get_reference_index(session, sequence_model).get(
+            row["accession"], row["seq_fingerprint"])
+    if sequence_id is None:
         raise NoResultFound("ERROR: missing accession in database: "
                             + f"{row['accession']}") # update database?
 
-    return associated_contig, sequence
+    return sequence_id
 
 
 def insert_into_resfinder_results(df, associated_sample, session, **kwargs):
@@ -40,26 +136,25 @@ def insert_into_resfinder_results(df, associated_sample, session, **kwargs):
     write results to database:
     creates sample and contigs on the fly or retrieves existing
     sequence link is established via accession -> multiples are handled by 
-    crc32_hash (of sequence itself) if sample feature is not used, only a
+    seq_fingerprint (of sequence itself) if sample feature is not used, only a
     single sample with no name is ever created
     """
     df = df.replace([np.nan], [None])
+    contig_ids = resolve_contigs(session, associated_sample, _contig_lengths(df))
     added_results = []
     for i, row in df.iterrows():
-        contig_kwargs = {}
         if row.get("contig_name"):
-            contig_kwargs["name"] = row["contig_name"]
-            contig_kwargs["length"] = row["contig_len"]
+            contig_id = contig_ids[row["contig_name"]]
         else:
+            contig_id = None
             row["orientation"] = None
 
-        associated_contig, sequence = _get_linked_sequence_and_contig(row,
-                associated_sample, session, "resfinder", contig_kwargs)
+        sequence_id = _get_linked_sequence(row, session, "resfinder")
 
         row = row[["identity","coverage","ref_pos_start","ref_pos_end",
             "qc_issues","orientation"]]
-        added_results.append(ResfinderResult(stored_sequence=sequence,
-            contig_associated=associated_contig,
+        added_results.append(ResfinderResult(sequence_id=sequence_id,
+            contig_id=contig_id,
             sample_associated=associated_sample, **row, **kwargs))
     session.add_all(added_results)
 
@@ -68,20 +163,16 @@ def insert_into_amrfinder_results(df, associated_sample, session, **kwargs):
     
     # replace nan with None, sqlalchemy does not handle np.nan!
     df = df.replace([np.nan], [None])
+    # identify linked contigs (might create new contigs)
+    contig_ids = resolve_contigs(session, associated_sample, _contig_lengths(df))
     added_results = []
     for i, row in df.iterrows():
-        contig_kwargs = {"name": row["contig_name"]}
-        if row["contig_len"]:
-            contig_kwargs["length"] = row["contig_len"]
+        contig_id = contig_ids[row["contig_name"]]
 
-        # identify linked contig and sequence (might create new contig)
+        # identify linked sequence
         point_result = ("point" in row["method"].lower())
-        if point_result:
-            associated_contig = get_or_create(session, Contig,
-                    sample_associated=associated_sample, **contig_kwargs)
-        else:
-            associated_contig, sequence = _get_linked_sequence_and_contig(row,
-                    associated_sample, session, "amrfinder", contig_kwargs)
+        if not point_result:
+            sequence_id = _get_linked_sequence(row, session, "amrfinder")
 
         # specific fields not needed in both tables
         phenotype = row["Phenotype"].title()
@@ -96,56 +187,85 @@ def insert_into_amrfinder_results(df, associated_sample, session, **kwargs):
             phenotypes = [get_or_create(session, Phenotype,
                 phenotype=p.strip().title()) for p in phenotype.split("/")]
             result = AmrfinderPointResult(phenotypes=phenotypes,
-                    contig_associated=associated_contig,
+                    contig_id=contig_id,
                     sample_associated=associated_sample,
                     mutation=mutation, **row, **kwargs)
         else:
-            result = AmrfinderResult(stored_sequence=sequence,
-                contig_associated=associated_contig,
+            result = AmrfinderResult(sequence_id=sequence_id,
+                contig_id=contig_id,
                 sample_associated=associated_sample, **row, **kwargs)
         added_results.append(result)
 
     session.add_all(added_results)
 
 
-def add_contig_info(df, assembly_file, infere_orientation=True):
-    """
-    if applicable, parses assembly and reads orientation of detected gene
-    together with total length of contig (for displaying purposes)
-    """
-    contig_names = df["contig_name"].unique()
-    contigs = {}
-    contig_lens = {}
-    for record in SeqIO.parse(assembly_file, "fasta"):
-        if record.id in contig_names:
-            contigs[record.id] = record
-            contig_lens[record.id] = len(record)
-
-    df["contig_len"] = df["contig_name"].map(contig_lens)
-
-    if not infere_orientation:
-        print(df)
-        return df
-
-    # infere orientation of hits on contig (not provided by resfinder atm)
-    ori = {}
-    for contig_name, sub in df.groupby("contig_name"):
-        for i, row in sub.iterrows():
-            seq = contigs[contig_name][row["ref_pos_start"]-1:row["ref_pos_end"]].seq.replace("-","")
-            sequence = row["sequence"].replace("-","")
-            if str(seq) == sequence:
-                ori[i] = "+"
-            elif str(seq.reverse_complement()) == sequence:
-                ori[i] = "-"
-            else:
-                # should never occur
-                ori[i] = np.nan
-                print([i, "mismatch", seq, seq.reverse_complement(), sequence])
-
-    df["orientation"] = ori
+# complement of nucleotides incl. ambiguity codes, for str.translate
+COMPLEMENT_TABLE = str.maketrans("ACGTURYKMSWBDHVNacgturykmswbdhvn",
+        "TGCAAYRMKSWVHDBNtgcaayrmkswvhdbn")
+
+
+@profiled("infer_orientation")
+def infer_orientation(df, assembly):
+    """
+    orientation of hits (contig_name, ref_pos_start, ref_pos_end, sequence)
+    on contigs of assembly (FastaIndex): regions are read per hit and compared
+    with the hit sequence and its reverse complement in one pass
+    returns orientation as Series ("+", "-" or NaN, index of df) and a
+    diagnostics DataFrame of hits matching in neither orientation
+    """
+    regions = pd.Series([assembly.fetch(contig_name, start, end)
+            for contig_name, start, end in zip(df["contig_name"],
+                df["ref_pos_start"], df["ref_pos_end"])],
+            index=df.index, dtype=object).str.replace("-", "", regex=False)
+    sequences = df["sequence"].str.replace("-", "", regex=False)
+    reverse_complements = pd.Series([region.translate(COMPLEMENT_TABLE)[::-1]
+        for region in regions], index=df.index, dtype=object)
+
+    orientation = pd.Series(np.where(regions == sequences, "+",
+        np.where(reverse_complements == sequences, "-", None)),
+        index=df.index).replace([None], [np.nan])
+
+    mismatch = orientation.isna()
+    diagnostics = pd.DataFrame({
+        "contig_name": df.loc[mismatch, "contig_name"],
+        "ref_pos_start": df.loc[mismatch, "ref_pos_start"],
+        "ref_pos_end": df.loc[mismatch, "ref_pos_end"],
+        "contig_sequence": regions[mismatch],
+        "hit_sequence": sequences[mismatch],
+    })
+    return orientation, diagnostics
+
+
+@profiled("add_contig_info")
+def add_contig_info(df, assembly_file, infere_orientation=True,
+        return_diagnostics=False):
+    """
+    if applicable, reads orientation of detected gene together with total
+    length of contig (for displaying purposes) from assembly; lengths are
+    taken from the fasta index of the assembly (.fai, built once) and only
+    the regions of the hits are read
+    return_diagnostics: additionally return hits which do not match the
+        assembly (see infer_orientation), otherwise only their number is
+        reported as warning
+    """
+    assembly = get_fasta_index(assembly_file)
+    df["contig_len"] = df["contig_name"].map(assembly.lengths)
+    diagnostics = None
+
+    if infere_orientation:
+        # infere orientation of hits on contig (not provided by resfinder atm)
+        df["orientation"], diagnostics = infer_orientation(df, assembly)
+        # should never occur
+        if not diagnostics.empty and not return_diagnostics:
+            warnings.warn(f"{len(diagnostics)} hits do not match "
+                    + f"assembly {assembly_file}, orientation unknown")
+
+    if return_diagnostics:
+        return df, diagnostics
     return df
 
 
+@profiled("add_new_sequences")
 def add_new_sequences(df, session, tool_model, add_model_fields=[]):
     """
     in case the sequence is very similar to known genes and was detected
@@ -159,29 +279,33 @@ def add_new_sequences(df, session, tool_model, add_model_fields=[]):
     be kept also for our added sequences (phenotype association made over acn)
     tool_model: may be ResfinderSequence or AmrfinderSequence
     """
-    DEFAULT_MODEL_FIELDS = ["sequence","crc32_hash","accession"]
-    add_model_fields.extend(DEFAULT_MODEL_FIELDS)
+    DEFAULT_MODEL_FIELDS = ["sequence","crc32_hash","seq_fingerprint","accession"]
+    # do not extend add_model_fields in place (shared default between calls)
+    model_fields = add_model_fields + DEFAULT_MODEL_FIELDS
     not_identical = (df["identity"] < 100) | (df["coverage"] != float(100))
     # qc-criteria: no frameshift, start & stopcodon present
     no_issues = (df["qc_issues"].isna())
     above_threshold = (df["identity"] >= 95) & (df["coverage"] > 95)
 
+    reference_index = get_reference_index(session, tool_model)
     for i, row in df[not_identical & no_issues & above_threshold].iterrows():
-        entry = session.query(tool_model).filter_by(crc32_hash=row["crc32_hash"])
-        if entry.count() > 1: # deal with collisions
-            entry = entry.filter_by(sequence=row["sequence"]).first()
-        else:
-            entry = entry.first()
-        if not entry:
+        if not reference_index.is_stored(session, row["seq_fingerprint"]):
             #derive phenotypes from best hit accession - important: Display Warning in UI!
-            phenotype_list = session.query(tool_model).filter_by(
-                    accession=row["accession"]).first().phenotypes
-            session.add(tool_model(
+            # loaded explicitly (relationships may be configured to raise)
+            phenotype_list = session.get(tool_model, reference_index.get(
+                    row["accession"], None),
+                    options=[selectinload(tool_model.phenotypes)],
+                    populate_existing=True).phenotypes
+            new_sequence = tool_model(
                 name=(row["Resistance gene"] + "_AGES_"+row["crc32_hash"]),
                 internal_numbering="AGES_"+row["crc32_hash"],
-                phenotypes=phenotype_list, **row[add_model_fields]))
+                phenotypes=phenotype_list, **row[model_fields])
+            session.add(new_sequence)
+            session.flush()
+            reference_index.add(new_sequence.accession,
+                    new_sequence.seq_fingerprint, new_sequence.id)
 
-    session.commit()
+    commit_or_flush(session)
 
 
 def insert_into_pointfinder_results(df, associated_sample, session, **kwargs):
@@ -196,47 +320,58 @@ def insert_into_pointfinder_results(df, associated_sample, session, **kwargs):
             del row["phenotype"]
             session.add(PointfinderResult(**row, sample_associated=associated_sample,
                 phenotypes=phenotypes, **kwargs))
-    session.commit()
+    commit_or_flush(session)
     
 
 def insert_generic_sample_results(df, associated_sample, session, model,
-        to_db_columns=None, **kwargs):
+        to_db_columns=None, bulk=False, chunk_size=BULK_CHUNK_SIZE, **kwargs):
     """
     write results to database, generic function
     takes a model class as parameter and to_db_columns (optional). model
     needs only associated sample, which needs to exist before (sample object)
     if no to_db columns are specified, all are taken
+    bulk: skip orm objects and write rows via core insert in chunks of
+        chunk_size rows
     """
     df = df.replace([np.nan], [None])
     if to_db_columns:
         df = df[to_db_columns]
-    for i, row in df.iterrows():
-        session.add(model(**row, sample_associated=associated_sample, **kwargs))
-    session.commit()
+    if bulk:
+        session.flush()
+        fk_values = _resolve_foreign_keys(model, kwargs)
+        records = [dict(row, sample_id=associated_sample.id, **fk_values)
+                for row in df.to_dict("records")]
+        _bulk_insert(session, model, records, chunk_size)
+    else:
+        for i, row in df.iterrows():
+            session.add(model(**row, sample_associated=associated_sample, **kwargs))
+    commit_or_flush(session)
 
 
 def insert_generic_contig_results(df, associated_sample, session, model,
-        to_db_columns, contig_name_col="seqID", create_contig=False, **kwargs):
+        to_db_columns, contig_name_col="seqID", create_contig=False,
+        bulk=False, chunk_size=BULK_CHUNK_SIZE, **kwargs):
     """
     write results to database, generic function,
     takes a model class as parameter and to_db_columns. model needs to have an
     associated_contig; contigs are not created, entries refering to 
     non-existing contigs will be dropped
+    bulk: rows are written via core insert in chunks of chunk_size rows
+        instead of orm objects
     """
     df = df.replace([np.nan], [None])
-    for contig_name, sub_df in df.groupby(contig_name_col):
-        associated_contig = session.query(Contig).filter_by(
-                sample_associated=associated_sample, name=contig_name).first()
-        if not associated_contig:
-            if create_contig:
-                associated_contig = get_or_create(session, Contig, name=contig_name, 
-                    sample_associated=associated_sample)
-            else:
-                continue
-
-        for i, row in sub_df.iterrows():
-            row = row[to_db_columns]
-            session.add(model(contig_associated=associated_contig, **row, **kwargs))
-
-    session.commit()
+    contig_ids = resolve_contigs(session, associated_sample,
+            _contig_lengths(df, contig_name_col, None), create=create_contig)
+    df = df[df[contig_name_col].isin(contig_ids.keys())]
+    contig_id_column = df[contig_name_col].map(contig_ids).tolist()
+
+    if bulk:
+        fk_values = _resolve_foreign_keys(model, kwargs)
+        records = [dict(row, contig_id=contig_id, **fk_values) for row, contig_id
+                in zip(df[to_db_columns].to_dict("records"), contig_id_column)]
+        _bulk_insert(session, model, records, chunk_size)
+    else:
+        for (i, row), contig_id in zip(df[to_db_columns].iterrows(), contig_id_column):
+            session.add(model(contig_id=contig_id, **row, **kwargs))
 
+    commit_or_flush(session)
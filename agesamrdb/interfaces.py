@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 from .models import Sample, ISEScanResult, BaktaResult, MobTyperResult, \
         PlasmidfinderResult, PhispyResults, ResfinderSequence, AmrfinderSequence, \
@@ -8,7 +9,11 @@ from .io import read_isescan_results, read_bakta_results, read_resfinder_results
         read_mlst_results
 from .insert import insert_generic_contig_results, insert_into_resfinder_results, \
         insert_into_pointfinder_results, add_new_sequences, add_contig_info, \
-        insert_generic_sample_results, insert_into_amrfinder_results \
+        insert_generic_sample_results, insert_into_amrfinder_results, \
+        BULK_CHUNK_SIZE
+from .profiling import profiled, stage
+from .cache import get_parse_cache
+from .summary import refresh_sample_phenotypes, METHOD_TOOLS
 
 
 # column names that are actually imported in database as constants
@@ -36,7 +41,19 @@ PHISPY_DB_COLUMNS = ['prophage_number', 'start' ,'stop', 'start_attL',
         'end_attL', 'start_attR', 'end_attR', 'sequence_attL', 'sequence_attR', 
         'description']        
 
+@profiled("read_result", arg="method")
 def read_result(inputpath: str, method: str, **kwargs) -> pd.DataFrame:
+    """
+    parse_result, taken from the parse cache if enabled (see
+    cache.get_parse_cache) and the same input files were parsed before
+    """
+    cache = get_parse_cache()
+    if cache is None:
+        return parse_result(inputpath, method, **kwargs)
+    return cache.read(inputpath, method, parse_result, **kwargs)
+
+
+def parse_result(inputpath: str, method: str, **kwargs) -> pd.DataFrame:
     """
     interface function that can be universally used to read data into
     a pandas dataframe that contains columns which will be written to database
@@ -70,8 +87,10 @@ def read_result(inputpath: str, method: str, **kwargs) -> pd.DataFrame:
         raise LookupError(f"Method not implemented: {method}")
 
 
+@profiled("insert_into_db", arg="method")
 def insert_into_db(df: pd.DataFrame, method: str, associated_sample: Sample, 
-        session: object, assembly_path: str=None, **kwargs) -> None:
+        session: object, assembly_path: str=None, bulk: bool=False,
+        chunk_size: int=BULK_CHUNK_SIZE, **kwargs) -> None:
     """
     interface function to import data of generic pandas.DataFrame format to db
     params:
@@ -80,40 +99,129 @@ def insert_into_db(df: pd.DataFrame, method: str, associated_sample: Sample,
     associated_sample: sqlalchemy instance of class Sample
     session: sqlalchemy session object
     assembly_path: for resfinder to parse assembly and create contig entries
+    bulk: write generic results (bakta, isescan, mobtyper, plasmidfinder,
+        phispy, speciesfinder, mlst) via core insert instead of orm objects
+    chunk_size: number of rows per executemany in bulk mode
+    resfinder, pointfinder and amrfinder results update the sample_phenotype
+    entries of the sample (see summary.refresh_sample_phenotypes)
     """
+    bulk_kwargs = {"bulk": bulk, "chunk_size": chunk_size}
     if method == "isescan":
         return insert_generic_contig_results(df, associated_sample, session, 
-                to_db_columns=ISESCAN_DB_COLUMNS, model=ISEScanResult, **kwargs)
+                to_db_columns=ISESCAN_DB_COLUMNS, model=ISEScanResult,
+                **bulk_kwargs, **kwargs)
     elif method == "bakta":
         return insert_generic_contig_results(df, associated_sample, session,
-                to_db_columns=BAKTA_DB_COLUMNS, model=BaktaResult, **kwargs)
+                to_db_columns=BAKTA_DB_COLUMNS, model=BaktaResult,
+                **bulk_kwargs, **kwargs)
     elif method == "resfinder":
         add_new_sequences(df, session, ResfinderSequence)
         if assembly_path:
             df = add_contig_info(df, assembly_path)
-        return insert_into_resfinder_results(df, associated_sample, session, **kwargs)
+        result = insert_into_resfinder_results(df, associated_sample, session, **kwargs)
     elif method == "pointfinder":
-        return insert_into_pointfinder_results(df, associated_sample, session, **kwargs)
+        result = insert_into_pointfinder_results(df, associated_sample, session, **kwargs)
     elif method == "mobtyper":
         return insert_generic_contig_results(df, associated_sample, session, **kwargs,
-                to_db_columns=MOBTYPER_DB_COLUMNS, model=MobTyperResult)
+                to_db_columns=MOBTYPER_DB_COLUMNS, model=MobTyperResult,
+                **bulk_kwargs)
     elif method == "plasmidfinder":
         return insert_generic_contig_results(df, associated_sample, session,
                 to_db_columns=PLASMIDFINDER_DB_COLUMNS, model=PlasmidfinderResult, 
-                create_contig=True, contig_name_col='contig_name', **kwargs)
+                create_contig=True, contig_name_col='contig_name',
+                **bulk_kwargs, **kwargs)
     elif method == "phispy":
         return insert_generic_contig_results(df, associated_sample, session,
                 to_db_columns=PHISPY_DB_COLUMNS, model=PhispyResults, 
-                create_contig=True, contig_name_col='contig_name', **kwargs)
+                create_contig=True, contig_name_col='contig_name',
+                **bulk_kwargs, **kwargs)
     elif method == "speciesfinder":
-        return insert_generic_sample_results(df, associated_sample, session, SpeciesfinderResult, **kwargs)
+        return insert_generic_sample_results(df, associated_sample, session,
+                SpeciesfinderResult, **bulk_kwargs, **kwargs)
     elif method == "amrfinder":
         add_new_sequences(df[~df["method"].str.contains("POINT")], session, AmrfinderSequence, ["long_name","is_core"])
         if assembly_path:
             df = add_contig_info(df, assembly_path, infere_orientation=False)
-        return insert_into_amrfinder_results(df, associated_sample, session, **kwargs)
+        result = insert_into_amrfinder_results(df, associated_sample, session, **kwargs)
     elif method == "mlst":
-        return insert_generic_sample_results(df, associated_sample, session, MlstResult, **kwargs)
+        return insert_generic_sample_results(df, associated_sample, session,
+                MlstResult, **bulk_kwargs, **kwargs)
     else:
         raise LookupError (f"Method not implemented: {method}")
+    # phenotype results: sample x phenotype matrix of the sample is updated
+    session.flush()
+    refresh_sample_phenotypes(session, [associated_sample.id],
+            METHOD_TOOLS[method])
+    return result
+
 
+def tool_version_args(method: str, mode: str="fasta", tool_version: str="unknown",
+        db_version: str=None, assembly_path: str=None) -> dict:
+    """
+    kwargs used to get or create ToolVersion of an import
+    resfinder without assembly is always considered as fastq input,
+    optional parameters which are None are removed (nullable in db)
+    """
+    if method == "resfinder" and not assembly_path:
+        mode = "fastq"
+    version_args = {
+            "db_version": db_version,
+            "tool_name": method,
+            "input_type": mode,
+            "tool_version": tool_version,
+        }
+    return {k: v for k, v in version_args.items() if v is not None}
+
+
+def read_import(inputpath: str, method: str, assembly_path: str=None) -> list:
+    """
+    parsing stage of an import (no database access, can be run in worker
+    processes): reads result of a single tool and, if an assembly is given,
+    adds contig information; resfinder additionally reads pointfinder results
+    if present in the same output directory
+    returns list of (method, DataFrame) tuples to be passed to write_import
+    """
+    read_kwargs = {}
+    if not assembly_path:
+        read_kwargs["extract_coordinates"] = False
+
+    results_df = read_result(inputpath, method, **read_kwargs)
+    if assembly_path and method in ("resfinder", "amrfinder"):
+        results_df = add_contig_info(results_df, assembly_path,
+                infere_orientation=(method == "resfinder"))
+    results = [(method, results_df)]
+
+    if (method == "resfinder"
+            and os.path.exists(f"{inputpath}/PointFinder_results.txt")):
+        results.append(("pointfinder",
+            read_result(inputpath, "pointfinder", **read_kwargs)))
+    return results
+
+
+def write_import(results: list, associated_sample: Sample, session: object,
+        version_associated: object, **kwargs) -> None:
+    """
+    writing stage of an import: inserts all (method, DataFrame) tuples
+    returned by read_import, linked to sample and tool version
+    kwargs: forwarded to insert_into_db (e.g. bulk, chunk_size)
+    """
+    for method, df in results:
+        insert_into_db(df, method, associated_sample, session,
+                version_associated=version_associated, **kwargs)
+        # pending objects are written per result (stage of its statements)
+        with stage(f"flush:{method}"):
+            session.flush()
+
+
+def import_result(inputpath: str, method: str, associated_sample: Sample,
+        session: object, version_associated: object, assembly_path: str=None,
+        **kwargs) -> None:
+    """
+    reads result of a single tool and writes it to db, linked to sample and
+    tool version; resfinder additionally imports pointfinder results if
+    present in the same output directory
+    kwargs: forwarded to insert_into_db (e.g. bulk, chunk_size)
+    """
+    results = read_import(inputpath, method, assembly_path)
+    write_import(results, associated_sample, session, version_associated,
+            **kwargs)
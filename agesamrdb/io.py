@@ -1,10 +1,49 @@
-from Bio import SeqIO
 import os
+import hashlib
 import pandas as pd
 import json
 
-from .util import calc_sequence_hash, gene_quality_control, \
-    apply_offset_to_partial_contigs
+from .util import calc_sequence_hash, calc_sequence_fingerprint, \
+    gene_quality_control, apply_offset_to_partial_contigs
+from .profiling import profiled
+
+# files read from the output directory of tools taking a directory as input
+# (optional files are skipped if missing), other tools read a single file
+INPUT_DIR_FILES = {
+        "resfinder": ["ResFinder_Hit_in_genome_seq.fsa",
+            "ResFinder_results_tab.txt", "PointFinder_results.txt"],
+        "pointfinder": ["PointFinder_results.txt"],
+        "amrfinder": ["amrfinder_results.txt", "amrfinder_nucleotides.fasta"],
+}
+
+# version of the parsed results, part of the key of cached results (see
+# cache.ParseCache): increase when a read_* function changes its output
+PARSER_VERSION = 1
+
+
+def input_files(inputpath: str, method: str) -> list:
+    """
+    paths of the files read for the result of method (see read_result)
+    """
+    if method not in INPUT_DIR_FILES:
+        return [inputpath]
+    paths = [os.path.join(inputpath, f) for f in INPUT_DIR_FILES[method]]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def digest_files(paths: list, chunk_size: int=1 << 20) -> str:
+    """
+    digest (32 hex characters) of the names and contents of files,
+    independent of their location
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(os.path.basename(path).encode() + b"\0")
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(chunk_size), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
 
 def read_isescan_results(input_file: str) -> pd.DataFrame:
     """
@@ -50,10 +89,13 @@ def read_mobtyper_results(input_file: str) -> pd.DataFrame:
     return df
     
 
+@profiled("parse_fasta_hits")
 def parse_fasta_hits(sequence_file: str, translate: bool=False) -> pd.DataFrame:
     """
     parses sequence fasta originating from hits (and might translate)
     """
+    # imported on use, only needed for resfinder and amrfinder
+    from Bio import SeqIO
     sequences = []
     for i, seqrecord in enumerate(SeqIO.parse(sequence_file, "fasta")):
         # amrfinder does not include stop-codon
@@ -63,9 +105,11 @@ def parse_fasta_hits(sequence_file: str, translate: bool=False) -> pd.DataFrame:
         else:
             seq = str(seqrecord.seq)
         sequences.append((seqrecord.id.strip(","), seq, comment,
-            calc_sequence_hash(seq), seqrecord.description))
+            calc_sequence_hash(seq), calc_sequence_fingerprint(seq),
+            seqrecord.description))
 
-    columns = ["Resistance gene", "sequence", "qc_issues","crc32_hash","desc"]
+    columns = ["Resistance gene", "sequence", "qc_issues","crc32_hash",
+            "seq_fingerprint","desc"]
     df_sequences = pd.DataFrame(sequences, columns=columns)
 
     return df_sequences
@@ -108,7 +152,7 @@ def read_resfinder_results(resfinder_dir: str,
         # on resistance gene name only. drop duplicates on sequence hash
         # duplicate case: multiple alleles matching equally good, no posistion
         # extractable -> remove duplicate sequences
-        df = df_results.merge(df_sequences, on="Resistance gene").drop_duplicates("crc32_hash")
+        df = df_results.merge(df_sequences, on="Resistance gene").drop_duplicates("seq_fingerprint")
         df["ref_pos_end"] = None
         df["ref_pos_start"] = None
 
@@ -163,7 +207,6 @@ def read_phispy_results(input_file: str) -> pd.DataFrame:
                 'start_attR', 'end_attR', 'sequence_attL', 'sequence_attR', 'description']
     df = pd.read_csv(input_file, index_col=False, header=None, names=columns, sep='\t')
     df["contig_name"] = df["contig_name"].astype(str)
-    print(df)
     df = apply_offset_to_partial_contigs(df, "contig_name")
     return df 
     
@@ -0,0 +1,347 @@
+"""
+minimizer index of the stored reference sequences for nearest neighbour
+search (e.g. which stored sequences or AGES_ variants are closest to a new
+variant) without external alignments: resfinder sequences are indexed as
+nucleotides (canonical k-mers, both strands), amrfinder sequences as proteins
+(nucleotide sequences, e.g. AGES_ variants, are translated). identity is
+estimated from the jaccard index of the minimizer sets (mash distance).
+the index is kept on disk (one npz file per table in a directory) and
+synchronized incrementally with the database: only added or changed
+sequences (by seq_fingerprint) are hashed, removed sequences are dropped
+"""
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import select
+
+from .models import ResfinderSequence, AmrfinderSequence
+from .profiling import profiled
+
+# directory of the on-disk indexes (see get_kmer_index)
+KMER_INDEX_ENV = "AGESAMRDB_KMER_INDEX"
+
+# k-mer length and minimizer window (number of consecutive k-mers) per
+# alphabet
+ALPHABETS = {
+        "nucleotide": {"letters": "ACGT", "k": 15, "w": 5},
+        "protein": {"letters": "ACDEFGHIKLMNPQRSTVWY", "k": 5, "w": 3},
+}
+MODEL_ALPHABETS = {ResfinderSequence: "nucleotide",
+        AmrfinderSequence: "protein"}
+
+# maximum number of sequence ids per IN clause
+ID_CHUNK_SIZE = 500
+
+# standard genetic code, codons ordered TCAG
+CODONS = "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"
+_CODON_CODES = np.full(256, -1, dtype=np.int64)
+for _i, _base in enumerate("TCAG"):
+    _CODON_CODES[ord(_base)] = _i
+    _CODON_CODES[ord(_base.lower())] = _i
+
+
+def _codes(sequence: str, letters: str) -> np.ndarray:
+    # letters -> 0..len(letters)-1, other characters -> -1
+    table = np.full(256, -1, dtype=np.int64)
+    for i, letter in enumerate(letters):
+        table[ord(letter)] = i
+        table[ord(letter.lower())] = i
+    return table[np.frombuffer(sequence.encode("ascii", "replace"), np.uint8)]
+
+
+def is_nucleotide(sequence: str) -> bool:
+    """
+    sequence only consists of A, C, G, T and N
+    """
+    return set(sequence.upper()) <= set("ACGTN")
+
+
+def translate(sequence: str) -> str:
+    """
+    translation of a nucleotide sequence (frame 1, standard genetic code),
+    codons with other bases than ACGT are translated to X, trailing stop
+    codon removed
+    """
+    codes = _CODON_CODES[np.frombuffer(sequence.encode("ascii", "replace"),
+        np.uint8)]
+    codes = codes[:len(codes) // 3 * 3].reshape(-1, 3)
+    unknown = (codes < 0).any(axis=1)
+    protein = np.frombuffer(CODONS.encode(), np.uint8)[
+            np.where(unknown, 0, codes @ [16, 4, 1])]
+    protein = np.where(unknown, ord("X"), protein).astype(np.uint8)
+    return protein.tobytes().decode().rstrip("*")
+
+
+def _mix(values):
+    # 64-bit hash of k-mer values (random order of minimizers)
+    values = values * np.uint64(0x9E3779B97F4A7C15)
+    return values ^ (values >> np.uint64(29))
+
+
+def minimizers(sequence: str, alphabet: str="nucleotide", k: int=None,
+        w: int=None) -> np.ndarray:
+    """
+    sorted unique minimizer hashes (uint64) of sequence: smallest hash of
+    every w consecutive k-mers; k-mers with other letters are skipped,
+    nucleotide k-mers are canonical (smaller hash of both strands)
+    """
+    params = ALPHABETS[alphabet]
+    k = params["k"] if k is None else k
+    w = params["w"] if w is None else w
+    letters = params["letters"]
+    bits = int(np.ceil(np.log2(len(letters))))
+    codes = _codes(sequence, letters)
+    if len(codes) < k:
+        return np.zeros(0, np.uint64)
+    weights = (np.uint64(1) << (np.arange(k - 1, -1, -1, dtype=np.uint64)
+        * np.uint64(bits)))
+    windows = sliding_window_view(codes, k)
+    valid = (windows >= 0).all(axis=1)
+    values = (windows.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+    hashes = _mix(values)
+    if alphabet == "nucleotide":
+        # reverse complement k-mer starting at the same position
+        reverse = np.where(codes >= 0, 3 - codes, -1)[::-1]
+        reverse_values = (sliding_window_view(reverse, k).astype(np.uint64)
+                * weights).sum(axis=1, dtype=np.uint64)[::-1]
+        hashes = np.minimum(hashes, _mix(reverse_values))
+    # invalid k-mers never become minimizers
+    hashes = np.where(valid, hashes, np.iinfo(np.uint64).max)
+    if len(hashes) > w:
+        hashes = sliding_window_view(hashes, w).min(axis=1)
+    hashes = np.unique(hashes)
+    return hashes[hashes != np.iinfo(np.uint64).max]
+
+
+class KmerIndex(object):
+    """
+    inverted index minimizer hash -> sequence ids of sequences of one
+    alphabet (see ALPHABETS), with seq_fingerprint and number of minimizers
+    of every indexed sequence
+    """
+
+    def __init__(self, alphabet: str="nucleotide", k: int=None, w: int=None):
+        self.alphabet = alphabet
+        self.k = ALPHABETS[alphabet]["k"] if k is None else k
+        self.w = ALPHABETS[alphabet]["w"] if w is None else w
+        # postings sorted by hash
+        self.hashes = np.zeros(0, np.uint64)
+        self.postings = np.zeros(0, np.int64)
+        # indexed sequences sorted by id
+        self.sequence_ids = np.zeros(0, np.int64)
+        self.fingerprints = np.zeros(0, np.int64)
+        self.sizes = np.zeros(0, np.int64)
+
+    def __len__(self):
+        return len(self.sequence_ids)
+
+    def sketch(self, sequence: str) -> np.ndarray:
+        """
+        minimizers of sequence in the alphabet of the index (nucleotide
+        sequences are translated for protein indexes)
+        """
+        if self.alphabet == "protein" and is_nucleotide(sequence):
+            sequence = translate(sequence)
+        return minimizers(sequence, self.alphabet, self.k, self.w)
+
+    def remove(self, sequence_ids):
+        """
+        drops sequences from the index
+        """
+        sequence_ids = np.asarray(list(sequence_ids), np.int64)
+        if not len(sequence_ids):
+            return
+        keep = ~np.isin(self.postings, sequence_ids)
+        self.hashes, self.postings = self.hashes[keep], self.postings[keep]
+        keep = ~np.isin(self.sequence_ids, sequence_ids)
+        self.sequence_ids = self.sequence_ids[keep]
+        self.fingerprints = self.fingerprints[keep]
+        self.sizes = self.sizes[keep]
+
+    def add(self, sequences: list):
+        """
+        adds list of (sequence_id, seq_fingerprint, sequence), sequences
+        already in the index are replaced
+        """
+        if not sequences:
+            return
+        self.remove(s[0] for s in sequences)
+        sketches = [self.sketch(sequence) for _, _, sequence in sequences]
+        sequence_ids = np.array([s[0] for s in sequences], np.int64)
+        sizes = np.array([len(sketch) for sketch in sketches], np.int64)
+        hashes = np.concatenate([self.hashes] + sketches)
+        postings = np.concatenate([self.postings,
+            np.repeat(sequence_ids, sizes)])
+        order = np.argsort(hashes, kind="stable")
+        self.hashes, self.postings = hashes[order], postings[order]
+        sequence_ids = np.concatenate([self.sequence_ids, sequence_ids])
+        fingerprints = np.concatenate([self.fingerprints,
+            np.array([s[1] or 0 for s in sequences], np.int64)])
+        sizes = np.concatenate([self.sizes, sizes])
+        order = np.argsort(sequence_ids, kind="stable")
+        self.sequence_ids = sequence_ids[order]
+        self.fingerprints = fingerprints[order]
+        self.sizes = sizes[order]
+
+    @profiled("sync_kmer_index")
+    def sync(self, session, model) -> tuple:
+        """
+        synchronizes the index with the sequences of model (ResfinderSequence
+        or AmrfinderSequence) in the database: indexes added sequences and
+        sequences with changed seq_fingerprint, drops removed sequences
+        returns (number of indexed, number of removed sequences)
+        """
+        stored = {sequence_id: seq_fingerprint or 0 for sequence_id,
+                seq_fingerprint in session.execute(select(model.id,
+                    model.seq_fingerprint))}
+        indexed = dict(zip(self.sequence_ids.tolist(),
+            self.fingerprints.tolist()))
+        removed = [i for i in indexed if i not in stored]
+        changed = [i for i, fingerprint in stored.items()
+                if indexed.get(i) != fingerprint]
+        self.remove(removed)
+        sequences = []
+        if changed and len(changed) == len(stored):
+            # first build: all sequences at once
+            sequences = session.execute(select(model.id,
+                model.seq_fingerprint, model.sequence)).all()
+        else:
+            for start in range(0, len(changed), ID_CHUNK_SIZE):
+                sequences.extend(session.execute(select(model.id,
+                    model.seq_fingerprint, model.sequence).where(
+                        model.id.in_(changed[start:start+ID_CHUNK_SIZE]))).all())
+        self.add([tuple(s) for s in sequences])
+        return len(sequences), len(removed)
+
+    def search(self, sequence: str, top_k: int=10,
+            min_identity: float=0.0) -> pd.DataFrame:
+        """
+        top_k indexed sequences closest to sequence (nucleotide or protein,
+        see sketch) as DataFrame with columns sequence_id, identity
+        (estimated from the jaccard index of the minimizers, see mash),
+        shared (minimizers) and jaccard, ordered by identity
+        """
+        if self.alphabet == "nucleotide" and not is_nucleotide(sequence):
+            raise ValueError("protein sequences can not be searched in a "
+                    + "nucleotide index")
+        sketch = self.sketch(sequence)
+        left = np.searchsorted(self.hashes, sketch, "left")
+        right = np.searchsorted(self.hashes, sketch, "right")
+        lengths = right - left
+        # positions of all postings of the minimizers of the query
+        positions = np.repeat(right - lengths.cumsum(), lengths) \
+                + np.arange(lengths.sum())
+        sequence_ids, shared = np.unique(self.postings[positions],
+                return_counts=True)
+        sizes = self.sizes[np.searchsorted(self.sequence_ids, sequence_ids)]
+        jaccard = shared / (len(sketch) + sizes - shared)
+        identity = np.clip(1 + np.log(2 * jaccard / (1 + jaccard)) / self.k,
+                0, 1)
+        df = pd.DataFrame({"sequence_id": sequence_ids, "identity": identity,
+            "shared": shared, "jaccard": jaccard})
+        df = df[df["identity"] >= min_identity]
+        return df.sort_values(["identity", "shared"], ascending=False,
+                kind="stable").head(top_k).reset_index(drop=True)
+
+    def save(self, path: str):
+        """
+        writes the index to an npz file (written atomically)
+        """
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp.npz"
+        np.savez(tmp_path, alphabet=np.array(self.alphabet),
+                params=np.array([self.k, self.w]), hashes=self.hashes,
+                postings=self.postings, sequence_ids=self.sequence_ids,
+                fingerprints=self.fingerprints, sizes=self.sizes)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "KmerIndex":
+        """
+        reads an index written by save
+        """
+        with np.load(path, allow_pickle=False) as npz:
+            k, w = npz["params"].tolist()
+            index = cls(str(npz["alphabet"]), k, w)
+            for name in ("hashes", "postings", "sequence_ids",
+                    "fingerprints", "sizes"):
+                setattr(index, name, npz[name])
+        return index
+
+
+# synchronized indexes of this process by directory (None: in memory) and
+# model
+_kmer_indexes = {}
+
+
+def index_path(directory: str, model) -> str:
+    return os.path.join(directory, f"{model.__tablename__}.npz")
+
+
+def get_kmer_index(session, model, directory: str=None) -> KmerIndex:
+    """
+    KmerIndex of model (ResfinderSequence or AmrfinderSequence) synchronized
+    with the database bound to session; directory (default: environment
+    variable AGESAMRDB_KMER_INDEX) keeps the index on disk between processes,
+    rewritten if sequences changed; without directory the index is kept in
+    memory of this process only
+    """
+    directory = directory or os.environ.get(KMER_INDEX_ENV)
+    key = (str(session.get_bind().url), directory, model)
+    index = _kmer_indexes.get(key)
+    path = index_path(directory, model) if directory else None
+    if index is None and path and os.path.exists(path):
+        index = KmerIndex.load(path)
+        params = ALPHABETS[MODEL_ALPHABETS[model]]
+        if (index.alphabet, index.k, index.w) != (MODEL_ALPHABETS[model],
+                params["k"], params["w"]):
+            # built with other parameters
+            index = None
+    if index is None:
+        index = KmerIndex(MODEL_ALPHABETS[model])
+    added, removed = index.sync(session, model)
+    if path and (added or removed or not os.path.exists(path)):
+        os.makedirs(directory, exist_ok=True)
+        index.save(path)
+    _kmer_indexes[key] = index
+    return index
+
+
+def nearest_sequences(session, model, queries, top_k: int=10,
+        min_identity: float=0.0, directory: str=None) -> pd.DataFrame:
+    """
+    top_k stored sequences of model (ResfinderSequence: nucleotide,
+    AmrfinderSequence: protein or nucleotide) closest to each query (see
+    KmerIndex.search) with name and accession of the sequences; the index is
+    synchronized once (see get_kmer_index) and names of all hits are read
+    together
+    queries: list of (name, sequence) or a single sequence (name "sequence")
+    ValueError (with the name of the query) if a query can not be searched
+    """
+    if isinstance(queries, str):
+        queries = [("sequence", queries)]
+    index = get_kmer_index(session, model, directory)
+    frames = []
+    for name, sequence in queries:
+        try:
+            hits = index.search(sequence, top_k, min_identity)
+        except ValueError as e:
+            raise ValueError(f"query {name}: {e}")
+        hits.insert(0, "query", name)
+        frames.append(hits)
+    hits = pd.concat(frames, ignore_index=True) if frames else \
+            pd.DataFrame(columns=["query", "sequence_id", "identity",
+                "shared", "jaccard"])
+    sequence_ids = hits["sequence_id"].unique().tolist()
+    rows = []
+    for start in range(0, len(sequence_ids), ID_CHUNK_SIZE):
+        rows.extend(session.execute(select(model.id, model.name,
+            model.accession).where(model.id.in_(
+                sequence_ids[start:start+ID_CHUNK_SIZE]))).all())
+    names = pd.DataFrame(rows, columns=["sequence_id", "name", "accession"])
+    # left merge keeps the order of the hits
+    hits = hits.merge(names, on="sequence_id", how="left")
+    return hits[hits["name"].notna()].reset_index(drop=True)[["query",
+        "sequence_id", "name", "accession", "identity", "shared", "jaccard"]]
@@ -0,0 +1,287 @@
+"""
+sparse presence/absence matrices (samples x features) for clustering and
+outbreak analyses (needs scipy): features are reference sequences of resfinder
+and amrfinder (incl. AGES_ variants, by sequence id), plasmidfinder replicons
+and isescan families. (sample, feature) pairs are aggregated by the database
+and read in chunks as integer codes, neither a dense table nor ORM objects
+are built; matrices are saved as npz together with their row and column
+labels (the matrix is also readable by scipy.sparse.load_npz)
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, union
+
+from .models import Sample, ToolVersion, Contig, ImportLog, ResfinderResult, \
+        ResfinderSequence, AmrfinderResult, AmrfinderSequence, \
+        PlasmidfinderResult, ISEScanResult
+from .frames import read_connection, ID_CHUNK_SIZE, ROW_CHUNK_SIZE
+
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    # optional dependency, only needed for the matrices
+    sparse = None
+
+# feature type (method of the import): result model, model of the feature
+# (reference sequence; None: the feature is a column of the result) and the
+# attribute naming the feature
+FEATURES = {
+        "resfinder": (ResfinderResult, ResfinderSequence, "name"),
+        "amrfinder": (AmrfinderResult, AmrfinderSequence, "name"),
+        "plasmidfinder": (PlasmidfinderResult, None, "plasmid"),
+        "isescan": (ISEScanResult, None, "family"),
+}
+# label arrays stored with the matrix
+LABELS = ["sample_ids", "sample_names", "external_ids", "feature_types",
+        "feature_ids", "feature_names"]
+
+
+def _require_scipy():
+    if sparse is None:
+        raise ImportError("sparse matrices need scipy (pip install scipy)")
+
+
+@dataclass
+class PresenceMatrix:
+    """
+    matrix: scipy.sparse csr matrix, one row per sample and one column per
+        feature (1 if present, number of results with counts=True)
+    sample_ids, sample_names, external_ids: labels of the rows (name "" and
+        external id -1 if not set)
+    feature_types, feature_ids, feature_names: labels of the columns (key of
+        FEATURES, id of the reference sequence or -1, name)
+    """
+    matrix: object
+    sample_ids: np.ndarray
+    sample_names: np.ndarray
+    external_ids: np.ndarray
+    feature_types: np.ndarray
+    feature_ids: np.ndarray
+    feature_names: np.ndarray
+
+    def save(self, path: str):
+        """
+        writes matrix and labels to a compressed npz file (without pickles)
+        """
+        matrix = self.matrix.tocsr()
+        np.savez_compressed(path, format=np.array(matrix.format.encode("ascii")),
+                shape=np.array(matrix.shape), data=matrix.data,
+                indices=matrix.indices, indptr=matrix.indptr,
+                **{label: getattr(self, label) for label in LABELS})
+
+    @classmethod
+    def load(cls, path: str) -> "PresenceMatrix":
+        """
+        reads a PresenceMatrix written by save
+        """
+        _require_scipy()
+        with np.load(path, allow_pickle=False) as npz:
+            matrix = sparse.csr_matrix((npz["data"], npz["indices"],
+                npz["indptr"]), shape=tuple(npz["shape"]))
+            return cls(matrix, **{label: npz[label] for label in LABELS})
+
+
+def _sample_column(model):
+    # contig results are linked to the sample by their contig
+    if hasattr(model, "sample_id"):
+        return model.sample_id
+    return Contig.sample_id
+
+
+def _version_ids(tool_version, db_version):
+    versions = select(ToolVersion.id)
+    if tool_version is not None:
+        versions = versions.where(ToolVersion.tool_version == tool_version)
+    if db_version is not None:
+        versions = versions.where(ToolVersion.db_version == db_version)
+    return versions
+
+
+def _date_conditions(imported_since, imported_before):
+    conditions = []
+    if imported_since is not None:
+        conditions.append(ImportLog.imported_at >= imported_since)
+    if imported_before is not None:
+        conditions.append(ImportLog.imported_at < imported_before)
+    return conditions
+
+
+def _results_select(feature, columns, sample_ids=None, tool_version=None,
+        db_version=None, imported_since=None, imported_before=None):
+    # select of columns of all results of feature type with a feature
+    model, feature_model, label = FEATURES[feature]
+    sample_column = _sample_column(model)
+    statement = select(*columns).select_from(model)
+    if not hasattr(model, "sample_id"):
+        statement = statement.join(Contig, model.contig_id == Contig.id)
+    if feature_model is None:
+        statement = statement.where(getattr(model, label).is_not(None))
+    if sample_ids is not None:
+        statement = statement.where(sample_column.in_(sample_ids))
+    if tool_version is not None or db_version is not None:
+        statement = statement.where(model.version_id.in_(
+            _version_ids(tool_version, db_version)))
+    dates = _date_conditions(imported_since, imported_before)
+    if dates:
+        # results imported before the import log existed are excluded
+        statement = statement.where(select(ImportLog.id).where(
+            ImportLog.sample_id == sample_column,
+            ImportLog.version_id == model.version_id,
+            ImportLog.method == feature, *dates).exists())
+    return statement
+
+
+def _feature_key(feature):
+    model, feature_model, label = FEATURES[feature]
+    if feature_model is None:
+        return getattr(model, label)
+    return model.sequence_id
+
+
+def pairs_statement(feature: str, sample_ids: list=None, **filters):
+    """
+    select of (sample_id, feature, count) of all results of feature type (see
+    FEATURES; feature: id of the reference sequence or name) of sample_ids
+    (default: all samples)
+    filters: tool_version, db_version, imported_since, imported_before
+    """
+    sample_column = _sample_column(FEATURES[feature][0])
+    key = _feature_key(feature)
+    return _results_select(feature, [sample_column.label("sample_id"),
+        key.label("feature"), func.count().label("count")], sample_ids,
+        **filters).group_by(sample_column, key)
+
+
+def features_statement(feature: str, **filters):
+    """
+    select of (feature, name) of all features of feature type present in
+    results (see pairs_statement), ordered by name
+    """
+    model, feature_model, label = FEATURES[feature]
+    key = _feature_key(feature)
+    if feature_model is None:
+        return _results_select(feature, [key.label("feature"),
+            key.label("name")], **filters).distinct().order_by(key)
+    keys = _results_select(feature, [key], **filters)
+    name = getattr(feature_model, label)
+    return select(feature_model.id.label("feature"), name.label("name"))\
+            .where(feature_model.id.in_(keys))\
+            .order_by(name, feature_model.id)
+
+
+def samples_statement(features: list, tool_version: str=None,
+        db_version: str=None, imported_since=None, imported_before=None):
+    """
+    select of (id, name, external_id) of all samples with results of features
+    or with imports of these methods without results, ordered by id
+    """
+    filters = {"tool_version": tool_version, "db_version": db_version,
+            "imported_since": imported_since, "imported_before": imported_before}
+    selects = [_results_select(feature,
+        [_sample_column(FEATURES[feature][0])], **filters)
+        for feature in features]
+    imports = select(ImportLog.sample_id).where(ImportLog.method.in_(features),
+            *_date_conditions(imported_since, imported_before))
+    if tool_version is not None or db_version is not None:
+        imports = imports.where(ImportLog.version_id.in_(
+            _version_ids(tool_version, db_version)))
+    return select(Sample.id, Sample.name, Sample.external_id)\
+            .where(Sample.id.in_(union(*selects, imports)))\
+            .order_by(Sample.id)
+
+
+def _read_chunks(connection, statement, chunk_size):
+    # streamed from server side cursors on mysql/mariadb
+    statement = statement.execution_options(stream_results=True)
+    for df in pd.read_sql(statement, connection, chunksize=chunk_size):
+        if len(df):
+            yield df
+
+
+def presence_matrix(bind, features: list=("resfinder", "amrfinder"),
+        sample_ids: list=None, tool_version: str=None, db_version: str=None,
+        imported_since=None, imported_before=None, counts: bool=False,
+        chunk_size: int=ROW_CHUNK_SIZE) -> PresenceMatrix:
+    """
+    sparse matrix of the features (see FEATURES) present in samples
+    params:
+    bind: engine or connection
+    features: feature types, columns are ordered by type and name
+    sample_ids: rows (existing samples, ordered by id); default: all samples
+        with results or imports (see samples_statement) of features
+    tool_version, db_version: only results of this tool / database version
+    imported_since, imported_before: only results imported in this range
+        (datetime, see ImportLog.imported_at, before is exclusive)
+    counts: values are the number of results instead of 1
+    chunk_size: (sample, feature) pairs read at once
+    """
+    _require_scipy()
+    unknown = [f for f in features if f not in FEATURES]
+    if unknown:
+        raise ValueError(f"unknown features: {', '.join(unknown)}")
+    filters = {"tool_version": tool_version, "db_version": db_version,
+            "imported_since": imported_since, "imported_before": imported_before}
+    if sample_ids is None:
+        id_chunks = [None]
+    else:
+        sample_ids = list(dict.fromkeys(sample_ids))
+        id_chunks = [sample_ids[i:i+ID_CHUNK_SIZE]
+                for i in range(0, len(sample_ids), ID_CHUNK_SIZE)]
+
+    rows, columns, values, feature_frames = [], [], [], []
+    offset = 0
+    with read_connection(bind) as connection:
+        if sample_ids is None:
+            samples = pd.read_sql(samples_statement(features, **filters),
+                    connection)
+        else:
+            samples = pd.concat([pd.read_sql(select(Sample.id, Sample.name,
+                Sample.external_id).where(Sample.id.in_(ids)), connection)
+                for ids in id_chunks], ignore_index=True)\
+                .sort_values("id", ignore_index=True)
+        sample_index = pd.Index(samples["id"])
+        for feature in features:
+            domain = pd.read_sql(features_statement(feature, **filters),
+                    connection)
+            feature_index = pd.Index(domain["feature"])
+            for ids in id_chunks:
+                for df in _read_chunks(connection, pairs_statement(feature,
+                    ids, **filters), chunk_size):
+                    row = sample_index.get_indexer(df["sample_id"])
+                    column = feature_index.get_indexer(df["feature"])
+                    # written by an import after the labels were read
+                    known = (row >= 0) & (column >= 0)
+                    rows.append(row[known].astype(np.int32))
+                    columns.append(column[known].astype(np.int32) + offset)
+                    values.append(df["count"].to_numpy()[known])
+            feature_frames.append(pd.DataFrame({"type": feature,
+                "id": domain["feature"] if FEATURES[feature][1] else -1,
+                "name": domain["name"]}))
+            offset += len(domain)
+
+    features_df = pd.concat(feature_frames, ignore_index=True) \
+            if feature_frames else pd.DataFrame(columns=["type", "id", "name"])
+    rows = np.concatenate(rows) if rows else np.zeros(0, np.int32)
+    columns = np.concatenate(columns) if columns else np.zeros(0, np.int32)
+    if counts:
+        values = np.concatenate(values).astype(np.int32) if values \
+                else np.zeros(0, np.int32)
+    else:
+        values = np.ones(len(rows), np.uint8)
+    if sample_ids is not None:
+        # features are read for all samples: keep those present in sample_ids
+        present = np.unique(columns)
+        features_df = features_df.iloc[present].reset_index(drop=True)
+        columns = np.searchsorted(present, columns).astype(np.int32)
+    matrix = sparse.csr_matrix((values, (rows, columns)),
+            shape=(len(samples), len(features_df)))
+
+    return PresenceMatrix(matrix,
+            sample_ids=samples["id"].to_numpy(np.int64),
+            sample_names=samples["name"].fillna("").astype(str).to_numpy(str),
+            external_ids=samples["external_id"].fillna(-1).to_numpy(np.int64),
+            feature_types=features_df["type"].astype(str).to_numpy(str),
+            feature_ids=features_df["id"].to_numpy(np.int64),
+            feature_names=features_df["name"].astype(str).to_numpy(str))
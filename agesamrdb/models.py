@@ -2,14 +2,57 @@
 
 from typing import List
 
-from sqlalchemy import Table, Column, Integer, String, ForeignKey, Float, Boolean
-from sqlalchemy.orm import relationship, Mapped, mapped_column
+import os
+import datetime
+
+from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, String, ForeignKey, Float, \
+        Boolean, Index, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.orm import relationship as orm_relationship
 from sqlalchemy.orm import declarative_base
 
-from sqlalchemy.ext.declarative import DeferredReflection
 from sqlalchemy.ext.declarative import declared_attr
 
-Base = declarative_base(cls=DeferredReflection)
+from .util import calc_natural_key
+
+class _PrepareCompat(object):
+    @classmethod
+    def prepare(cls, engine=None, **kwargs):
+        # models of previous versions used DeferredReflection, Base.prepare
+        # (engine) is kept for existing callers: nothing to map or reflect
+        pass
+
+
+# all columns are declared in the models, the tables are not reflected from
+# the database (see prepare_models)
+Base = declarative_base(cls=_PrepareCompat)
+
+# loading strategy of all relationships: "select" (lazy loading on access,
+# default), "raise" or "raise_on_sql" (lazy loads raise an error, e.g. to
+# detect N+1 queries in production, see agesamrdb.query for eager loading);
+# read once when the models are imported
+LAZY_LOADING = os.environ.get("AGESAMRDB_LAZY_LOADING", "select")
+if LAZY_LOADING not in ("select", "raise", "raise_on_sql"):
+    raise ValueError(f"unknown AGESAMRDB_LAZY_LOADING: {LAZY_LOADING}")
+
+
+def relationship(*args, **kwargs):
+    """
+    sqlalchemy.orm.relationship using LAZY_LOADING by default
+    """
+    kwargs.setdefault("lazy", LAZY_LOADING)
+    return orm_relationship(*args, **kwargs)
+
+
+def natural_key_default(*columns):
+    """
+    column default: natural key (see util.calc_natural_key) of columns of the
+    inserted row, set by ORM and core inserts
+    """
+    def default(context):
+        parameters = context.get_current_parameters()
+        return calc_natural_key([parameters.get(c) for c in columns])
+    return default
 
 # helper table for many2many relationship gene <-> phenotype
 resfinder_phenotype_association_table = Table(
@@ -52,10 +95,11 @@ class ResfinderSequence(Base):
     name: Mapped[str] = mapped_column(String(200), nullable=False)
     short_name: Mapped[str] = mapped_column(String(50), nullable=True)
     subseq_numbering: Mapped[str] = mapped_column(String(50), nullable=True)
-    accession: Mapped[str] = mapped_column(String(50), nullable=False)
+    accession: Mapped[str] = mapped_column(String(50), nullable=False, index=True)
     main_numbering: Mapped[str] = mapped_column(String(50), nullable=True)
     internal_numbering: Mapped[str] = mapped_column(String(100), nullable=True)
     crc32_hash: Mapped[str] = mapped_column(String(10), nullable=False)
+    seq_fingerprint: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
     sequence: Mapped[str] = mapped_column(String(10000), nullable=False)
 
     # Relationships
@@ -70,12 +114,13 @@ class AmrfinderSequence(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(200), nullable=False)
     short_name: Mapped[str] = mapped_column(String(50), nullable=True)
-    accession: Mapped[str] = mapped_column(String(50), nullable=False)
+    accession: Mapped[str] = mapped_column(String(50), nullable=False, index=True)
     activity_type: Mapped[str] = mapped_column(String(50), nullable=True)
     is_core: Mapped[bool] = mapped_column(Boolean(), nullable=True)
     long_name: Mapped[str] = mapped_column(String(1000), nullable=False)
     internal_numbering: Mapped[str] = mapped_column(String(100), nullable=True)
     crc32_hash: Mapped[str] = mapped_column(String(10), nullable=False)
+    seq_fingerprint: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
     sequence: Mapped[str] = mapped_column(String(10000), nullable=False)
 
     # Relationships
@@ -102,7 +147,12 @@ class Phenotype(Base):
         secondary=amrfinder_point_phenotype_association_table, back_populates="phenotypes",
     )
     class_name: Mapped[str] = mapped_column(String(50), nullable=True)
-    phenotype: Mapped[str] = mapped_column(String(50), nullable=False)
+    # not unique: a phenotype may be listed with multiple classes
+    phenotype: Mapped[str] = mapped_column(String(50), nullable=False, index=True)
+    # unique (phenotype, class_name), also if class_name is NULL
+    natural_key_columns = ["phenotype", "class_name"]
+    natural_key: Mapped[str] = mapped_column(String(32), nullable=True,
+            unique=True, index=True, default=natural_key_default(*natural_key_columns))
     invitroresults: Mapped[List["InVitroResult"]] = relationship(back_populates="phenotype_associated")
 
 
@@ -119,7 +169,7 @@ class ResfinderResult(Base):
     orientation: Mapped[str] = mapped_column(String(1), nullable=True)
 
     # Foreign Keys
-    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id", ondelete="CASCADE"), nullable=False)
+    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id", ondelete="CASCADE"), nullable=False, index=True)
     sequence_id:  Mapped[int] = mapped_column(ForeignKey("resfinder_sequence.id", ondelete="CASCADE"), nullable=False)
     contig_id: Mapped[int] = mapped_column(ForeignKey("contig.id", ondelete="CASCADE"), nullable=True)
     version_id: Mapped[int] = mapped_column(ForeignKey("tool_version.id", ondelete="CASCADE"), nullable=False)
@@ -138,10 +188,17 @@ class Sample(Base):
     # sample may conntect results and contigs separately
     # e.g. sample phenotypes needs to be accessed via sample.resfinderresults.stored_sequence.phenotypes
     __tablename__ = "sample"
+    __table_args__ = (
+        Index("ix_sample_name_external_id", "name", "external_id", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     external_id: Mapped[int] = mapped_column(Integer(), nullable=True)
     name: Mapped[str] = mapped_column(String(500), nullable=True)
+    # unique (name, external_id), also if one of them is NULL
+    natural_key_columns = ["name", "external_id"]
+    natural_key: Mapped[str] = mapped_column(String(32), nullable=True,
+            unique=True, index=True, default=natural_key_default(*natural_key_columns))
 
     # Relationships
     stored_contigs: Mapped[List["Contig"]] = relationship(back_populates="sample_associated")
@@ -156,6 +213,9 @@ class Sample(Base):
 
 class Contig(Base):
     __tablename__ = "contig"
+    __table_args__ = (
+        Index("ix_contig_sample_id_name", "sample_id", "name", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name:  Mapped[str] = mapped_column(String(500), nullable=False)
@@ -184,7 +244,7 @@ class PointfinderResult(Base):
     nuc_change: Mapped[str] = mapped_column(String(50), nullable=False)
 
     # Foreign keys
-    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id", ondelete="CASCADE"), nullable=False)
+    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id", ondelete="CASCADE"), nullable=False, index=True)
     version_id: Mapped[int] = mapped_column(ForeignKey("tool_version.id", ondelete="CASCADE"), nullable=False)
 
     # Relationships
@@ -212,7 +272,7 @@ class AmrfinderResultMixin(object):
     method: Mapped[str] = mapped_column(String(30), nullable=True)
 
     # Foreign Keys
-    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id", ondelete="CASCADE"), nullable=False)
+    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id", ondelete="CASCADE"), nullable=False, index=True)
     contig_id: Mapped[int] = mapped_column(ForeignKey("contig.id", ondelete="CASCADE"), nullable=True)
     version_id: Mapped[int] = mapped_column(ForeignKey("tool_version.id", ondelete="CASCADE"), nullable=False)
 
@@ -459,12 +519,80 @@ class MlstResult(Base):
 class ToolVersion(Base):
     # Table which contains information about the version of db and tool
     __tablename__ = "tool_version"
+    __table_args__ = (
+        Index("ix_tool_version_name_version_input_db", "tool_name",
+            "tool_version", "input_type", "db_version", unique=True),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     tool_name: Mapped[str] = mapped_column(String(100), nullable=True)
     tool_version: Mapped[str] = mapped_column(String(100), nullable=True)
     input_type: Mapped[str] = mapped_column(String(10), nullable=True)
     db_version: Mapped[str] = mapped_column(String(100), nullable=True)
+    # unique (tool_name, tool_version, input_type, db_version), also with NULLs
+    natural_key_columns = ["tool_name", "tool_version", "input_type", "db_version"]
+    natural_key: Mapped[str] = mapped_column(String(32), nullable=True,
+            unique=True, index=True, default=natural_key_default(*natural_key_columns))
 
     # Relationships:
     # TODO write all associated back-populations, this does not seem to
     # be neccessary at this point
+
+
+class ImportLog(Base):
+    # one entry per imported tool result, identifies re-imports of the same
+    # input files (input_fingerprint, see importlog.input_fingerprint)
+    __tablename__ = "import_log"
+    __table_args__ = (
+        Index("ix_import_log_sample_version_method_input", "sample_id",
+            "version_id", "method", "input_fingerprint", unique=True),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    method: Mapped[str] = mapped_column(String(30), nullable=False)
+    input_fingerprint: Mapped[str] = mapped_column(String(32), nullable=False)
+    input_path: Mapped[str] = mapped_column(String(1000), nullable=True)
+    imported_at: Mapped[datetime.datetime] = mapped_column(DateTime(), nullable=True,
+            default=datetime.datetime.now)
+
+    # Foreign Keys
+    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id", ondelete="CASCADE"), nullable=False)
+    version_id: Mapped[int] = mapped_column(ForeignKey("tool_version.id", ondelete="CASCADE"), nullable=False)
+
+
+class SamplePhenotype(Base):
+    # materialized sample x phenotype matrix: one entry per sample, phenotype
+    # and tool (resfinder, pointfinder, amrfinder, amrfinder_point) with
+    # number of results and best identity, maintained by
+    # summary.refresh_sample_phenotypes
+    __tablename__ = "sample_phenotype"
+    __table_args__ = (
+        Index("ix_sample_phenotype_sample_phenotype_tool", "sample_id",
+            "phenotype_id", "tool", unique=True),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tool: Mapped[str] = mapped_column(String(30), nullable=False)
+    evidence_count: Mapped[int] = mapped_column(Integer(), nullable=False)
+    # NULL for pointfinder (no identity reported)
+    best_identity: Mapped[float] = mapped_column(Float(), nullable=True)
+
+    # Foreign Keys
+    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id", ondelete="CASCADE"), nullable=False)
+    phenotype_id: Mapped[int] = mapped_column(ForeignKey("phenotype.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    # Relationships
+    phenotype_associated: Mapped["Phenotype"] = relationship()
+
+
+def prepare_models(engine=None, reflect=False):
+    """
+    called by all scripts before first use of the models (instead of
+    Base.prepare of previous versions): the models are mapped when they are
+    imported, their tables are not reflected from the database (saves one
+    round trip per table on every start). reflect=True returns the tables of
+    engine reflected into a separate MetaData (e.g. for columns of the
+    database not declared in the models), the models are not changed
+    """
+    if reflect:
+        metadata = MetaData()
+        metadata.reflect(engine)
+        return metadata
+    return None
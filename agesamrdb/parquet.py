@@ -0,0 +1,356 @@
+"""
+export of the result tables to parquet files (needs pyarrow) for analyses
+with e.g. duckdb or pandas: foreign keys are denormalized (sample, tool
+version, contig, gene, phenotypes) and strings dictionary-encoded; results
+are written in buckets of samples (bucket_size consecutive sample ids), so
+an incremental export only rewrites buckets of new or re-imported samples
+
+layout of the output directory:
+    sample.parquet, tool_version.parquet, phenotype.parquet (complete)
+    <table>/sample_bucket=<bucket>/bucket-<bucket>.parquet
+    <table>/version_id=<id>/bucket-<bucket>.parquet (partition_by="version")
+    _export_state.json (state of the last export)
+read e.g. with duckdb: read_parquet('<dir>/resfinder_result/*/*.parquet',
+hive_partitioning=true) or pandas.read_parquet('<dir>/resfinder_result')
+"""
+import os
+import glob
+import bisect
+import json
+import datetime
+
+from sqlalchemy import select, Integer, BigInteger, Float, Boolean, \
+        DateTime
+
+from .models import Sample, ToolVersion, Contig, Phenotype, ImportLog, \
+        ResfinderResult, ResfinderSequence, AmrfinderResult, \
+        AmrfinderSequence, PointfinderResult, AmrfinderPointResult, \
+        BaktaResult, ISEScanResult, MobTyperResult, PlasmidfinderResult, \
+        PhispyResults, SpeciesfinderResult, MlstResult, InVitroResult, \
+        resfinder_phenotype_association_table, \
+        amrfinder_phenotype_association_table, \
+        pointfinder_phenotype_association_table, \
+        amrfinder_point_phenotype_association_table
+from .frames import read_connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    # optional dependency, only needed for the export
+    pa = pc = pq = None
+
+STATE_FILE = "_export_state.json"
+BUCKET_SIZE = 1000
+
+# exported in buckets of samples
+EXPORT_MODELS = [ResfinderResult, AmrfinderResult, PointfinderResult,
+        AmrfinderPointResult, BaktaResult, ISEScanResult, MobTyperResult,
+        PlasmidfinderResult, PhispyResults, SpeciesfinderResult, MlstResult,
+        InVitroResult, Contig]
+# exported completely by every run
+REFERENCE_MODELS = [Sample, ToolVersion, Phenotype]
+
+# gene of results
+SEQUENCE_MODELS = {ResfinderResult: ResfinderSequence,
+        AmrfinderResult: AmrfinderSequence}
+# phenotypes of results: association table, its key and the result column
+# referenced by the key
+PHENOTYPE_ASSOCIATIONS = {
+        ResfinderResult: (resfinder_phenotype_association_table,
+            "sequence_id", "sequence_id"),
+        AmrfinderResult: (amrfinder_phenotype_association_table,
+            "sequence_id", "sequence_id"),
+        PointfinderResult: (pointfinder_phenotype_association_table,
+            "pointfinder_result_id", "id"),
+        AmrfinderPointResult: (amrfinder_point_phenotype_association_table,
+            "amrfinder_point_result_id", "id"),
+}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("parquet export needs pyarrow (pip install pyarrow)")
+
+
+def _arrow_type(sql_type):
+    if isinstance(sql_type, (Integer, BigInteger)):
+        return pa.int64()
+    if isinstance(sql_type, Float):
+        return pa.float64()
+    if isinstance(sql_type, Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, DateTime):
+        return pa.timestamp("us")
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def export_statement(model):
+    """
+    select of all columns of model (except natural_key) with denormalized
+    foreign keys: sample_id, sample_name, external_id; tool_name,
+    tool_version, db_version; contig_name, contig_length; gene,
+    gene_short_name, gene_accession; phenotype, class_name (invitro results)
+    results of contigs without contig are left out (no sample)
+    """
+    table = model.__table__
+    statement = select(*[c for c in table.c if c.name != "natural_key"])\
+            .select_from(table)
+    if "sample_id" in table.c:
+        sample_id = table.c.sample_id
+        if "contig_id" in table.c:
+            statement = statement.outerjoin(Contig,
+                    table.c.contig_id == Contig.id)
+    else:
+        statement = statement.add_columns(Contig.sample_id)\
+                .join(Contig, table.c.contig_id == Contig.id)
+        sample_id = Contig.sample_id
+    statement = statement.add_columns(Sample.name.label("sample_name"),
+            Sample.external_id).join(Sample, sample_id == Sample.id)
+    if "version_id" in table.c:
+        statement = statement.add_columns(ToolVersion.tool_name,
+                ToolVersion.tool_version, ToolVersion.db_version)\
+            .join(ToolVersion, table.c.version_id == ToolVersion.id)
+    if "contig_id" in table.c:
+        statement = statement.add_columns(Contig.name.label("contig_name"),
+                Contig.length.label("contig_length"))
+    if model in SEQUENCE_MODELS:
+        sequence_model = SEQUENCE_MODELS[model]
+        statement = statement.add_columns(sequence_model.name.label("gene"),
+                sequence_model.short_name.label("gene_short_name"),
+                sequence_model.accession.label("gene_accession"))\
+            .join(sequence_model, table.c.sequence_id == sequence_model.id)
+    if "phenotype_id" in table.c:
+        statement = statement.add_columns(Phenotype.phenotype,
+                Phenotype.class_name)\
+            .join(Phenotype, table.c.phenotype_id == Phenotype.id)
+    return statement, sample_id
+
+
+def _phenotype_lists(connection, model, sample_condition):
+    # {key: ([phenotypes], [class names])} of results of sample_condition
+    table, key, column = PHENOTYPE_ASSOCIATIONS[model]
+    statement = select(table.c[key], Phenotype.phenotype,
+            Phenotype.class_name)\
+        .join(Phenotype, table.c.phenotype_id == Phenotype.id)\
+        .where(table.c[key].in_(select(model.__table__.c[column])
+            .where(sample_condition)))\
+        .order_by(table.c[key], Phenotype.phenotype)
+    phenotypes = {}
+    for key_value, phenotype, class_name in connection.execute(statement):
+        entry = phenotypes.setdefault(key_value, ([], []))
+        entry[0].append(phenotype)
+        entry[1].append(class_name)
+    return phenotypes
+
+
+def _arrow_table(statement, rows, extra_columns={}):
+    arrays, fields = [], []
+    columns = list(zip(*rows)) if rows else [()] * len(statement.selected_columns)
+    for column, values in zip(statement.selected_columns, columns):
+        arrow_type = _arrow_type(column.type)
+        if pa.types.is_dictionary(arrow_type):
+            array = pa.array(values, pa.string()).dictionary_encode()
+        else:
+            array = pa.array(values, arrow_type)
+        arrays.append(array)
+        fields.append(pa.field(column.name, array.type))
+    for name, (values, arrow_type) in extra_columns.items():
+        arrays.append(pa.array(values, arrow_type))
+        fields.append(pa.field(name, arrow_type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def read_bucket(connection, model, bucket: int, bucket_size: int=BUCKET_SIZE):
+    """
+    arrow table of model (see export_statement) of samples of bucket (sample
+    ids bucket * bucket_size to (bucket + 1) * bucket_size - 1), ordered by
+    sample; results with phenotypes get list columns phenotypes and
+    class_names
+    """
+    statement, sample_id = export_statement(model)
+    condition = sample_id.between(bucket * bucket_size,
+            (bucket + 1) * bucket_size - 1)
+    statement = statement.where(condition).order_by(sample_id,
+            model.__table__.c.id)
+    rows = connection.execute(statement).all()
+    extra_columns = {}
+    if model in PHENOTYPE_ASSOCIATIONS:
+        phenotypes = _phenotype_lists(connection, model, condition)
+        column = PHENOTYPE_ASSOCIATIONS[model][2]
+        index = list(statement.selected_columns.keys()).index(column)
+        entries = [phenotypes.get(row[index], ([], [])) for row in rows]
+        list_type = pa.list_(pa.string())
+        extra_columns = {"phenotypes": ([e[0] for e in entries], list_type),
+                "class_names": ([e[1] for e in entries], list_type)}
+    return _arrow_table(statement, rows, extra_columns)
+
+
+def _write_table(table, path: str, compression: str):
+    # replaced atomically, readers never see partial files
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path + ".tmp", compression=compression)
+    os.replace(path + ".tmp", path)
+
+
+def _remove_bucket(table_dir: str, bucket: int):
+    for path in glob.glob(os.path.join(table_dir, "*",
+            f"bucket-{bucket:06d}.parquet")):
+        os.remove(path)
+
+
+def write_bucket(connection, model, bucket: int, output_dir: str,
+        partition_by: str="sample", bucket_size: int=BUCKET_SIZE,
+        compression: str="snappy") -> int:
+    """
+    (re)writes the results of model of a bucket of samples (see read_bucket)
+    below output_dir/<table>; partition_by "version" writes a file per tool
+    version (version_id is then only part of the path)
+    returns number of written rows
+    """
+    table_dir = os.path.join(output_dir, model.__tablename__)
+    _remove_bucket(table_dir, bucket)
+    table = read_bucket(connection, model, bucket, bucket_size)
+    if table.num_rows == 0:
+        return 0
+    filename = f"bucket-{bucket:06d}.parquet"
+    if partition_by == "version" and "version_id" in table.column_names:
+        versions = table.column("version_id")
+        for version_id in versions.unique().to_pylist():
+            part = table.filter(pc.equal(versions, version_id))\
+                    .select([c for c in table.column_names if c != "version_id"])
+            _write_table(part, os.path.join(table_dir,
+                f"version_id={version_id}", filename), compression)
+    else:
+        _write_table(table, os.path.join(table_dir, f"sample_bucket={bucket}",
+            filename), compression)
+    return table.num_rows
+
+
+def read_export_state(output_dir: str) -> dict:
+    """
+    state of the last export to output_dir (None if there was none)
+    """
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def _merge_ranges(ranges: list, ids: list) -> list:
+    # ordered, non-overlapping [first, last] ranges covering ranges and ids
+    merged = []
+    for first, last in sorted([list(r) for r in ranges] + [[i, i] for i in ids]):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def new_ids(connection, column, ranges: list) -> tuple:
+    """
+    ids of column (primary key) not contained in ranges (ordered [first,
+    last] ranges of the ids seen by previous exports) and ranges extended by
+    them; ids are not assigned in commit order, ids below the highest seen id
+    committed after a previous export are found as well
+    """
+    # ids up to the end of a first range starting at 1 have all been seen
+    low = ranges[0][1] + 1 if ranges and ranges[0][0] <= 1 else 1
+    starts = [first for first, last in ranges]
+    ids = []
+    for i in connection.execute(select(column).where(column >= low)).scalars():
+        pos = bisect.bisect_right(starts, i) - 1
+        if pos < 0 or i > ranges[pos][1]:
+            ids.append(i)
+    return ids, _merge_ranges(ranges, ids)
+
+
+def _seen_ranges(state: dict, name: str) -> list:
+    if state is None:
+        return []
+    if "seen_ids" in state:
+        return state["seen_ids"][name]
+    # state of previous versions: all ids up to the highest were exported
+    highest = state[f"max_{name}_id"]
+    return [[1, highest]] if highest else []
+
+
+def changed_buckets(connection, state: dict, bucket_size: int) -> tuple:
+    """
+    buckets of samples added or imported into (see importlog) since the
+    export of state (all buckets if state is None) and the ids seen by this
+    export (see new_ids, as stored in the state)
+    """
+    sample_ids, sample_ranges = new_ids(connection, Sample.id,
+            _seen_ranges(state, "sample"))
+    log_ids, log_ranges = new_ids(connection, ImportLog.id,
+            _seen_ranges(state, "import_log"))
+    for start in range(0, len(log_ids), 500):
+        sample_ids.extend(connection.execute(select(ImportLog.sample_id)
+            .where(ImportLog.id.in_(log_ids[start:start+500]))).scalars())
+    return ({sample_id // bucket_size for sample_id in sample_ids},
+            {"sample": sample_ranges, "import_log": log_ranges})
+
+
+def export_parquet(bind, output_dir: str, partition_by: str="sample",
+        bucket_size: int=BUCKET_SIZE, full: bool=False,
+        compression: str="snappy", models: list=None) -> dict:
+    """
+    exports result tables (default: EXPORT_MODELS) to parquet files in
+    output_dir (see module documentation); if output_dir contains a previous
+    export, only buckets of new samples or samples with new imports (since
+    the previous export) are rewritten, unless full is set
+    partition_by: "sample" (buckets of samples) or "version" (tool version,
+        and buckets of samples within)
+    bind: engine or connection
+    returns number of written rows per table
+    """
+    _require_pyarrow()
+    if partition_by not in ("sample", "version"):
+        raise ValueError(f"unknown partitioning: {partition_by}")
+    models = models or EXPORT_MODELS
+    state = None if full else read_export_state(output_dir)
+    if state is not None and (state["partition_by"], state["bucket_size"]) \
+            != (partition_by, bucket_size):
+        raise ValueError(f"{output_dir} was exported with partition_by="
+                + f"{state['partition_by']}, bucket_size="
+                + f"{state['bucket_size']}, a full export is needed")
+    if state is not None and set(m.__tablename__ for m in models) \
+            - set(state["tables"]):
+        # tables not yet exported need all buckets
+        state = None
+
+    rows = {}
+    with read_connection(bind) as connection:
+        if state is None:
+            for model in models:
+                for path in glob.glob(os.path.join(output_dir,
+                        model.__tablename__, "*", "bucket-*.parquet")):
+                    os.remove(path)
+        # ids are read before the buckets, samples imported during the
+        # export are exported again by the next run
+        buckets, seen_ids = changed_buckets(connection, state, bucket_size)
+        buckets = sorted(buckets)
+        for model in models:
+            rows[model.__tablename__] = sum(write_bucket(connection, model,
+                bucket, output_dir, partition_by, bucket_size, compression)
+                for bucket in buckets)
+        for model in REFERENCE_MODELS:
+            statement = select(*[c for c in model.__table__.c
+                if c.name != "natural_key"])
+            _write_table(_arrow_table(statement,
+                connection.execute(statement).all()),
+                os.path.join(output_dir, model.__tablename__ + ".parquet"),
+                compression)
+
+    tables = set(state["tables"]) if state else set()
+    tables.update(m.__tablename__ for m in models)
+    with open(os.path.join(output_dir, STATE_FILE), "w") as fh:
+        json.dump({"partition_by": partition_by, "bucket_size": bucket_size,
+            "seen_ids": seen_ids,
+            "tables": sorted(tables), "buckets": len(buckets),
+            "exported_at": datetime.datetime.now().isoformat()}, fh, indent=2)
+    return rows
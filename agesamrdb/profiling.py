@@ -0,0 +1,207 @@
+import json
+import time
+import pstats
+import cProfile
+import functools
+import inspect as pyinspect
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+# profile of the running import (see ImportProfile.activate), stages of the
+# library functions are only recorded while a profile is active
+_active = None
+
+
+class ImportProfile(object):
+    """
+    wall time per stage of an import and accounting of sql statements (per
+    stage and per table) via engine events; stages are nested, e.g.
+    "insert_into_db:resfinder/add_new_sequences"
+    rows are counted for insert/update/delete (number of parameter sets of
+    executemany or rowcount), select statements are only counted; an
+    executemany sent in several batches (insertmanyvalues) is counted as
+    one statement per batch, its rows only once
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.tables = {}
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.seconds = 0.0
+        self.hotspots = None
+        self._stack = []
+        self._profiler = None
+
+    def _stage_stats(self, path):
+        return self.stages.setdefault(path, {"calls": 0, "seconds": 0.0,
+            "sql_statements": 0, "sql_seconds": 0.0})
+
+    @contextmanager
+    def stage(self, name):
+        """
+        records wall time (and sql statements) of the enclosed block as stage
+        name (nested in the currently running stage)
+        """
+        self._stack.append(name)
+        stats = self._stage_stats("/".join(self._stack))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats["calls"] += 1
+            stats["seconds"] += time.perf_counter() - start
+            self._stack.pop()
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+            executemany):
+        conn.info.setdefault("agesamrdb_query_start", []).append(
+                time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+            executemany):
+        seconds = time.perf_counter() - conn.info["agesamrdb_query_start"].pop()
+        self.statements += 1
+        self.sql_seconds += seconds
+        if self._stack:
+            stats = self._stage_stats("/".join(self._stack))
+            stats["sql_statements"] += 1
+            stats["sql_seconds"] += seconds
+
+        compiled = getattr(context, "compiled", None)
+        sql_statement = getattr(compiled, "statement", None)
+        verb = statement.lstrip().split(None, 1)[0].lower() if statement.strip() \
+                else "unknown"
+        if isinstance(sql_statement, UpdateBase):
+            table_names = [sql_statement.table.name]
+        elif sql_statement is not None and hasattr(sql_statement, "get_final_froms"):
+            table_names = sorted({getattr(f, "name", str(f))
+                for f in sql_statement.get_final_froms()})
+        else:
+            table_names = ["(other)"]
+        rows = None
+        if verb in ("insert", "update", "delete") and not executemany:
+            rows = max(cursor.rowcount, 0)
+        elif verb in ("insert", "update", "delete") \
+                and not getattr(context, "agesamrdb_rows_counted", False):
+            # parameters are the flattened values of the current batch, the
+            # rows of all batches are the compiled parameter sets
+            rows = len(context.compiled_parameters)
+            context.agesamrdb_rows_counted = True
+        for table_name in table_names:
+            stats = self.tables.setdefault(table_name, {})\
+                    .setdefault(verb, {"statements": 0})
+            stats["statements"] += 1
+            if rows is not None:
+                stats["rows"] = stats.get("rows", 0) + rows
+
+    @contextmanager
+    def activate(self, engine=None, cprofile=False):
+        """
+        records stages of the library functions and (if engine is given) all
+        sql statements of engine while the block runs
+        cprofile: additionally run cProfile (see dump_cprofile, hotspots)
+        """
+        global _active
+        previous, _active = _active, self
+        if engine is not None:
+            event.listen(engine, "before_cursor_execute", self._before_execute)
+            event.listen(engine, "after_cursor_execute", self._after_execute)
+        if cprofile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.seconds += time.perf_counter() - start
+            if self._profiler is not None:
+                self._profiler.disable()
+                self.hotspots = hotspots(self._profiler)
+            if engine is not None:
+                event.remove(engine, "before_cursor_execute", self._before_execute)
+                event.remove(engine, "after_cursor_execute", self._after_execute)
+            _active = previous
+
+    def dump_cprofile(self, output_file):
+        """
+        writes cProfile statistics (pstats format, e.g. for snakeviz)
+        """
+        if self._profiler is None:
+            raise ValueError("profile was not activated with cprofile=True")
+        self._profiler.dump_stats(output_file)
+
+    def report(self):
+        """
+        dict of all recorded values (rounded seconds), see write_report
+        """
+        def rounded(stats):
+            return {k: round(v, 6) if isinstance(v, float) else v
+                    for k, v in stats.items()}
+        report = {"total_seconds": round(self.seconds, 6),
+                "stages": {path: rounded(stats)
+                    for path, stats in self.stages.items()},
+                "sql": {"statements": self.statements,
+                    "seconds": round(self.sql_seconds, 6),
+                    "tables": self.tables}}
+        if self.hotspots is not None:
+            report["hotspots"] = self.hotspots
+        return report
+
+    def write_report(self, output_file):
+        """
+        writes report as json
+        """
+        with open(output_file, "w") as fh:
+            json.dump(self.report(), fh, indent=2, sort_keys=True)
+
+
+def hotspots(profiler, limit=20):
+    """
+    functions with highest cumulative time of a cProfile.Profile
+    """
+    stats = pstats.Stats(profiler)
+    entries = []
+    for (file_name, line, function), (_, calls, own, cumulative, _) in \
+            stats.stats.items():
+        entries.append({"function": f"{file_name}:{line}({function})",
+            "calls": calls, "own_seconds": round(own, 6),
+            "cumulative_seconds": round(cumulative, 6)})
+    entries.sort(key=lambda e: e["cumulative_seconds"], reverse=True)
+    return entries[:limit]
+
+
+@contextmanager
+def stage(name):
+    """
+    stage of the active profile, does nothing if no profile is active
+    """
+    if _active is None:
+        yield
+    else:
+        with _active.stage(name):
+            yield
+
+
+def profiled(name, arg=None):
+    """
+    decorator recording calls of a function as stage name of the active
+    profile, the value of argument arg (e.g. "method") is appended to the name
+    """
+    def decorator(function):
+        signature = pyinspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            stage_name = name
+            if arg is not None:
+                bound = signature.bind_partial(*args, **kwargs)
+                stage_name = f"{name}:{bound.arguments.get(arg)}"
+            with _active.stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
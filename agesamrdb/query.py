@@ -0,0 +1,223 @@
+"""
+read access for frontends: sample profiles are loaded with a fixed number of
+queries (eager loading of all relationships, independent of the number of
+samples and results) and returned as plain dataclasses, detached from the
+session; lazy loads are disabled for these queries (raiseload), e.g. for use
+with AGESAMRDB_LAZY_LOADING=raise_on_sql (see models.LAZY_LOADING)
+"""
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload, joinedload, raiseload
+
+from .models import Sample, Contig, ResfinderResult, ResfinderSequence, \
+        AmrfinderResult, AmrfinderSequence, AmrfinderPointResult, \
+        PointfinderResult
+
+# maximum number of ids per IN clause
+ID_CHUNK_SIZE = 500
+
+
+@dataclass
+class PhenotypeInfo:
+    phenotype: str
+    class_name: Optional[str]
+
+
+@dataclass
+class GeneHit:
+    # acquired gene found by resfinder or amrfinder
+    tool: str
+    name: str
+    accession: str
+    identity: float
+    coverage: float
+    contig: Optional[str]
+    ref_pos_start: Optional[int]
+    ref_pos_end: Optional[int]
+    orientation: Optional[str]
+    qc_issues: Optional[str]
+    tool_version: Optional[str]
+    # sequence is a variant (AGES_) added by an import
+    is_variant: bool
+    phenotypes: List[PhenotypeInfo] = field(default_factory=list)
+
+
+@dataclass
+class PointMutation:
+    # point mutation found by pointfinder or amrfinder
+    tool: str
+    mutation: str
+    nuc_change: Optional[str]
+    contig: Optional[str]
+    tool_version: Optional[str]
+    phenotypes: List[PhenotypeInfo] = field(default_factory=list)
+
+
+@dataclass
+class Plasmid:
+    # plasmidfinder hit on a contig
+    plasmid: Optional[str]
+    identity: float
+    accession_number: Optional[str]
+
+
+@dataclass
+class Mobility:
+    # mob_typer result of a contig
+    rep_type: Optional[str]
+    relaxase_type: Optional[str]
+    mpf_type: Optional[str]
+    predicted_mobility: Optional[str]
+    primary_cluster_id: Optional[str]
+
+
+@dataclass
+class ContigProfile:
+    name: str
+    length: Optional[int]
+    plasmids: List[Plasmid] = field(default_factory=list)
+    mobility: Optional[Mobility] = None
+
+
+@dataclass
+class MlstType:
+    scheme_name: Optional[str]
+    sequence_type: Optional[int]
+    allele_types: Optional[str]
+
+
+@dataclass
+class SampleProfile:
+    id: int
+    name: Optional[str]
+    external_id: Optional[int]
+    genes: List[GeneHit] = field(default_factory=list)
+    point_mutations: List[PointMutation] = field(default_factory=list)
+    contigs: List[ContigProfile] = field(default_factory=list)
+    species: List[str] = field(default_factory=list)
+    mlst: List[MlstType] = field(default_factory=list)
+
+    def phenotypes(self) -> List[str]:
+        """
+        sorted phenotypes of all genes and point mutations
+        """
+        return sorted({p.phenotype for hit in self.genes + self.point_mutations
+            for p in hit.phenotypes})
+
+
+def sample_profile_options():
+    """
+    loader options of Sample for all relationships used by SampleProfile;
+    collections are loaded with selectinload (one query per relationship),
+    many-to-one relationships with joinedload, all other relationships raise
+    """
+    def gene_options(relationship, result_model, sequence_model):
+        return selectinload(relationship).options(
+                joinedload(result_model.stored_sequence)
+                    .selectinload(sequence_model.phenotypes),
+                joinedload(result_model.contig_associated),
+                joinedload(result_model.version_associated),
+                raiseload("*"))
+    return [
+        gene_options(Sample.resfinderresults, ResfinderResult,
+            ResfinderSequence),
+        gene_options(Sample.amrfinderresults, AmrfinderResult,
+            AmrfinderSequence),
+        selectinload(Sample.pointfinderresults).options(
+            selectinload(PointfinderResult.phenotypes),
+            joinedload(PointfinderResult.version_associated),
+            raiseload("*")),
+        selectinload(Sample.amrfinderpointresults).options(
+            selectinload(AmrfinderPointResult.phenotypes),
+            joinedload(AmrfinderPointResult.contig_associated),
+            joinedload(AmrfinderPointResult.version_associated),
+            raiseload("*")),
+        selectinload(Sample.stored_contigs).options(
+            selectinload(Contig.plasmidfinderresults),
+            selectinload(Contig.mobtyperresults),
+            raiseload("*")),
+        selectinload(Sample.speciesfinderresults),
+        selectinload(Sample.mlstresults),
+        raiseload("*"),
+    ]
+
+
+def _phenotypes(phenotypes):
+    return [PhenotypeInfo(p.phenotype, p.class_name) for p in phenotypes]
+
+
+def _version(result):
+    version = result.version_associated
+    return version.tool_version if version is not None else None
+
+
+def _contig_name(result):
+    contig = result.contig_associated
+    return contig.name if contig is not None else None
+
+
+def _gene_hit(tool, result):
+    sequence = result.stored_sequence
+    return GeneHit(tool=tool, name=sequence.name, accession=sequence.accession,
+            identity=result.identity, coverage=result.coverage,
+            contig=_contig_name(result), ref_pos_start=result.ref_pos_start,
+            ref_pos_end=result.ref_pos_end, orientation=result.orientation,
+            qc_issues=result.qc_issues, tool_version=_version(result),
+            is_variant="_AGES_" in sequence.name,
+            phenotypes=_phenotypes(sequence.phenotypes))
+
+
+def _sample_profile(sample):
+    profile = SampleProfile(id=sample.id, name=sample.name,
+            external_id=sample.external_id)
+    profile.genes = [_gene_hit("resfinder", r) for r in sample.resfinderresults] \
+            + [_gene_hit("amrfinder", r) for r in sample.amrfinderresults]
+    profile.point_mutations = [PointMutation(tool="pointfinder",
+        mutation=r.mutation, nuc_change=r.nuc_change, contig=None,
+        tool_version=_version(r), phenotypes=_phenotypes(r.phenotypes))
+        for r in sample.pointfinderresults] \
+        + [PointMutation(tool="amrfinder", mutation=r.mutation,
+            nuc_change=None, contig=_contig_name(r), tool_version=_version(r),
+            phenotypes=_phenotypes(r.phenotypes))
+            for r in sample.amrfinderpointresults]
+    for contig in sorted(sample.stored_contigs, key=lambda c: c.name):
+        mobtyper = contig.mobtyperresults
+        profile.contigs.append(ContigProfile(name=contig.name,
+            length=contig.length,
+            plasmids=[Plasmid(r.plasmid, r.identity, r.accession_number)
+                for r in contig.plasmidfinderresults],
+            mobility=Mobility(mobtyper.rep_type, mobtyper.relaxase_type,
+                mobtyper.mpf_type, mobtyper.predicted_mobility,
+                mobtyper.primary_cluster_id) if mobtyper is not None else None))
+    profile.species = [r.species for r in sample.speciesfinderresults]
+    profile.mlst = [MlstType(r.scheme_name, r.sequence_type, r.allele_types)
+            for r in sample.mlstresults]
+    return profile
+
+
+def get_sample_profiles(session, sample_ids: list) -> List[SampleProfile]:
+    """
+    AMR profiles (genes and point mutations with phenotypes, contigs with
+    plasmids and mobility, species, mlst) of samples, in order of sample_ids
+    (unknown ids are left out); the number of queries does not depend on the
+    number of samples or results (see sample_profile_options)
+    """
+    sample_ids = list(dict.fromkeys(sample_ids))
+    samples = {}
+    for start in range(0, len(sample_ids), ID_CHUNK_SIZE):
+        chunk = sample_ids[start:start+ID_CHUNK_SIZE]
+        statement = select(Sample).where(Sample.id.in_(chunk))\
+                .options(*sample_profile_options())
+        for sample in session.execute(statement).scalars():
+            samples[sample.id] = _sample_profile(sample)
+    return [samples[i] for i in sample_ids if i in samples]
+
+
+def get_sample_profile(session, sample_id: int) -> Optional[SampleProfile]:
+    """
+    AMR profile of a single sample (None if unknown), see get_sample_profiles
+    """
+    profiles = get_sample_profiles(session, [sample_id])
+    return profiles[0] if profiles else None
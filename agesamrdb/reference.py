@@ -0,0 +1,109 @@
+from sqlalchemy import select
+
+from .profiling import profiled
+
+
+class ReferenceIndex(object):
+    """
+    in-memory lookup of reference sequences (ResfinderSequence or
+    AmrfinderSequence): loads (accession, seq_fingerprint, id) of all rows in
+    a single query and resolves sequence ids of hits without further queries;
+    sequences added since are loaded by refresh
+    """
+
+    @profiled("load_reference_index")
+    def __init__(self, session, model):
+        self.model = model
+        self.by_accession = {}
+        self.by_fingerprint = {}
+        self.max_id = 0
+        self.refresh(session)
+
+    def refresh(self, session):
+        """
+        loads sequences with an id above the highest loaded id, e.g. AGES_
+        variants committed by concurrent importers
+        """
+        rows = session.execute(select(self.model.id, self.model.accession,
+            self.model.seq_fingerprint).where(self.model.id > self.max_id)
+            .order_by(self.model.id))
+        for sequence_id, accession, seq_fingerprint in rows:
+            self.add(accession, seq_fingerprint, sequence_id)
+
+    def add(self, accession, seq_fingerprint, sequence_id):
+        """
+        register a sequence, e.g. newly added AGES_ variant (first entry of a
+        fingerprint is kept)
+        """
+        self.by_accession.setdefault(accession, {})\
+                .setdefault(seq_fingerprint, sequence_id)
+        self.by_fingerprint.setdefault(seq_fingerprint, sequence_id)
+        self.max_id = max(self.max_id, sequence_id)
+
+    def get(self, accession, seq_fingerprint):
+        """
+        sequence id for accession: exact match of seq_fingerprint among the
+        sequences of the accession, else first entry (original entry), None
+        if accession is unknown
+        """
+        sequences = self.by_accession.get(accession)
+        if not sequences:
+            return None
+        if seq_fingerprint in sequences:
+            return sequences[seq_fingerprint]
+        return min(sequences.values())
+
+    def __contains__(self, seq_fingerprint):
+        """
+        sequence with seq_fingerprint is stored (under any accession)
+        """
+        return seq_fingerprint in self.by_fingerprint
+
+    def is_stored(self, session, seq_fingerprint):
+        """
+        sequence with seq_fingerprint is stored: checked in the index, on a
+        miss in the database (locking read, sees sequences committed by
+        concurrent importers since the index was loaded, which are added)
+        """
+        if seq_fingerprint in self.by_fingerprint:
+            return True
+        rows = session.execute(select(self.model.id, self.model.accession)
+                .where(self.model.seq_fingerprint == seq_fingerprint)
+                .order_by(self.model.id).with_for_update()).all()
+        for sequence_id, accession in rows:
+            self.add(accession, seq_fingerprint, sequence_id)
+        return bool(rows)
+
+
+# one index per database and model, loaded on first use in this process
+_reference_indexes = {}
+
+
+def get_reference_index(session, model):
+    """
+    returns process-wide ReferenceIndex of model for the database bound to
+    session (loaded once)
+    """
+    key = (str(session.get_bind().url), model)
+    if key not in _reference_indexes:
+        _reference_indexes[key] = ReferenceIndex(session, model)
+    return _reference_indexes[key]
+
+
+def refresh_reference_indexes(session):
+    """
+    loads sequences added since into all loaded indexes of the database bound
+    to session (see ReferenceIndex.refresh), e.g. by long-running importers
+    before each transaction
+    """
+    url = str(session.get_bind().url)
+    for (index_url, model), index in _reference_indexes.items():
+        if index_url == url:
+            index.refresh(session)
+
+
+def clear_reference_indexes():
+    """
+    drop all loaded indexes, e.g. after reference database was updated
+    """
+    _reference_indexes.clear()
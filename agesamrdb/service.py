@@ -0,0 +1,436 @@
+import os
+import json
+import time
+import queue
+import threading
+import traceback
+import multiprocessing
+from collections import OrderedDict
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from sqlalchemy.orm import Session
+
+from .cli import IMPORT_JOB_FIELDS
+from .models import Sample, ToolVersion, prepare_models
+from .interfaces import read_import, tool_version_args
+from .importlog import input_fingerprint, is_imported, write_logged_import, \
+        METHOD_RESULT_MODELS
+from .reference import clear_reference_indexes, refresh_reference_indexes
+from .engine import run_transaction, is_transient_error, write_engine, \
+        READ_ONLY
+from .util import get_or_create, enable_unit_of_work, LOOKUP_CACHE
+
+# job states, a job is finished if imported, skipped (input files were
+# already imported) or failed
+QUEUED = "queued"
+RUNNING = "running"
+IMPORTED = "imported"
+SKIPPED = "skipped"
+FAILED = "failed"
+FINISHED = (IMPORTED, SKIPPED, FAILED)
+
+JOB_DEFAULTS = {"mode": "fasta", "tool_version": "unknown", "bulk": False,
+        "chunk_size": 5000, "replace": False}
+
+
+def normalize_job(job: dict) -> dict:
+    """
+    checks fields of an import job (as returned by cli.import_job) and sets
+    defaults; input_path and assembly have to be absolute paths, since the
+    service does not share the working directory of the client
+    """
+    unknown = set(job) - set(IMPORT_JOB_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown job fields: {sorted(unknown)}")
+    job = {field: job.get(field) for field in IMPORT_JOB_FIELDS}
+    for field, default in JOB_DEFAULTS.items():
+        if job[field] is None:
+            job[field] = default
+    for field in ("input_path", "method"):
+        if not job[field]:
+            raise ValueError(f"job is missing mandatory field: {field}")
+    if job["method"] not in METHOD_RESULT_MODELS:
+        raise ValueError(f"unknown method: {job['method']} (one of "
+                + f"{', '.join(METHOD_RESULT_MODELS)})")
+    for field in ("input_path", "assembly"):
+        if job[field] and not os.path.isabs(job[field]):
+            raise ValueError(f"{field} is not an absolute path: {job[field]}")
+    return job
+
+
+def _sample_args(job):
+    sample_args = {}
+    if job["sample_name"]:
+        sample_args["name"] = job["sample_name"]
+    if job["external_id"]:
+        sample_args["external_id"] = job["external_id"]
+    return sample_args
+
+
+def _version_args(job):
+    return tool_version_args(job["method"], job["mode"], job["tool_version"],
+            job["db_version"], job["assembly"])
+
+
+class ImportJob(object):
+    """
+    import submitted to the service: job arguments, parsing future and state
+    """
+
+    def __init__(self, job_id, job, future, fingerprint):
+        self.id = job_id
+        self.job = job
+        self.future = future
+        self.fingerprint = fingerprint
+        self.status = QUEUED
+        self.message = None
+        self.submitted = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {"id": self.id, "status": self.status, "message": self.message,
+                "submitted": self.submitted, "finished": self.finished,
+                "job": self.job}
+
+
+class ImportService(object):
+    """
+    long-running import service: holds a single engine and session (in unit of
+    work mode, Sample/ToolVersion/Phenotype lookups and reference indexes stay
+    warm between imports); submitted jobs are parsed in an executor and written
+    by a single writer thread, which commits up to batch_size jobs (or the
+    jobs arriving within batch_delay seconds) in one transaction
+    a failing job is rolled back and marked failed, the other jobs of its
+    batch are written again in a new transaction (also after deadlocks)
+    workers: number of processes parsing inputs (1: a single thread)
+    cache_size: maximum number of memoized get_or_create lookups
+    history: number of finished jobs whose status is kept
+    retries: number of times a batch is written again after a deadlock
+    """
+
+    def __init__(self, engine, batch_size: int=10, batch_delay: float=0.5,
+            workers: int=1, cache_size: int=10000, history: int=1000,
+            retries: int=5):
+        self.engine = engine
+        self.retries = retries
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.history = history
+        prepare_models(engine)
+        # cached samples and versions are reused across commits
+        self.session = Session(write_engine(engine), expire_on_commit=False)
+        enable_unit_of_work(self.session, cache_size)
+        if workers > 1:
+            # workers are spawned: forking would copy the writer and http
+            # threads of this process (and their locks)
+            self.executor = ProcessPoolExecutor(max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.jobs = OrderedDict()
+        self.counts = {IMPORTED: 0, SKIPPED: 0, FAILED: 0}
+        self.transactions = 0
+        self.started = time.time()
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._stopping = False
+        self._writer = threading.Thread(target=self._write_jobs,
+                name="amrdb-writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, job: dict) -> dict:
+        """
+        queues an import job (see normalize_job), parsing starts immediately;
+        input files which were already imported (see importlog) are skipped
+        unless the job replaces previous results
+        returns status of the job
+        """
+        job = normalize_job(job)
+        try:
+            fingerprint = input_fingerprint(job["input_path"], job["method"],
+                    job["assembly"])
+        except OSError as e:
+            raise ValueError(f"input not readable: {e}")
+        imported = not job["replace"] and self._is_imported(job, fingerprint)
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("service is shutting down")
+            job_id = self._next_id
+            self._next_id += 1
+            future = None
+            if not imported:
+                future = self.executor.submit(read_import, job["input_path"],
+                        job["method"], job["assembly"])
+            import_job = ImportJob(job_id, job, future, fingerprint)
+            self.jobs[job_id] = import_job
+        if imported:
+            self._set_status(import_job, SKIPPED, "input files already imported")
+        else:
+            self._queue.put(import_job)
+        with self._lock:
+            return import_job.to_dict()
+
+    def _is_imported(self, job, fingerprint):
+        # own short-lived session, the writer's session is not shared; only
+        # reads (sqlite: does not wait for the write lock of the writer)
+        with self.engine.connect() as connection, Session(
+                connection.execution_options(**{READ_ONLY: True})) as session:
+            return is_imported(session, _sample_args(job),
+                    _version_args(job), job["method"], fingerprint)
+
+    def status(self, job_id: int, wait: float=None) -> dict:
+        """
+        status of a job (None if unknown), waits up to wait seconds for the
+        job to finish
+        """
+        with self._lock:
+            import_job = self.jobs.get(job_id)
+        if import_job is None:
+            return None
+        if wait:
+            import_job.done.wait(wait)
+        with self._lock:
+            return import_job.to_dict()
+
+    def summary(self) -> dict:
+        """
+        state of the service: number of jobs per state and transactions
+        """
+        with self._lock:
+            pending = {QUEUED: 0, RUNNING: 0}
+            for import_job in self.jobs.values():
+                if import_job.status in pending:
+                    pending[import_job.status] += 1
+            return {"database": self.engine.url.render_as_string(
+                        hide_password=True),
+                    "uptime": round(time.time() - self.started, 3),
+                    "transactions": self.transactions,
+                    **pending, **self.counts}
+
+    def reload(self):
+        """
+        drops reference indexes and memoized lookups (e.g. after the
+        reference database was updated), done by the writer between batches
+        """
+        self._queue.put("reload")
+
+    def shutdown(self, wait: bool=True):
+        """
+        stops accepting jobs, queued jobs are still imported
+        """
+        with self._lock:
+            self._stopping = True
+        self._queue.put(None)
+        if wait:
+            self._writer.join()
+        self.executor.shutdown()
+
+    def _set_status(self, import_job, status, message=None):
+        with self._lock:
+            import_job.status = status
+            import_job.message = message
+            if status in FINISHED:
+                import_job.finished = time.time()
+                self.counts[status] += 1
+                import_job.future = None
+                import_job.done.set()
+                self._forget_finished()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, import_job in self.jobs.items()
+                if import_job.done.is_set()]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    def _next_batch(self):
+        """
+        blocks for the next job, then collects further jobs until batch_size
+        or batch_delay is reached; returns (batch, stop, reload)
+        """
+        item = self._queue.get()
+        if not isinstance(item, ImportJob):
+            return [], item is None, item == "reload"
+        batch = [item]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if not isinstance(item, ImportJob):
+                # handled after this batch
+                self._queue.put(item)
+                break
+            batch.append(item)
+        return batch, False, False
+
+    def _write_jobs(self):
+        while True:
+            batch, stop, reload = self._next_batch()
+            if reload:
+                clear_reference_indexes()
+                enable_unit_of_work(self.session,
+                        self.session.info[LOOKUP_CACHE].maxsize)
+            for import_job in batch:
+                self._set_status(import_job, RUNNING)
+            while batch:
+                batch = self._write_batch(batch)
+            if stop:
+                self.session.close()
+                return
+
+    def _write_job(self, session, import_job):
+        """
+        returns False if the input files were already imported
+        """
+        results = import_job.future.result()
+        job = import_job.job
+        associated_sample = get_or_create(session, Sample, **_sample_args(job))
+        version = get_or_create(session, ToolVersion, **_version_args(job))
+        return write_logged_import(results, associated_sample, session,
+                version, job["method"], import_job.fingerprint,
+                input_path=job["input_path"], replace=job["replace"],
+                bulk=job["bulk"], chunk_size=job["chunk_size"])
+
+    def _write_batch(self, batch):
+        """
+        writes jobs of batch in a single transaction (repeated on deadlocks,
+        see engine.run_transaction); returns the jobs to be written again if
+        a job failed (empty list otherwise)
+        """
+        failed = []
+
+        def write(session):
+            # sequences (AGES_ variants) added by other importers since the
+            # last batch
+            refresh_reference_indexes(session)
+            written = {}
+            for import_job in batch:
+                try:
+                    written[import_job.id] = self._write_job(session, import_job)
+                except Exception as e:
+                    if not is_transient_error(e):
+                        failed.append(import_job)
+                    raise
+            return written
+
+        try:
+            written = run_transaction(self.session, write, retries=self.retries)
+        except Exception as e:
+            traceback.print_exception(type(e), e, e.__traceback__)
+            if failed:
+                self._set_status(failed[0], FAILED, repr(e))
+                return [j for j in batch if j is not failed[0]]
+            # commit failed or retries exhausted
+            for import_job in batch:
+                self._set_status(import_job, FAILED, repr(e))
+            return []
+        with self._lock:
+            self.transactions += 1
+        for import_job in batch:
+            if written[import_job.id]:
+                self._set_status(import_job, IMPORTED)
+            else:
+                self._set_status(import_job, SKIPPED,
+                        "input files already imported")
+        return []
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    json api of an ImportService (server.service):
+    POST /jobs (job as json) - submit import job, returns status of the job
+    GET /jobs/<id>?wait=<seconds> - status of a job (waits until finished)
+    GET /status - state of the service
+    POST /reload - drop cached reference indexes and lookups
+    POST /shutdown - import queued jobs and stop
+    """
+
+    def _respond(self, code, content):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        service = self.server.service
+        if parts == ["status"]:
+            return self._respond(200, service.summary())
+        if len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            wait = parse_qs(url.query).get("wait", [None])[0]
+            try:
+                wait = float(wait) if wait else None
+            except ValueError:
+                return self._respond(400, {"error": f"invalid wait: {wait}"})
+            status = service.status(int(parts[1]), wait=wait)
+            if status is None:
+                return self._respond(404, {"error": f"unknown job: {parts[1]}"})
+            return self._respond(200, status)
+        self._respond(404, {"error": f"unknown path: {url.path}"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path.strip("/")
+        service = self.server.service
+        if path == "jobs":
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                status = service.submit(json.loads(self.rfile.read(length)))
+            except (ValueError, RuntimeError) as e:
+                return self._respond(400, {"error": str(e)})
+            except Exception as e:
+                # e.g. database errors of the check of previous imports
+                traceback.print_exception(type(e), e, e.__traceback__)
+                return self._respond(500, {"error": repr(e)})
+            return self._respond(202, status)
+        if path == "reload":
+            service.reload()
+            return self._respond(202, {})
+        if path == "shutdown":
+            self._respond(202, {})
+            # serve_forever is stopped from another thread (not the handler)
+            threading.Thread(target=self.server.shutdown).start()
+            return
+        self._respond(404, {"error": f"unknown path: {path}"})
+
+    def address_string(self):
+        # client_address of unix sockets is empty
+        return str(self.client_address[0]) if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def make_server(service: ImportService, socket_path: str=None,
+        host: str="127.0.0.1", port: int=8765, verbose: bool=False):
+    """
+    http server of service on unix socket socket_path (an existing socket
+    file is replaced) or, if not given, on host:port
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, ServiceRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
@@ -0,0 +1,102 @@
+"""
+materialized sample x phenotype matrix (table sample_phenotype, see
+models.SamplePhenotype): which phenotypes a sample is predicted resistant to
+by which tool, with number of results (evidence_count) and best identity, so
+dashboards read one indexed table instead of joining results, reference
+sequences and phenotype associations of all tools.
+entries of a sample are rewritten by insert_into_db after each import of
+resfinder, pointfinder or amrfinder results; update_resfinder_database.py
+refreshes all samples if phenotype associations of reference sequences
+changed
+"""
+from sqlalchemy import select, insert, delete, func, literal, null
+
+from .models import SamplePhenotype, ResfinderResult, AmrfinderResult, \
+        PointfinderResult, AmrfinderPointResult, \
+        resfinder_phenotype_association_table, \
+        amrfinder_phenotype_association_table, \
+        pointfinder_phenotype_association_table, \
+        amrfinder_point_phenotype_association_table
+from .profiling import profiled
+
+# maximum number of sample ids per IN clause
+ID_CHUNK_SIZE = 500
+
+# tools of the summary: result model and the join to its phenotypes (acquired
+# genes via their reference sequence, point mutations via the result)
+TOOL_PHENOTYPES = {
+        "resfinder": (ResfinderResult, resfinder_phenotype_association_table,
+            "sequence_id", "sequence_id"),
+        "amrfinder": (AmrfinderResult, amrfinder_phenotype_association_table,
+            "sequence_id", "sequence_id"),
+        "pointfinder": (PointfinderResult,
+            pointfinder_phenotype_association_table, "id",
+            "pointfinder_result_id"),
+        "amrfinder_point": (AmrfinderPointResult,
+            amrfinder_point_phenotype_association_table, "id",
+            "amrfinder_point_result_id"),
+}
+# tools written by an import of method (see interfaces.insert_into_db)
+METHOD_TOOLS = {
+        "resfinder": ["resfinder"],
+        "pointfinder": ["pointfinder"],
+        "amrfinder": ["amrfinder", "amrfinder_point"],
+}
+
+
+def summary_statement(tool: str, sample_ids: list=None):
+    """
+    select of the sample_phenotype entries of tool (columns sample_id,
+    phenotype_id, tool, evidence_count, best_identity), of all samples or of
+    sample_ids
+    """
+    model, association, result_key, association_key = TOOL_PHENOTYPES[tool]
+    identity = func.max(model.identity) if hasattr(model, "identity") \
+            else null()
+    statement = select(model.sample_id, association.c.phenotype_id,
+            literal(tool).label("tool"),
+            func.count(model.id.distinct()).label("evidence_count"),
+            identity.label("best_identity"))\
+            .select_from(model)\
+            .join(association, association.c[association_key]
+                    == getattr(model, result_key))\
+            .group_by(model.sample_id, association.c.phenotype_id)
+    if sample_ids is not None:
+        statement = statement.where(model.sample_id.in_(sample_ids))
+    return statement
+
+
+@profiled("refresh_sample_phenotypes")
+def refresh_sample_phenotypes(session, sample_ids: list=None,
+        tools: list=None) -> int:
+    """
+    rewrites sample_phenotype entries of tools (default: all tools) from the
+    results in the database (within the transaction of session, pending
+    results must be flushed)
+    params:
+    session: sqlalchemy session object
+    sample_ids: ids of samples to refresh, None refreshes all samples
+    tools: names of TOOL_PHENOTYPES, e.g. METHOD_TOOLS[method]
+    returns number of written entries
+    """
+    tools = list(TOOL_PHENOTYPES) if tools is None else tools
+    if sample_ids is None:
+        chunks = [None]
+    else:
+        sample_ids = list(sample_ids)
+        chunks = [sample_ids[start:start+ID_CHUNK_SIZE]
+                for start in range(0, len(sample_ids), ID_CHUNK_SIZE)]
+    columns = ["sample_id", "phenotype_id", "tool", "evidence_count",
+            "best_identity"]
+    written = 0
+    for chunk in chunks:
+        condition = SamplePhenotype.tool.in_(tools)
+        if chunk is not None:
+            condition = condition & SamplePhenotype.sample_id.in_(chunk)
+        session.execute(delete(SamplePhenotype).where(condition),
+                execution_options={"synchronize_session": False})
+        for tool in tools:
+            result = session.execute(insert(SamplePhenotype).from_select(
+                columns, summary_statement(tool, chunk)))
+            written += max(result.rowcount, 0)
+    return written
@@ -1,5 +1,9 @@
 #
-from Bio import SeqRecord
+from collections import OrderedDict
+from sqlalchemy import inspect, insert
+from sqlalchemy.exc import IntegrityError
+import hashlib
+import json
 import zlib
 
 ADAPT_COLS = ["Start","Stop","isBegin","isEnd","start1","end1","start2","end2","orfBegin","orfEnd",
@@ -9,6 +13,28 @@ def calc_sequence_hash(sequence: str):
     return hex(zlib.crc32(sequence.encode('ascii')))
 
 
+def calc_sequence_fingerprint(sequence: str) -> int:
+    """
+    64-bit blake2b digest of sequence as signed integer (fits BIGINT), used to
+    identify sequences (crc32_hash is only kept for naming AGES_ variants)
+    """
+    digest = hashlib.blake2b(sequence.encode('ascii'), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def calc_natural_key(values: list) -> str:
+    """
+    digest (32 hex characters) of the values of a natural key, used as unique
+    column since unique indexes do not apply to rows with NULL values;
+    values are compared as strings (e.g. external_id 1 and "1"), None if all
+    values are None
+    """
+    if all(v is None for v in values):
+        return None
+    key = json.dumps([None if v is None else str(v) for v in values])
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
 def gene_quality_control(seqrecord, ignore_missing_stop=True):
     """
     some basic quality control about the sequence :start and stopcodon, 
@@ -29,20 +55,141 @@ def gene_quality_control(seqrecord, ignore_missing_stop=True):
         return None
 
 
+# keys in session.info used by unit of work mode
+UNIT_OF_WORK = "agesamrdb_unit_of_work"
+LOOKUP_CACHE = "agesamrdb_lookup_cache"
+
+
+class LookupCache(OrderedDict):
+    """
+    memoized get_or_create results of a session, keyed by (model, kwargs),
+    least recently used entries are dropped beyond maxsize (None: unbounded)
+    """
+
+    def __init__(self, maxsize=None):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get_instance(self, key):
+        instance = self.get(key)
+        if instance is None:
+            return None
+        if inspect(instance).transient or inspect(instance).detached:
+            # created in a transaction that was rolled back since
+            del self[key]
+            return None
+        self.move_to_end(key)
+        return instance
+
+    def set_instance(self, key, instance):
+        self[key] = instance
+        self.move_to_end(key)
+        if self.maxsize is not None and len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+def enable_unit_of_work(session, cache_size=None):
+    """
+    unit of work mode of a session: get_or_create results are memoized per
+    session (at most cache_size entries, None: unbounded) and neither
+    get_or_create nor the insert functions commit, they only flush - the
+    caller commits (or rolls back) a whole import as a single transaction
+    """
+    session.info[UNIT_OF_WORK] = True
+    session.info[LOOKUP_CACHE] = LookupCache(cache_size)
+
+
+def commit_or_flush(session):
+    """
+    commits session, or only flushes it in unit of work mode
+    """
+    if session.info.get(UNIT_OF_WORK):
+        session.flush()
+    else:
+        session.commit()
+
+
+def _insert_ignore_statement(session, table):
+    # insert skipping rows which violate a unique constraint (None if the
+    # dialect has no such statement)
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        return mysql_insert(table).on_duplicate_key_update(id=table.c.id)
+    return None
+
+
+def insert_or_ignore(session, model, **kwargs):
+    """
+    inserts row of model unless it violates a unique constraint (e.g. the row
+    was inserted by a concurrent importer): ON CONFLICT DO NOTHING (sqlite),
+    ON DUPLICATE KEY UPDATE (mysql/mariadb), savepoint otherwise
+    """
+    insert_many_or_ignore(session, model, [kwargs])
+
+
+def insert_many_or_ignore(session, model, records: list):
+    """
+    inserts rows of model (list of parameter dicts) as insert_or_ignore, rows
+    violating a unique constraint are skipped; a single executemany on sqlite
+    and mysql/mariadb, one savepoint per row otherwise
+    """
+    if not records:
+        return
+    table = model.__table__
+    statement = _insert_ignore_statement(session, table)
+    if statement is not None:
+        if len(records) == 1:
+            session.execute(statement.values(**records[0]))
+        else:
+            session.execute(statement, records)
+        return
+    for record in records:
+        try:
+            with session.begin_nested():
+                session.execute(insert(table).values(**record))
+        except IntegrityError:
+            pass
+
+
 def get_or_create(session, model, **kwargs):
     """
     generic function similar to what's known from django ORM
     creates new completely black item if all kwargs are None (assumed that this
     behaviour is allowed in database and as cli-args)
+    models with a natural key (natural_key_columns) are created with
+    insert_or_ignore, concurrent importers get the same item
+    in unit of work mode (see enable_unit_of_work) results are memoized and new
+    items are flushed instead of committed
     """
+    blank = all(v is None for v in kwargs.values())
+    cache = session.info.get(LOOKUP_CACHE)
+    key = (model, frozenset(kwargs.items()))
+    if cache is not None and not blank:
+        instance = cache.get_instance(key)
+        if instance is not None:
+            return instance
+
     instance = session.query(model).filter_by(**kwargs).first()
-    if not all(v is None for v in kwargs.values()) and instance is not None:
-        return instance
-    else:
+    key_columns = getattr(model, "natural_key_columns", None)
+    if instance is None and not blank and key_columns \
+            and set(kwargs) <= set(key_columns):
+        insert_or_ignore(session, model, **kwargs)
+        # locking read: sees the row of a concurrent importer (mysql)
+        natural_key = calc_natural_key([kwargs.get(c) for c in key_columns])
+        instance = session.query(model).filter_by(natural_key=natural_key)\
+                .with_for_update().one()
+        commit_or_flush(session)
+    elif blank or instance is None:
         instance = model(**kwargs)
         session.add(instance)
-        session.commit()
-        return instance
+        commit_or_flush(session)
+    if cache is not None and not blank:
+        cache.set_instance(key, instance)
+    return instance
 
 
 def apply_offset_to_partial_contigs(df, contig_id_col="seqID"):
@@ -1,116 +1,106 @@
 #!/usr/bin/env python
 
-import os
 import argparse
+from contextlib import nullcontext
 
-from agesamrdb.models import Base, Sample, ToolVersion
-from agesamrdb.interfaces import read_result, insert_into_db
-from agesamrdb.util import get_or_create
+from agesamrdb.cli import add_database_arguments, add_import_arguments, \
+        add_parse_cache_arguments
 
-from sqlalchemy import create_engine, inspect 
-from sqlalchemy.orm import Session
+# agesamrdb, sqlalchemy and pandas are imported in main and run_import (after
+# parsing of arguments), --help and invalid arguments return without loading
+# them; parsers load further dependencies (e.g. Biopython) only if needed
 
 # CLI definitions
 parser = argparse.ArgumentParser(description="agres - helperscript to add " \
         + "single result to database - methods allowed are: " \
         + "resfinder, bakta, isescan, mobtyper")
 # db definitions
-parser.add_argument('-d','--database',dest='database',
-        help="mysql database name or path to sqlite-db [./agres.db]",
-        default="./agres.db")
-parser.add_argument('-H','--hostname',dest='hostname', 
-        help="mysql hostname; if not provided sqlite-db will be used",
-        required=False)
-parser.add_argument('-u','--user',dest='dbuser', help="mysql database username",
-        required=False)
-parser.add_argument('-p','--password',dest='mariadbpassword',
-        help="mysql password", required=False)
-# input specifications
-parser.add_argument('-i', '--input_path', dest='input_path',
-        help="path to resfinder output dir or tabular input file", required=True)
-parser.add_argument('--method', dest='method',
-        help="which tools output should be imported", required=True)
-parser.add_argument('--mode', dest='mode', 
-        help='define which input type was used (fasta/fastq) ' \
-                + '- only in use for resfinder [fasta]', default='fasta')
-parser.add_argument('--tool_version', dest='tool_version',
-        help="string to describe the version of the tool used [unknown]",
-        default='unknown')
-parser.add_argument('--db_version', dest='db_version',
-        help="string to describe database version (optional)", required=False)
-
-# optional reference to external id or provide a sample_name or both
-parser.add_argument('--external_id', dest='external_id', 
-        help="optional external id for other db", required=False,
-        metavar="INT")
-parser.add_argument('--sample_name', dest='sample_name', 
-        help="optional sample name to be displayed", required=False,
-        metavar="NAME")
-parser.add_argument('--assembly', dest='assembly',
-        help="imports contig in Fasta-format (dna) to allow visualization",
-        required=False, metavar="FASTA")
+add_database_arguments(parser)
+# input specifications (shared with amrdb_submit.py)
+add_import_arguments(parser)
+add_parse_cache_arguments(parser)
+parser.add_argument('--profile', dest='profile', metavar="JSON",
+        help="write wall time per stage and sql statements per table as json")
+parser.add_argument('--profile_dump', dest='profile_dump', metavar="FILE",
+        help="write cProfile statistics (pstats format) of the import; "
+        + "the hottest functions are added to the --profile report")
 
 
 def main():
 
     args = parser.parse_args()
 
-    # establish connection to database (mysql or sqlite)
-    if args.hostname:
-        engine = create_engine("mysql+mysqlconnector://%s:%s@%s:3306/%s" %
-                        (args.dbuser, args.mariadbpassword, args.hostname, 
-                            args.database))
-    else:
-        engine = create_engine("sqlite:///%s" % args.database)
-    session = Session(engine)
-    Base.prepare(engine)
+    from agesamrdb.engine import engine_from_args
+    from agesamrdb.profiling import ImportProfile
+    from agesamrdb.cache import parse_cache_from_args
 
-    read_kwargs = {}
-    insert_kwargs = {}
+    # establish connection to database (mysql or sqlite)
+    engine = engine_from_args(args)
+    parse_cache_from_args(args)
+
+    profile = None
+    if args.profile or args.profile_dump:
+        profile = ImportProfile()
+    with profile.activate(engine, cprofile=bool(args.profile_dump)) \
+            if profile else nullcontext():
+        run_import(args, engine)
+
+    if args.profile:
+        profile.write_report(args.profile)
+    if args.profile_dump:
+        profile.dump_cprofile(args.profile_dump)
+
+
+def run_import(args, engine):
+    from sqlalchemy.orm import Session
+    from agesamrdb.models import Sample, ToolVersion, prepare_models
+    from agesamrdb.interfaces import read_import, tool_version_args
+    from agesamrdb.importlog import input_fingerprint, is_imported, \
+            write_logged_import
+    from agesamrdb.engine import run_transaction
+    from agesamrdb.util import get_or_create, enable_unit_of_work
+    from agesamrdb.profiling import stage
 
-    if not args.assembly:
-        read_kwargs["extract_coordinates"] = False
-    else:
-        insert_kwargs["assembly_path"] = args.assembly  
+    session = Session(engine)
+    # whole import is a single transaction
+    enable_unit_of_work(session)
+    with stage("prepare"):
+        prepare_models(engine)
 
-    # interaction with data in database: fetch sample, read results to df and
-    # write to database
     sample_args = {}
     if args.sample_name:
         sample_args["name"] = args.sample_name
     if args.external_id:
         sample_args["external_id"] = args.external_id
-    associated_sample = get_or_create(session, Sample, **sample_args)
-
-    # create db entry
-    mode = args.mode
-    if args.method == "resfinder" and not args.assembly:
-        mode = "fastq"
-    version_args = {
-            "db_version": args.db_version,
-            "tool_name": args.method,
-            "input_type": mode,
-            "tool_version": args.tool_version,
-        }
-    # remove optional parameters which are nullable (None not accepted as value)
-    for key in list(version_args.keys()):
-        if version_args[key] == None:
-            del version_args[key]
-    version = get_or_create(session, ToolVersion, **version_args)
-
-    results_df = read_result(args.input_path, args.method, **read_kwargs)
-    
-    insert_into_db(results_df, args.method, associated_sample, session, 
-            version_associated=version, **insert_kwargs)
-
-    if (args.method == "resfinder" 
-            and os.path.exists(f"{args.input_path}/PointFinder_results.txt")):
-        pointfinder_df = read_result(args.input_path, "pointfinder", 
-                **read_kwargs)
-        insert_into_db(pointfinder_df, "pointfinder", associated_sample,
-                session, version_associated=version, **insert_kwargs)
-
-    session.commit()
+    version_args = tool_version_args(args.method, args.mode,
+            args.tool_version, args.db_version, args.assembly)
+
+    # identical input files already imported: skipped without parsing
+    fingerprint = input_fingerprint(args.input_path, args.method, args.assembly)
+    imported = not args.replace and is_imported(session, sample_args,
+            version_args, args.method, fingerprint)
+    # ends transaction of the lookup (read snapshot) before parsing
+    session.rollback()
+    if imported:
+        print(f"{args.method} result {args.input_path} already imported, skipped")
+        session.close()
+        return
+
+    # results are read before the transaction starts (sqlite: holds the
+    # write lock), the transaction is repeated on deadlocks
+    results = read_import(args.input_path, args.method, args.assembly)
+
+    def write(session):
+        # interaction with data in database: fetch sample and write results
+        associated_sample = get_or_create(session, Sample, **sample_args)
+        version = get_or_create(session, ToolVersion, **version_args)
+        return write_logged_import(results, associated_sample, session,
+                version, args.method, fingerprint, input_path=args.input_path,
+                replace=args.replace, bulk=args.bulk,
+                chunk_size=args.chunk_size)
+
+    if not run_transaction(session, write):
+        print(f"{args.method} result {args.input_path} already imported, skipped")
     session.close()
 
 
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import sys
+import argparse
+
+from agesamrdb.cli import add_database_arguments, add_parse_cache_arguments
+
+# agesamrdb, sqlalchemy and pandas are imported in main (after parsing of
+# arguments), --help and invalid arguments return without loading them
+
+# CLI definitions
+parser = argparse.ArgumentParser(description="agres - helperscript to add " \
+        + "results of many samples and methods in a single process, " \
+        + "driven by a manifest (tsv with header or json records) with " \
+        + "columns: sample_name, external_id, method, input_path, assembly, " \
+        + "tool_version, db_version, mode")
+# db definitions
+add_database_arguments(parser)
+# input specifications
+parser.add_argument('-m', '--manifest', dest='manifest',
+        help="path to manifest (.tsv or .json)", required=True)
+parser.add_argument('--commit', dest='commit', choices=["sample", "batch"],
+        help="commit after each sample or once for the whole batch [sample]",
+        default="sample")
+parser.add_argument('--workers', dest='workers', type=int,
+        help="number of processes parsing inputs in parallel, database is " \
+        + "written by a single process [1]", default=1, metavar="INT")
+parser.add_argument('--queue_size', dest='queue_size', type=int,
+        help="maximum number of parsed inputs waiting to be written " \
+        + "[2 x workers]", required=False, metavar="INT")
+parser.add_argument('--bulk', dest='bulk', action='store_true',
+        help="write generic results (bakta, isescan, mobtyper, plasmidfinder, "
+        + "phispy, speciesfinder, mlst) in bulk via executemany")
+parser.add_argument('--chunk_size', dest='chunk_size', type=int,
+        help="rows per executemany in --bulk mode [5000]", default=5000,
+        metavar="INT")
+parser.add_argument('--replace', dest='replace', action='store_true',
+        help="delete results of previous imports (same sample, tool version "
+        + "and method) instead of skipping identical input files")
+add_parse_cache_arguments(parser)
+
+
+def main():
+
+    args = parser.parse_args()
+
+    from agesamrdb.models import prepare_models
+    from agesamrdb.batch import read_manifest, import_manifest
+    from agesamrdb.engine import engine_from_args
+    from agesamrdb.cache import parse_cache_from_args
+    from sqlalchemy.orm import Session
+
+    # establish connection to database (mysql or sqlite)
+    engine = engine_from_args(args)
+    # before the workers are started (configured via the environment)
+    parse_cache_from_args(args)
+    # cached samples and versions are reused across commits
+    session = Session(engine, expire_on_commit=False)
+    prepare_models(engine)
+
+    manifest_df = read_manifest(args.manifest)
+    status_df = import_manifest(manifest_df, session, commit=args.commit,
+            workers=args.workers, queue_size=args.queue_size, bulk=args.bulk,
+            chunk_size=args.chunk_size, replace=args.replace)
+    session.close()
+
+    failed = status_df[status_df["status"] == "failed"]
+    skipped = (status_df["status"] == "skipped").sum()
+    print(f"imported {len(status_df) - len(failed) - skipped} of "
+            + f"{len(status_df)} results ({skipped} already imported)")
+    if not failed.empty:
+        print(failed[["sample_name","external_id","method","input_path",
+            "message"]].to_string(), file=sys.stderr)
+        sys.exit(1)
+
+
+if  __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+
+from agesamrdb.cli import add_database_arguments
+
+# agesamrdb, sqlalchemy, pandas and scipy are imported in main (after parsing
+# of arguments), --help and invalid arguments return without loading them
+
+FEATURES = ["resfinder", "amrfinder", "plasmidfinder", "isescan"]
+
+# CLI definitions
+parser = argparse.ArgumentParser(description="agres - exports a sparse " \
+        + "presence/absence matrix (samples x genes, replicons or IS " \
+        + "families) with its row and column labels as npz file, e.g. for " \
+        + "clustering; needs scipy")
+# db definitions
+add_database_arguments(parser)
+# export specifications
+parser.add_argument('--features', dest='features', nargs="+",
+        choices=FEATURES, default=["resfinder", "amrfinder"],
+        help="columns: reference sequences (resfinder, amrfinder, incl. " \
+        + "AGES_ variants), replicons (plasmidfinder) or IS families " \
+        + "(isescan) [resfinder amrfinder]")
+parser.add_argument('-o', '--output', dest='output',
+        help="path to output file (.npz)", required=True)
+parser.add_argument('--sample_ids', dest='sample_ids',
+        help="file with database ids of the samples to export (one per " \
+        + "line); if not provided all samples with results are exported",
+        required=False, metavar="PATH")
+parser.add_argument('--tool_version', dest='tool_version',
+        help="export only results of this tool version", required=False)
+parser.add_argument('--db_version', dest='db_version',
+        help="export only results of this database version", required=False)
+parser.add_argument('--imported_since', dest='imported_since',
+        type=datetime.datetime.fromisoformat, metavar="DATE",
+        help="export only results imported at or after DATE (iso format, " \
+        + "e.g. 2024-01-31)", required=False)
+parser.add_argument('--imported_before', dest='imported_before',
+        type=datetime.datetime.fromisoformat, metavar="DATE",
+        help="export only results imported before DATE (iso format)",
+        required=False)
+parser.add_argument('--counts', dest='counts', action='store_true',
+        help="number of results per sample and feature instead of 1")
+parser.add_argument('--chunk_size', dest='chunk_size', type=int,
+        help="(sample, feature) pairs read at once [100000]", default=100000,
+        metavar="INT")
+
+
+def read_sample_ids(path: str) -> list:
+    with open(path) as fh:
+        return [int(line) for line in fh if line.strip()]
+
+
+def main():
+
+    args = parser.parse_args()
+
+    from agesamrdb.models import prepare_models
+    from agesamrdb.engine import engine_from_args
+    from agesamrdb.matrix import presence_matrix
+
+    sample_ids = read_sample_ids(args.sample_ids) if args.sample_ids else None
+
+    # establish connection to database (mysql or sqlite)
+    engine = engine_from_args(args)
+    prepare_models(engine)
+
+    matrix = presence_matrix(engine, args.features, sample_ids=sample_ids,
+            tool_version=args.tool_version, db_version=args.db_version,
+            imported_since=args.imported_since,
+            imported_before=args.imported_before, counts=args.counts,
+            chunk_size=args.chunk_size)
+    matrix.save(args.output)
+    rows, columns = matrix.matrix.shape
+    print(f"exported {rows} samples x {columns} features "
+            + f"({matrix.matrix.nnz} entries) to {args.output}")
+
+
+if  __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import argparse
+
+from agesamrdb.cli import add_database_arguments
+
+# agesamrdb, sqlalchemy and pyarrow are imported in main (after parsing of
+# arguments), --help and invalid arguments return without loading them
+
+# CLI definitions
+parser = argparse.ArgumentParser(description="agres - exports all result " \
+        + "tables to parquet files (denormalized, partitioned by buckets of " \
+        + "samples or tool version); repeated exports to the same directory " \
+        + "only write samples which were added or imported into since; " \
+        + "needs pyarrow")
+# db definitions
+add_database_arguments(parser)
+# export specifications
+parser.add_argument('-o', '--output', dest='output',
+        help="output directory", required=True)
+parser.add_argument('--partition_by', dest='partition_by',
+        choices=["sample", "version"], default="sample",
+        help="directories by buckets of samples or by tool version [sample]")
+parser.add_argument('--bucket_size', dest='bucket_size', type=int,
+        help="consecutive sample ids per file [1000]", default=1000,
+        metavar="INT")
+parser.add_argument('--full', dest='full', action='store_true',
+        help="export all samples, also if the output directory contains " \
+        + "a previous export")
+parser.add_argument('--compression', dest='compression', default="snappy",
+        choices=["snappy", "zstd", "gzip", "none"],
+        help="parquet compression [snappy]")
+
+
+def main():
+
+    args = parser.parse_args()
+
+    from agesamrdb.models import prepare_models
+    from agesamrdb.engine import engine_from_args
+    from agesamrdb.parquet import export_parquet
+
+    # establish connection to database (mysql or sqlite)
+    engine = engine_from_args(args)
+    prepare_models(engine)
+
+    rows = export_parquet(engine, args.output,
+            partition_by=args.partition_by, bucket_size=args.bucket_size,
+            full=args.full, compression=args.compression)
+    for table, count in rows.items():
+        print(f"{table}: {count} rows")
+
+
+if  __name__ == "__main__":
+    main()
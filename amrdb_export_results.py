@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import argparse
+
+from agesamrdb.cli import add_database_arguments
+
+# agesamrdb, sqlalchemy and pandas are imported in main (after parsing of
+# arguments), --help and invalid arguments return without loading them
+
+METHODS = ["resfinder", "amrfinder", "pointfinder", "amrfinder_point"]
+
+# CLI definitions
+parser = argparse.ArgumentParser(description="agres - exports all results " \
+        + "of a method (one row per result and phenotype) of many samples " \
+        + "as tab-separated file, written in chunks")
+# db definitions
+add_database_arguments(parser)
+# export specifications
+parser.add_argument('--method', dest='method', choices=METHODS,
+        help="results to export: genes (resfinder, amrfinder) or point " \
+        + "mutations (pointfinder, amrfinder_point)", required=True)
+parser.add_argument('-o', '--output', dest='output',
+        help="path to output file (.tsv, .tsv.gz)", required=True)
+parser.add_argument('--sample_ids', dest='sample_ids',
+        help="file with database ids of the samples to export (one per " \
+        + "line); if not provided all samples are exported", required=False,
+        metavar="PATH")
+parser.add_argument('--tool_version', dest='tool_version',
+        help="export only results of this tool version", required=False)
+parser.add_argument('--db_version', dest='db_version',
+        help="export only results of this database version", required=False)
+parser.add_argument('--chunk_size', dest='chunk_size', type=int,
+        help="rows read and written at once [100000]", default=100000,
+        metavar="INT")
+
+
+def read_sample_ids(path: str) -> list:
+    with open(path) as fh:
+        return [int(line) for line in fh if line.strip()]
+
+
+def main():
+
+    args = parser.parse_args()
+
+    from agesamrdb.models import prepare_models
+    from agesamrdb.engine import engine_from_args
+    from agesamrdb.frames import export_results
+
+    sample_ids = read_sample_ids(args.sample_ids) if args.sample_ids else None
+
+    # establish connection to database (mysql or sqlite)
+    engine = engine_from_args(args)
+    prepare_models(engine)
+
+    rows = export_results(engine, args.output, args.method,
+            sample_ids=sample_ids, tool_version=args.tool_version,
+            db_version=args.db_version, chunk_size=args.chunk_size)
+    print(f"exported {rows} rows to {args.output}")
+
+
+if  __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import sys
+import argparse
+
+from agesamrdb.cli import add_database_arguments
+
+# agesamrdb, sqlalchemy and numpy are imported in main (after parsing
+# of arguments), --help and invalid arguments return without loading them
+
+# CLI definitions
+parser = argparse.ArgumentParser(description="agres - finds the stored " \
+        + "reference sequences and AGES_ variants closest to query sequences " \
+        + "(identity estimated from shared k-mers, no alignment) and writes " \
+        + "them as tab-separated table to stdout")
+# db definitions
+add_database_arguments(parser)
+# query specifications
+parser.add_argument('-q', '--query', dest='query', metavar="FASTA",
+        help="fasta file with query sequences", required=False)
+parser.add_argument('--sequence', dest='sequence',
+        help="single query sequence", required=False)
+parser.add_argument('--reference', dest='reference',
+        choices=["resfinder", "amrfinder"], default="resfinder",
+        help="sequences to search: resfinder (nucleotide) or amrfinder " \
+        + "(protein, nucleotide queries are translated) [resfinder]")
+parser.add_argument('--top_k', dest='top_k', type=int, default=10,
+        help="number of closest sequences per query [10]", metavar="INT")
+parser.add_argument('--min_identity', dest='min_identity', type=float,
+        default=0.0, help="minimum estimated identity (0-1) [0]",
+        metavar="FLOAT")
+parser.add_argument('--kmer_index', dest='kmer_index', metavar="DIR",
+        help="directory keeping the k-mer index between runs, updated " \
+        + "with sequences added since [$AGESAMRDB_KMER_INDEX]; without it " \
+        + "the index is built for this run", required=False)
+
+
+def main():
+
+    args = parser.parse_args()
+    if not args.query and not args.sequence:
+        parser.error("one of -q/--query or --sequence is required")
+
+    from sqlalchemy.orm import Session
+    from agesamrdb.models import prepare_models, ResfinderSequence, \
+            AmrfinderSequence
+    from agesamrdb.engine import engine_from_args
+    from agesamrdb.fasta import read_fasta
+    from agesamrdb.kmers import nearest_sequences
+
+    model = {"resfinder": ResfinderSequence,
+            "amrfinder": AmrfinderSequence}[args.reference]
+    queries = list(read_fasta(args.query)) if args.query else []
+    if args.sequence:
+        queries.append(("sequence", args.sequence))
+
+    # establish connection to database (mysql or sqlite)
+    engine = engine_from_args(args)
+    prepare_models(engine)
+    session = Session(engine)
+
+    # index is synchronized once for all queries
+    try:
+        df = nearest_sequences(session, model, queries, top_k=args.top_k,
+                min_identity=args.min_identity, directory=args.kmer_index)
+    except ValueError as e:
+        sys.exit(str(e))
+    session.close()
+    df.to_csv(sys.stdout, sep="\t", index=False, float_format="%.4f")
+
+
+if  __name__ == "__main__":
+    main()
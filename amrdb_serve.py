@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import sys
+import signal
+import argparse
+
+from agesamrdb.cli import add_database_arguments, add_parse_cache_arguments
+
+# agesamrdb and sqlalchemy are imported in main (after parsing of arguments)
+
+# CLI definitions
+parser = argparse.ArgumentParser(description="agres - import service " \
+        + "holding a connection to the database and warm caches; accepts " \
+        + "import jobs (see amrdb_submit.py) via unix socket or localhost " \
+        + "http, jobs are parsed in parallel and written in batched " \
+        + "transactions")
+# db definitions
+add_database_arguments(parser)
+# service definitions
+parser.add_argument('--socket', dest='socket',
+        help="path of unix socket to listen on; if not provided http on " \
+        + "--host and --port is used", required=False, metavar="PATH")
+parser.add_argument('--host', dest='host', default="127.0.0.1",
+        help="address to listen on [127.0.0.1]")
+parser.add_argument('--port', dest='port', type=int, default=8765,
+        help="port to listen on [8765]", metavar="INT")
+parser.add_argument('--batch_size', dest='batch_size', type=int, default=10,
+        help="maximum number of jobs committed in one transaction [10]",
+        metavar="INT")
+parser.add_argument('--batch_delay', dest='batch_delay', type=float,
+        default=0.5, help="seconds to wait for further jobs of a batch [0.5]",
+        metavar="SECONDS")
+parser.add_argument('--workers', dest='workers', type=int,
+        help="number of processes parsing inputs in parallel, database is " \
+        + "written by a single thread [1]", default=1, metavar="INT")
+parser.add_argument('--verbose', dest='verbose', action='store_true',
+        help="log requests")
+add_parse_cache_arguments(parser)
+
+
+def main():
+
+    args = parser.parse_args()
+
+    from agesamrdb.engine import engine_from_args
+    from agesamrdb.service import ImportService, make_server
+    from agesamrdb.cache import parse_cache_from_args
+
+    # establish connection to database (mysql or sqlite)
+    engine = engine_from_args(args)
+    # before the workers are started (configured via the environment)
+    parse_cache_from_args(args)
+
+    service = ImportService(engine, batch_size=args.batch_size,
+            batch_delay=args.batch_delay, workers=args.workers)
+    server = make_server(service, socket_path=args.socket, host=args.host,
+            port=args.port, verbose=args.verbose)
+    # SIGTERM stops like POST /shutdown: queued jobs are imported before exit
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"listening on {args.socket or f'http://{args.host}:{args.port}'}",
+            file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        print(service.summary(), file=sys.stderr)
+
+
+if  __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+
+from agesamrdb.cli import add_import_arguments, import_job
+from agesamrdb.client import ServiceClient, ServiceError, DEFAULT_URL
+
+# CLI definitions
+parser = argparse.ArgumentParser(description="agres - submits a single " \
+        + "result to a running import service (amrdb_serve.py) and waits " \
+        + "until it is imported; takes the same import arguments as " \
+        + "amrdb_add_results.py")
+# service definitions
+parser.add_argument('--socket', dest='socket',
+        help="unix socket of the service; if not provided --url is used",
+        required=False, metavar="PATH")
+parser.add_argument('--url', dest='url', default=DEFAULT_URL,
+        help=f"url of the service [{DEFAULT_URL}]")
+parser.add_argument('--no_wait', dest='wait', action='store_false',
+        help="return after submitting, prints the job id")
+# input specifications (shared with amrdb_add_results.py)
+add_import_arguments(parser)
+
+
+def main():
+
+    args = parser.parse_args()
+    client = ServiceClient(socket_path=args.socket, url=args.url)
+
+    job = import_job(args)
+    # the service does not share the working directory
+    for field in ("input_path", "assembly"):
+        if job[field]:
+            job[field] = os.path.abspath(job[field])
+
+    try:
+        status = client.submit(job)
+        if args.wait:
+            status = client.wait(status["id"])
+    except (ServiceError, OSError) as e:
+        print(f"import could not be submitted: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    print(f"job {status['id']}: {status['status']}")
+    if status["status"] == "failed":
+        print(status["message"], file=sys.stderr)
+        sys.exit(1)
+
+
+if  __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+ingestion benchmark: synthetic tool outputs (benchmark.synthetic) and timing
+of parsing and database import per method (python -m benchmark.run)
+"""
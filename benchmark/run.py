@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+ingestion benchmark: generates (or reuses) a synthetic dataset and imports
+it into each given database, timing parsing (read_import: read_result and
+contig information) and writing (insert_into_db per result) of every method
+separately; results are written as json (stable key order) to be compared
+between releases
+
+run from the repository root, e.g.
+python -m benchmark.run -n 100 -o results.json \\
+        --url sqlite:///bench.db --url mysql+mysqlconnector://u:p@localhost/bench
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import warnings
+import contextlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import inspect, select, func
+from sqlalchemy.orm import Session
+
+from agesamrdb.engine import create_db_engine, write_engine
+from agesamrdb.models import Base, Sample, ToolVersion, prepare_models
+from agesamrdb.interfaces import read_import, insert_into_db, tool_version_args
+from agesamrdb.reference import clear_reference_indexes
+from agesamrdb.util import get_or_create, enable_unit_of_work
+from agesamrdb.batch import read_manifest
+from agesamrdb.profiling import ImportProfile
+import update_resfinder_database
+
+from .synthetic import generate_dataset, DEFAULT_PARAMS
+
+parser = argparse.ArgumentParser(description="benchmark of result imports "
+        + "with synthetic data of all supported methods")
+parser.add_argument('-n', '--samples', dest='samples', type=int, default=10,
+        help="number of synthetic samples [10]", metavar="INT")
+parser.add_argument('-o', '--output', dest='output',
+        default="benchmark_results.json",
+        help="json file with results [benchmark_results.json]")
+parser.add_argument('--url', dest='urls', action='append',
+        help="sqlalchemy url of an empty database to import into, can be "
+        + "given multiple times [sqlite database in temporary directory]")
+parser.add_argument('--data_dir', dest='data_dir',
+        help="directory of synthetic dataset, generated if it does not "
+        + "contain a manifest.tsv yet, otherwise reused [temporary directory]")
+parser.add_argument('--seed', dest='seed', type=int, default=1,
+        help="seed of synthetic data [1]", metavar="INT")
+parser.add_argument('--reset', dest='reset', action='store_true',
+        help="drop all tables of non-empty databases before import")
+parser.add_argument('--bulk', dest='bulk', action='store_true',
+        help="write generic results in bulk (see amrdb_add_results.py)")
+parser.add_argument('--chunk_size', dest='chunk_size', type=int, default=5000,
+        help="rows per executemany in --bulk mode [5000]", metavar="INT")
+for name, default in DEFAULT_PARAMS.items():
+    parser.add_argument(f'--{name}', dest=name, default=default,
+            type=type(default), help=f"synthetic data: {name} [{default}]")
+
+
+def summarize(durations, rows):
+    """
+    statistics of the durations (seconds) of one stage and method
+    """
+    durations = np.array(durations)
+    return {"count": len(durations), "rows": int(sum(rows)),
+            "total_s": round(float(durations.sum()), 6),
+            "mean_s": round(float(durations.mean()), 6),
+            "median_s": round(float(np.median(durations)), 6),
+            "p95_s": round(float(np.percentile(durations, 95)), 6),
+            "max_s": round(float(durations.max()), 6),
+            "rows_per_s": round(sum(rows) / durations.sum(), 1)
+                if durations.sum() > 0 else None}
+
+
+def setup_database(engine, reference_dir, reset=False):
+    """
+    creates all tables and fills reference sequences of the synthetic dataset
+    """
+    if inspect(engine).get_table_names():
+        if not reset:
+            raise RuntimeError(f"database {engine.url} is not empty, use "
+                    + "--reset to drop all tables")
+        Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    prepare_models(engine)
+    clear_reference_indexes()
+    session = Session(write_engine(engine))
+    update_resfinder_database.initialize_phenotype_classes(session)
+    update_resfinder_database.update_reference_sequences(session,
+            os.path.join(reference_dir, "resfinder_db"),
+            os.path.join(reference_dir, "amrfinder"))
+    session.commit()
+    session.close()
+
+
+def run_import(engine, manifest, **kwargs):
+    """
+    imports all manifest rows (one transaction per sample) and returns
+    dict stage -> method -> list of (seconds, rows)
+    kwargs: forwarded to insert_into_db (bulk, chunk_size)
+    """
+    timings = {"read": {}, "insert": {}, "commit": {}}
+    session = Session(write_engine(engine), expire_on_commit=False)
+    enable_unit_of_work(session)
+    for sample_name, rows in manifest.groupby("sample_name", sort=False):
+        sample = get_or_create(session, Sample, name=sample_name)
+        for _, row in rows.iterrows():
+            version = get_or_create(session, ToolVersion, **tool_version_args(
+                row["method"], row["mode"], row["tool_version"],
+                row["db_version"], row["assembly"]))
+            start = time.perf_counter()
+            results = read_import(row["input_path"], row["method"],
+                    row["assembly"])
+            timings["read"].setdefault(row["method"], []).append(
+                    (time.perf_counter() - start, len(results[0][1])))
+            for method, df in results:
+                start = time.perf_counter()
+                insert_into_db(df, method, sample, session,
+                        version_associated=version, **kwargs)
+                session.flush()
+                timings["insert"].setdefault(method, []).append(
+                        (time.perf_counter() - start, len(df)))
+        start = time.perf_counter()
+        session.commit()
+        timings["commit"].setdefault("sample", []).append(
+                (time.perf_counter() - start, 1))
+    session.close()
+    return timings
+
+
+def table_rows(engine):
+    """
+    number of rows per table after import (to compare imported amounts)
+    """
+    with engine.connect() as connection:
+        return {table.name: connection.execute(select(func.count())
+            .select_from(table)).scalar() for table in Base.metadata.sorted_tables}
+
+
+def row_accounting(profile, rows_before, rows_after):
+    """
+    tables whose number of rows written according to profile (inserted minus
+    deleted rows, see profiling.ImportProfile) differs from the change of
+    their row count: table -> {"reported": n, "actual": n}
+    """
+    mismatches = {}
+    for table, before in rows_before.items():
+        verbs = profile.tables.get(table, {})
+        reported = verbs.get("insert", {}).get("rows", 0) \
+                - verbs.get("delete", {}).get("rows", 0)
+        actual = rows_after[table] - before
+        if reported != actual:
+            mismatches[table] = {"reported": reported, "actual": actual}
+    return mismatches
+
+
+def benchmark_database(url, data_dir, manifest, reset=False, **kwargs):
+    """
+    sets up database of url and imports manifest, returns results of database
+    kwargs: forwarded to run_import
+    """
+    engine = create_db_engine(url)
+    print(f"benchmark {engine.url.render_as_string(hide_password=True)}")
+    # tools and import functions report progress on stdout
+    with contextlib.redirect_stdout(StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        start = time.perf_counter()
+        setup_database(engine, os.path.join(data_dir, "reference"), reset)
+        setup_s = time.perf_counter() - start
+        rows_before = table_rows(engine)
+        start = time.perf_counter()
+        with ImportProfile().activate(engine) as profile:
+            timings = run_import(engine, manifest, **kwargs)
+        import_s = time.perf_counter() - start
+    rows_after = table_rows(engine)
+    mismatches = row_accounting(profile, rows_before, rows_after)
+    for table, counts in mismatches.items():
+        print(f"WARNING: {table}: {counts['reported']} rows reported by the "
+                + f"profile, row count changed by {counts['actual']}")
+    results = {"backend": engine.url.get_backend_name(),
+            "url": engine.url.render_as_string(hide_password=True),
+            "setup_s": round(setup_s, 6), "import_s": round(import_s, 6),
+            "stages": {stage: {method: summarize(*zip(*values))
+                for method, values in sorted(methods.items())}
+                for stage, methods in timings.items()},
+            "table_rows": rows_after, "row_accounting": mismatches}
+    engine.dispose()
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                text=True, cwd=os.path.dirname(os.path.abspath(__file__)))\
+                .stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"git_commit": commit, "python": platform.python_version(),
+            "platform": platform.platform(), "sqlalchemy": sqlalchemy.__version__,
+            "pandas": pd.__version__, "numpy": np.__version__}
+
+
+def main():
+
+    args = parser.parse_args()
+    tmp_dir = tempfile.TemporaryDirectory(prefix="amrdb_benchmark_")
+    data_dir = args.data_dir or os.path.join(tmp_dir.name, "data")
+    urls = args.urls or [f"sqlite:///{os.path.join(tmp_dir.name, 'bench.db')}"]
+    params = {name: getattr(args, name) for name in DEFAULT_PARAMS}
+
+    manifest_file = os.path.join(data_dir, "manifest.tsv")
+    start = time.perf_counter()
+    if not os.path.exists(manifest_file):
+        print(f"generate {args.samples} synthetic samples in {data_dir}")
+        generate_dataset(data_dir, args.samples, args.seed, **params)
+    else:
+        print(f"reuse synthetic samples of {data_dir}")
+    generation_s = time.perf_counter() - start
+    with open(os.path.join(data_dir, "parameters.json")) as fh:
+        dataset = json.load(fh)
+    manifest = read_manifest(manifest_file)
+
+    results = {"dataset": dataset, "environment": environment(),
+            "options": {"bulk": args.bulk, "chunk_size": args.chunk_size},
+            "generation_s": round(generation_s, 6), "backends": {}}
+    # each database in a fresh process: no caches (reference index, fasta
+    # index) or reflected metadata are shared between runs
+    spawn = multiprocessing.get_context("spawn")
+    for url in urls:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            backend_results = executor.submit(benchmark_database, url, data_dir,
+                    manifest, args.reset, bulk=args.bulk,
+                    chunk_size=args.chunk_size).result()
+        name = backend_results["backend"]
+        while name in results["backends"]:
+            name += "_"
+        results["backends"][name] = backend_results
+        print(f"{name}: setup {backend_results['setup_s']:.2f}s, import "
+                + f"{backend_results['import_s']:.2f}s")
+
+    with open(args.output, "w") as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+    print(f"results written to {args.output}")
+    tmp_dir.cleanup()
+
+
+if  __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+startup budget of amrdb_add_results.py: median wall time of fresh processes
+for --help and for a small import (mlst result of testdata into a temporary
+sqlite database); exits with status 1 if a median exceeds its budget
+
+run from the repository root, e.g.
+python -m benchmark.startup --repeat 10 -o startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_DIR, "amrdb_add_results.py")
+
+# seconds (median), measured on a developer machine with a margin of ~2x
+DEFAULT_BUDGETS = {"help": 0.3, "small_import": 2.0}
+
+parser = argparse.ArgumentParser(description="measure startup time of "
+        + "amrdb_add_results.py against a budget")
+parser.add_argument('--repeat', dest='repeat', type=int, default=5,
+        help="number of runs per command [5]", metavar="INT")
+parser.add_argument('--help_budget', dest='help_budget', type=float,
+        default=DEFAULT_BUDGETS["help"],
+        help=f"budget of --help in seconds [{DEFAULT_BUDGETS['help']}]")
+parser.add_argument('--import_budget', dest='import_budget', type=float,
+        default=DEFAULT_BUDGETS["small_import"],
+        help="budget of a small import in seconds "
+        + f"[{DEFAULT_BUDGETS['small_import']}]")
+parser.add_argument('-o', '--output', dest='output',
+        help="write measurements as json")
+
+
+def measure(command, repeat):
+    """
+    wall times (seconds) of repeat runs of command in a fresh process
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, cwd=REPO_DIR)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def create_database(database):
+    """
+    empty database with all tables (in a separate process, not loading
+    agesamrdb into the measuring process)
+    """
+    subprocess.run([sys.executable, "-c", "import sys; "
+        + "from sqlalchemy import create_engine; "
+        + "from agesamrdb.models import Base; "
+        + "Base.metadata.create_all(create_engine(f'sqlite:///{sys.argv[1]}'))",
+        database], check=True, cwd=REPO_DIR)
+
+
+def main():
+
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="amrdb_startup_") as tmp_dir:
+        database = os.path.join(tmp_dir, "startup.db")
+        create_database(database)
+        commands = {
+            "help": ([sys.executable, SCRIPT, "--help"], args.help_budget),
+            "small_import": ([sys.executable, SCRIPT, "-d", database,
+                "--method", "mlst", "-i", "testdata/mlst_output.csv",
+                "--external_id", "1", "--tool_version", "startup"],
+                args.import_budget),
+        }
+        results = {}
+        for name, (command, budget) in commands.items():
+            durations = measure(command, args.repeat)
+            median = statistics.median(durations)
+            results[name] = {"median_s": round(median, 4),
+                    "min_s": round(min(durations), 4),
+                    "max_s": round(max(durations), 4), "budget_s": budget,
+                    "within_budget": median <= budget}
+            print(f"{name}: median {median:.3f}s (min {min(durations):.3f}s)"
+                    + f", budget {budget:.3f}s"
+                    + ("" if median <= budget else " - EXCEEDED"))
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    if not all(r["within_budget"] for r in results.values()):
+        sys.exit(1)
+
+
+if  __name__ == "__main__":
+    main()
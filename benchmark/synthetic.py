@@ -0,0 +1,429 @@
+"""
+generator of synthetic but format-faithful inputs for all methods supported by
+agesamrdb.interfaces.read_result: a reference database (resfinder_db and
+amrfinder AMRProt) and per sample an assembly together with the outputs of
+resfinder (incl. pointfinder), amrfinder, bakta, isescan, mobtyper,
+plasmidfinder, phispy, speciesfinder and mlst
+all outputs are derived from a seeded random generator, the same parameters
+always result in identical files
+"""
+import os
+import json
+import random
+
+import pandas as pd
+from Bio.Seq import Seq
+
+# class_name, phenotype as listed in agesamrdb/data/phenotypes_classnames.tsv
+GENE_CLASSES = [
+        ("Aminoglycoside", "Gentamicin", "aac"),
+        ("Beta-Lactam", "Ampicillin", "bla"),
+        ("Tetracycline", "Tetracycline", "tet"),
+        ("Folate Pathway Antagonist", "Trimethoprim", "dfr"),
+        ("Folate Pathway Antagonist", "Sulfamethoxazole", "sul"),
+        ("Phenicol", "Chloramphenicol", "cat"),
+]
+POINT_MUTATIONS = [
+        ("gyrA p.S83L", "TCG -> TTG", "S -> L", "Nalidixic acid,Ciprofloxacin"),
+        ("gyrA p.D87N", "GAC -> AAC", "D -> N", "Nalidixic acid,Ciprofloxacin"),
+        ("parC p.S80I", "AGC -> ATC", "S -> I", "Ciprofloxacin"),
+        ("pmrB p.V161G", "GTG -> GGG", "V -> G", "Colistin"),
+]
+AMRFINDER_POINT_GENES = [
+        ("gyrA_S83L", "Escherichia quinolone resistant GyrA", "QUINOLONE"),
+        ("parC_S80I", "Escherichia quinolone resistant ParC", "QUINOLONE"),
+        ("pmrB_V161G", "Escherichia colistin resistant PmrB", "COLISTIN"),
+]
+BAKTA_PRODUCTS = ["cds", "cds", "cds", "cds", "tRNA", "rRNA", "ncRNA"]
+IS_FAMILIES = ["IS1", "IS3", "IS6", "IS21", "IS30", "IS110", "IS481", "ISNCY"]
+REPLICONS = ["IncFIB", "IncFII", "IncI1-I(Alpha)", "IncX4", "IncN", "ColRNAI"]
+MLST_LOCI = ["adk", "fumC", "gyrB", "icd", "mdh", "purA", "recA"]
+
+STOP_CODONS = {"TAA", "TAG", "TGA"}
+SENSE_CODONS = [a + b + c for a in "ACGT" for b in "ACGT" for c in "ACGT"
+        if a + b + c not in STOP_CODONS]
+
+# default scale of a single sample
+DEFAULT_PARAMS = {
+        "reference_genes": 500,
+        "contigs": 20,
+        "contig_length": 20000,
+        "hits": 10,
+        "variant_rate": 0.1,
+        "features": 500,
+}
+
+
+def random_gene(rnd, codons):
+    """
+    coding sequence: start codon, codons sense codons and stop codon
+    """
+    return "ATG" + "".join(rnd.choice(SENSE_CODONS) for _ in range(codons)) \
+            + rnd.choice(sorted(STOP_CODONS))
+
+
+def mutate_gene(rnd, sequence, n_codons):
+    """
+    replaces n_codons internal codons by other sense codons (keeps start,
+    stop and length -> passes quality control, is imported as new variant)
+    """
+    codons = [sequence[i:i+3] for i in range(0, len(sequence), 3)]
+    for i in rnd.sample(range(1, len(codons) - 1), n_codons):
+        codons[i] = rnd.choice([c for c in SENSE_CODONS if c != codons[i]])
+    return "".join(codons)
+
+
+def identity(sequence, reference):
+    matches = sum(a == b for a, b in zip(sequence, reference))
+    return 100 * matches / max(len(sequence), len(reference))
+
+
+def write_fasta(fh, name, sequence, width=60):
+    fh.write(f">{name}\n")
+    for i in range(0, len(sequence), width):
+        fh.write(sequence[i:i+width] + "\n")
+
+
+def generate_reference(out_dir, n_genes=DEFAULT_PARAMS["reference_genes"],
+        seed=1):
+    """
+    writes synthetic reference database: resfinder_db (one fasta per class
+    and phenotypes.txt) in out_dir/resfinder_db and AMRProt in
+    out_dir/amrfinder, the same genes are part of both databases
+    returns list of gene dicts (used to place hits in samples)
+    """
+    rnd = random.Random(f"reference-{seed}")
+    genes = []
+    for i in range(n_genes):
+        class_name, phenotype, prefix = GENE_CLASSES[i % len(GENE_CLASSES)]
+        sequence = random_gene(rnd, rnd.randint(150, 400))
+        genes.append({
+            "name": f"{prefix}SYN-{i + 1}",
+            "accession": f"SYN{i + 1:06d}",
+            "protein_accession": f"WP_9{i + 1:08d}.1",
+            "class_name": class_name,
+            "phenotype": phenotype,
+            "sequence": sequence,
+            "protein": str(Seq(sequence[:-3]).translate()),
+        })
+
+    resfinder_dir = os.path.join(out_dir, "resfinder_db")
+    amrfinder_dir = os.path.join(out_dir, "amrfinder")
+    os.makedirs(resfinder_dir, exist_ok=True)
+    os.makedirs(amrfinder_dir, exist_ok=True)
+    for class_name in sorted({g["class_name"] for g in genes}):
+        file_name = class_name.lower().replace(" ", "_") + ".fsa"
+        with open(os.path.join(resfinder_dir, file_name), "w") as fh:
+            for gene in genes:
+                if gene["class_name"] == class_name:
+                    write_fasta(fh, f"{gene['name']}_1_{gene['accession']}",
+                            gene["sequence"])
+    pd.DataFrame({
+        "Gene_accession no.": [f"{g['name']}_1_{g['accession']}" for g in genes],
+        "Class": [g["class_name"] for g in genes],
+        "Phenotype": [g["phenotype"] for g in genes],
+        "PMID": "", "Mechanism of resistance": "", "Notes": "",
+        "Required_gene": "",
+    }).to_csv(os.path.join(resfinder_dir, "phenotypes.txt"), sep="\t",
+            index=False)
+    with open(os.path.join(amrfinder_dir, "AMRProt"), "w") as fh:
+        for i, gene in enumerate(genes):
+            fields = [str(900000000 + i), gene["protein_accession"], "1", "1",
+                    gene["name"], gene["name"].split("-")[0], "AMR", "2",
+                    gene["phenotype"].upper(), gene["class_name"].upper(),
+                    f"synthetic {gene['phenotype'].lower()} resistance protein"]
+            fh.write(">" + "|".join(fields) + "\n" + gene["protein"] + "\n")
+    return genes
+
+
+def _place_regions(rnd, contigs, lengths, n):
+    """
+    n non-overlapping regions (contig index, start offset) of given lengths
+    (0-based offsets), regions which do not fit are skipped
+    """
+    free = {i: 0 for i in range(len(contigs))}
+    placed = []
+    for length in lengths[:n]:
+        candidates = [i for i in free
+                if free[i] + length + 100 < len(contigs[i])]
+        if not candidates:
+            break
+        i = rnd.choice(candidates)
+        start = free[i] + rnd.randint(50, 100)
+        placed.append((i, start))
+        free[i] = start + length
+    return placed
+
+
+def generate_sample(out_dir, sample_name, genes, seed=1, **params):
+    """
+    writes all tool outputs of a single synthetic sample to out_dir/sample_name
+    params: see DEFAULT_PARAMS (contigs, contig_length, hits, variant_rate,
+        features)
+    returns dict method -> input path (and "assembly")
+    """
+    params = {**DEFAULT_PARAMS, **params}
+    rnd = random.Random(f"{sample_name}-{seed}")
+    sample_dir = os.path.join(out_dir, sample_name)
+    resfinder_dir = os.path.join(sample_dir, "resfinder")
+    amrfinder_dir = os.path.join(sample_dir, "amrfinder")
+    os.makedirs(resfinder_dir, exist_ok=True)
+    os.makedirs(amrfinder_dir, exist_ok=True)
+
+    contig_names = [f"{sample_name}_{i + 1}" for i in range(params["contigs"])]
+    contig_descs = [f"{name} {sample_name} #{i + 1}"
+            for i, name in enumerate(contig_names)]
+    contigs = [list(rnd.choices("ACGT", k=max(params["contig_length"]
+        - rnd.randint(0, params["contig_length"] // 2), 200)))
+        for _ in contig_names]
+
+    # acquired genes (reported by resfinder and amrfinder) and point mutations
+    # (amrfinder only) placed on contigs, every second one reverse complement
+    hit_genes = rnd.sample(genes, min(params["hits"], len(genes)))
+    hits = []
+    for gene in hit_genes:
+        sequence = gene["sequence"]
+        if rnd.random() < params["variant_rate"]:
+            sequence = mutate_gene(rnd, sequence, rnd.randint(1, 3))
+        hits.append({"gene": gene, "sequence": sequence, "point": False})
+    for name, long_name, subclass in rnd.sample(AMRFINDER_POINT_GENES,
+            rnd.randint(0, len(AMRFINDER_POINT_GENES))):
+        hits.append({"gene": {"name": name, "long_name": long_name,
+            "class_name": subclass, "phenotype": subclass,
+            "protein_accession": "WP_000000000.1"},
+            "sequence": random_gene(rnd, rnd.randint(200, 300)), "point": True})
+    placements = _place_regions(rnd, contigs, [len(h["sequence"]) for h in hits],
+            len(hits))
+    for n, (hit, (i, start)) in enumerate(zip(hits, placements)):
+        hit["strand"] = "-" if n % 2 else "+"
+        on_contig = hit["sequence"] if hit["strand"] == "+" \
+                else str(Seq(hit["sequence"]).reverse_complement())
+        contigs[i][start:start + len(on_contig)] = list(on_contig)
+        hit.update({"contig": i, "start": start + 1,
+            "end": start + len(on_contig)})
+    hits = hits[:len(placements)]
+
+    assembly_file = os.path.join(sample_dir, "assembly.fasta")
+    with open(assembly_file, "w") as fh:
+        for name, desc, sequence in zip(contig_names, contig_descs, contigs):
+            write_fasta(fh, desc, "".join(sequence))
+
+    # resfinder (assembly based) incl. pointfinder
+    resfinder_rows = []
+    with open(os.path.join(resfinder_dir, "ResFinder_Hit_in_genome_seq.fsa"),
+            "w") as fh:
+        for hit in hits:
+            if hit["point"]:
+                continue
+            gene, length = hit["gene"], len(hit["sequence"])
+            hit_identity = identity(hit["sequence"], gene["sequence"])
+            contig, position = contig_descs[hit["contig"]], \
+                    f"{hit['start']}..{hit['end']}"
+            resfinder_rows.append([gene["name"], f"{hit_identity:.2f}",
+                f"{length}/{length}", "100.0", f"1..{length}", contig,
+                position, f"{gene['phenotype']} resistance", gene["accession"]])
+            write_fasta(fh, f"{gene['name']}, ID: {hit_identity:.2f} %, "
+                    + f"Alignment Length/Gene Length: {length}/{length}, "
+                    + f"Coverage: 100.0, Positions in reference: 1..{length}, "
+                    + f"Contig name: {contig}, Position: {position}",
+                    hit["sequence"])
+    pd.DataFrame(resfinder_rows, columns=["Resistance gene", "Identity",
+        "Alignment Length/Gene Length", "Coverage", "Position in reference",
+        "Contig", "Position in contig", "Phenotype", "Accession no."])\
+        .to_csv(os.path.join(resfinder_dir, "ResFinder_results_tab.txt"),
+                sep="\t", index=False)
+    pd.DataFrame([m + ("",) for m in rnd.sample(POINT_MUTATIONS,
+        rnd.randint(0, len(POINT_MUTATIONS)))], columns=["Mutation",
+            "Nucleotide change", "Amino acid change", "Resistance", "PMID"])\
+        .to_csv(os.path.join(resfinder_dir, "PointFinder_results.txt"),
+                sep="\t", index=False)
+
+    # amrfinder (nucleotide output without stop codon)
+    amrfinder_rows = []
+    with open(os.path.join(amrfinder_dir, "amrfinder_nucleotides.fasta"),
+            "w") as fh:
+        for hit in hits:
+            gene = hit["gene"]
+            protein = str(Seq(hit["sequence"][:-3]).translate())
+            if hit["point"]:
+                method, hit_identity, subtype = "POINTX", 99.5, "POINT"
+            else:
+                hit_identity = identity(protein, gene["protein"])
+                method = "EXACTX" if hit_identity == 100 else "BLASTX"
+                subtype = "AMR"
+            long_name = gene.get("long_name",
+                    f"synthetic {gene['phenotype'].lower()} resistance protein")
+            contig, strand = contig_names[hit["contig"]], hit["strand"]
+            end = hit["end"] - 3 if strand == "+" else hit["end"]
+            start = hit["start"] if strand == "+" else hit["start"] + 3
+            amrfinder_rows.append(["NA", contig, start, end, strand,
+                gene["name"], long_name, "core", "AMR", subtype,
+                gene["class_name"].upper(), gene["phenotype"].upper(), method,
+                len(protein), len(protein), "100.00", f"{hit_identity:.2f}",
+                len(protein), gene["protein_accession"], long_name, "NA", "NA"])
+            write_fasta(fh, f"{contig}:{start}-{end} strand:{strand} "
+                    + f"{gene['name']} {long_name}", hit["sequence"][:-3])
+    pd.DataFrame(amrfinder_rows, columns=["Protein identifier", "Contig id",
+        "Start", "Stop", "Strand", "Gene symbol", "Sequence name", "Scope",
+        "Element type", "Element subtype", "Class", "Subclass", "Method",
+        "Target length", "Reference sequence length",
+        "% Coverage of reference sequence", "% Identity to reference sequence",
+        "Alignment length", "Accession of closest sequence",
+        "Name of closest sequence", "HMM id", "HMM description"])\
+        .to_csv(os.path.join(amrfinder_dir, "amrfinder_results.txt"),
+                sep="\t", index=False)
+
+    # bakta (--keep-contig-headers)
+    bakta_file = os.path.join(sample_dir, "bakta.tsv")
+    with open(bakta_file, "w") as fh:
+        fh.write("# Annotated with Bakta\n# Software: v1.8.1\n"
+                + "# Database: v5.0, light\n# DOI: 10.1099/mgen.0.000685\n"
+                + "# URL: github.com/oschwengers/bakta\n#Sequence Id\tType\t"
+                + "Start\tStop\tStrand\tLocus Tag\tGene\tProduct\tDbXrefs\n")
+        for n in range(params["features"]):
+            i = rnd.randrange(len(contigs))
+            start = rnd.randint(1, max(len(contigs[i]) - 1000, 1))
+            product_type = rnd.choice(BAKTA_PRODUCTS)
+            gene_name = f"syn{chr(97 + n % 26)}{n % 10}" if rnd.random() < 0.6 else ""
+            fh.write("\t".join([contig_names[i], product_type, str(start),
+                str(start + rnd.randint(100, 999)), rnd.choice("+-"),
+                f"SYN_{n + 1:05d}", gene_name,
+                f"synthetic {product_type} product {n % 97}",
+                f"SO:0001217, UniRef:UniRef50_SYN{n % 997:04d}"]) + "\n")
+
+    # isescan
+    isescan_rows = []
+    for n in range(max(params["features"] // 50, 1)):
+        i = rnd.randrange(len(contigs))
+        start = rnd.randint(1, max(len(contigs[i]) - 2000, 1))
+        length = rnd.randint(700, 1500)
+        end = start + length - 1
+        family = rnd.choice(IS_FAMILIES)
+        ir = "".join(rnd.choices("ACGT", k=20))
+        isescan_rows.append([contig_names[i], family,
+            f"{family}_{rnd.randint(1, 300)}", start, end, length, 1, start,
+            start + 19, end - 19, end, rnd.randint(10, 30), rnd.randint(10, 20),
+            20, 0, start + 100, end - 100, rnd.choice("+-"), length - 200,
+            f"{rnd.random():.1e}", f"{rnd.random():.1e}", rnd.choice("cp"), 1,
+            f"{ir}:{ir[::-1]}"])
+    isescan_file = os.path.join(sample_dir, "isescan.tsv")
+    pd.DataFrame(isescan_rows, columns=["seqID", "family", "cluster",
+        "isBegin", "isEnd", "isLen", "ncopy4is", "start1", "end1", "start2",
+        "end2", "score", "irId", "irLen", "nGaps", "orfBegin", "orfEnd",
+        "strand", "orfLen", "E-value", "E-value4copy", "type", "ov", "tir"])\
+        .to_csv(isescan_file, sep="\t", index=False)
+
+    # mobtyper (one row per contig)
+    mobtyper_file = os.path.join(sample_dir, "mobtyper.txt")
+    pd.DataFrame([[desc, 1, len(contig), f"{rnd.uniform(0.4, 0.6):.6f}",
+        f"{rnd.getrandbits(128):032x}"] + ["-"] * 8
+        + [rnd.choice(["non-mobilizable", "mobilizable", "conjugative"]),
+            f"CP{rnd.randint(10000, 99999):06d}", f"{rnd.random():.6f}",
+            "Escherichia coli", f"AA{rnd.randint(100, 999)}",
+            f"AB{rnd.randint(100, 999)}"] + ["-"] * 7
+        for desc, contig in zip(contig_descs, contigs)],
+        columns=["sample_id", "num_contigs", "size", "gc", "md5",
+            "rep_type(s)", "rep_type_accession(s)", "relaxase_type(s)",
+            "relaxase_type_accession(s)", "mpf_type", "mpf_type_accession(s)",
+            "orit_type(s)", "orit_accession(s)", "predicted_mobility",
+            "mash_nearest_neighbor", "mash_neighbor_distance",
+            "mash_neighbor_identification", "primary_cluster_id",
+            "secondary_cluster_id", "predicted_host_range_overall_rank",
+            "predicted_host_range_overall_name",
+            "observed_host_range_ncbi_rank", "observed_host_range_ncbi_name",
+            "reported_host_range_lit_rank", "reported_host_range_lit_name",
+            "associated_pmid(s)"]).to_csv(mobtyper_file, sep="\t", index=False)
+
+    # plasmidfinder
+    plasmidfinder_rows = []
+    for replicon in rnd.sample(REPLICONS, rnd.randint(0, 3)):
+        i = rnd.randrange(len(contigs))
+        length = rnd.randint(250, 800)
+        start = rnd.randint(1, max(len(contigs[i]) - length, 1))
+        plasmidfinder_rows.append(["enterobacteriaceae", replicon, "100.0",
+            f"{length} / {length}", contig_descs[i],
+            f"{start}..{start + length - 1}", "",
+            f"CP{rnd.randint(100000, 999999)}"])
+    plasmidfinder_file = os.path.join(sample_dir, "plasmidfinder.tsv")
+    pd.DataFrame(plasmidfinder_rows, columns=["Database", "Plasmid",
+        "Identity", "Query / Template length", "Contig", "Position in contig",
+        "Note", "Accession number"]).to_csv(plasmidfinder_file, sep="\t",
+                index=False)
+
+    # phispy (prophage_coordinates.tsv, no header)
+    phispy_file = os.path.join(sample_dir, "phispy.tsv")
+    with open(phispy_file, "w") as fh:
+        for n in range(rnd.randint(1, 5)):
+            i = rnd.randrange(len(contigs))
+            start = rnd.randint(1, max(len(contigs[i]) // 2, 1))
+            end = min(start + rnd.randint(5000, 30000), len(contigs[i]))
+            attachment = "".join(rnd.choices("ACGT", k=12))
+            fh.write("\t".join(str(v) for v in [f"pp{n + 1}", contig_names[i],
+                start, end, max(start - 500, 1), max(start - 488, 1), end,
+                end + 12, attachment, attachment,
+                "Longest Repeat flanking phage and within 2000 bp"]) + "\n")
+
+    # speciesfinder (json)
+    speciesfinder_file = os.path.join(sample_dir, "speciesfinder.json")
+    with open(speciesfinder_file, "w") as fh:
+        json.dump({"speciesfinder": {
+            "user_input": {"filename(s)": [assembly_file], "method": "kma",
+                "file_format": "fasta"},
+            "run_info": {"date": "01.01.2024", "time": "00:00:00"},
+            "results": {"Template": "SYN00000001 Bacteria;Proteobacteria;"
+                + "Gammaproteobacteria;Enterobacterales;Enterobacteriaceae;"
+                + "Escherichia;Escherichia coli",
+                "Species": "Escherichia coli", "Match": "SYN00000001",
+                "Database": "speciesfinder_db/16srna_database",
+                "Confidence of result": rnd.choice(["PASS", "FAIL"])}}}, fh)
+
+    # mlst (--csv)
+    mlst_file = os.path.join(sample_dir, "mlst.csv")
+    with open(mlst_file, "w") as fh:
+        fh.write(",".join(["assembly.fasta", "ecoli_achtman_4",
+            str(rnd.randint(1, 15000))]
+            + [f"{locus}({rnd.randint(1, 500)})" for locus in MLST_LOCI]) + "\n")
+
+    return {"assembly": assembly_file, "resfinder": resfinder_dir,
+            "amrfinder": amrfinder_dir, "bakta": bakta_file,
+            "isescan": isescan_file, "mobtyper": mobtyper_file,
+            "plasmidfinder": plasmidfinder_file, "phispy": phispy_file,
+            "speciesfinder": speciesfinder_file, "mlst": mlst_file}
+
+
+# methods of a sample in import order, resfinder/amrfinder use the assembly
+METHODS = ["resfinder", "amrfinder", "plasmidfinder", "phispy", "bakta",
+        "isescan", "mobtyper", "speciesfinder", "mlst"]
+ASSEMBLY_METHODS = ["resfinder", "amrfinder"]
+
+
+def generate_dataset(out_dir, n_samples, seed=1, **params):
+    """
+    writes reference database (out_dir/reference) and n_samples samples
+    (out_dir/samples) and a manifest (out_dir/manifest.tsv, format of
+    agesamrdb.batch.read_manifest) with one row per sample and method
+    returns manifest as DataFrame
+    """
+    params = {**DEFAULT_PARAMS, **params}
+    genes = generate_reference(os.path.join(out_dir, "reference"),
+            params.pop("reference_genes"), seed)
+    rows = []
+    for n in range(n_samples):
+        sample_name = f"SYN-{n + 1:05d}"
+        paths = generate_sample(os.path.join(out_dir, "samples"), sample_name,
+                genes, seed, **params)
+        for method in METHODS:
+            rows.append({"sample_name": sample_name, "external_id": None,
+                "method": method, "input_path": paths[method],
+                "assembly": paths["assembly"] if method in ASSEMBLY_METHODS
+                    else None,
+                "tool_version": "synthetic", "db_version": None,
+                "mode": "fasta"})
+    manifest = pd.DataFrame(rows)
+    manifest.to_csv(os.path.join(out_dir, "manifest.tsv"), sep="\t",
+            index=False)
+    with open(os.path.join(out_dir, "parameters.json"), "w") as fh:
+        json.dump({"samples": n_samples, "seed": seed,
+            "reference_genes": len(genes), **params}, fh, indent=2,
+            sort_keys=True)
+    return manifest
@@ -11,7 +11,12 @@ setup (
       data_files = [("agesamrdb", ["agesamrdb/data/phenotypes_classnames.tsv"])],
       include_package_data=True,
       install_requires=["pandas", "sqlalchemy>=2.0", "mysql-connector-python"],
-      scripts = ["amrdb_add_results.py", "update_resfinder_database.py"],
+      extras_require={"parquet": ["pyarrow"], "matrix": ["scipy"],
+          "test": ["pytest"]},
+      scripts = ["amrdb_add_results.py", "amrdb_batch_add_results.py",
+          "amrdb_serve.py", "amrdb_submit.py", "amrdb_export_results.py",
+          "amrdb_export_parquet.py", "amrdb_export_matrix.py",
+          "amrdb_nearest_sequences.py", "update_resfinder_database.py"],
       long_description = "This tool allows to create a relational database" \
               + " from ResFinder and store ResFinder (PointFinder) results" \
               + " alongside with additional tools results: currently " \
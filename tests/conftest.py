@@ -0,0 +1,71 @@
+import os
+
+import pandas as pd
+import pytest
+from sqlalchemy.orm import Session
+
+from agesamrdb.engine import create_db_engine
+from agesamrdb.models import Base, Phenotype, ResfinderSequence, prepare_models
+from agesamrdb.reference import clear_reference_indexes
+from agesamrdb.util import calc_sequence_hash, calc_sequence_fingerprint
+
+TESTDATA = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "testdata")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """
+    engine of an empty sqlite database with all tables
+    """
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'agres.db'}")
+    Base.metadata.create_all(engine)
+    prepare_models(engine)
+    clear_reference_indexes()
+    yield engine
+    clear_reference_indexes()
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    session = Session(engine)
+    yield session
+    session.close()
+
+
+def add_sequence(session, accession, sequence, phenotypes=(), **kwargs):
+    """
+    stores a ResfinderSequence (name derived from accession)
+    """
+    kwargs.setdefault("name", f"gene_1_{accession}")
+    stored = ResfinderSequence(accession=accession, sequence=sequence,
+            crc32_hash=calc_sequence_hash(sequence),
+            seq_fingerprint=calc_sequence_fingerprint(sequence),
+            phenotypes=list(phenotypes), **kwargs)
+    session.add(stored)
+    session.flush()
+    return stored
+
+
+@pytest.fixture
+def resfinder_references(session):
+    """
+    reference sequences of all accessions of the resfinder testdata, each
+    with its own phenotype (named after the accession)
+    returns dict accession -> phenotype name
+    """
+    phenotypes = {}
+    for out_dir in ("resfinder_assembly_out", "resfinder_reads_out"):
+        df = pd.read_csv(os.path.join(TESTDATA, out_dir,
+            "ResFinder_results_tab.txt"), sep="\t")
+        for gene, accession in zip(df["Resistance gene"], df["Accession no."]):
+            if accession in phenotypes:
+                continue
+            phenotypes[accession] = f"phenotype_{accession}"
+            phenotype = Phenotype(phenotype=phenotypes[accession],
+                    class_name="test")
+            add_sequence(session, accession, "ATG" + accession, [phenotype],
+                    name=f"{gene}_1_{accession}", short_name=gene)
+    session.commit()
+    return phenotypes
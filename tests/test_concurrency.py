@@ -0,0 +1,108 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, event, insert, select, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from agesamrdb import util
+from agesamrdb.engine import run_transaction, is_transient_error
+from agesamrdb.models import Sample, Phenotype
+from agesamrdb.util import insert_or_ignore, insert_many_or_ignore, \
+        get_or_create
+
+
+def _count(session, model):
+    return session.execute(select(func.count()).select_from(model)).scalar()
+
+
+def test_insert_or_ignore_skips_committed_row(engine, session):
+    with Session(engine) as other:
+        other.add(Phenotype(phenotype="Gentamicin", class_name="Aminoglycoside"))
+        other.commit()
+    insert_or_ignore(session, Phenotype, phenotype="Gentamicin",
+            class_name="Aminoglycoside")
+    session.commit()
+    assert _count(session, Phenotype) == 1
+
+
+def test_insert_or_ignore_savepoint(engine, session, monkeypatch):
+    # dialects without ON CONFLICT / ON DUPLICATE KEY use a savepoint
+    monkeypatch.setattr(util, "_insert_ignore_statement", lambda *args: None)
+    session.add(Sample(name="kept"))
+    session.flush()
+    insert_or_ignore(session, Sample, name="kept")
+    insert_many_or_ignore(session, Sample, [{"name": "kept"}, {"name": "new"}])
+    session.commit()
+    assert sorted(session.execute(select(Sample.name)).scalars()) \
+            == ["kept", "new"]
+
+
+def test_get_or_create_conflicting_insert(tmp_path):
+    # the lookup misses, a concurrent importer commits the same sample before
+    # the insert (pysqlite without explicit transactions: reads do not hold
+    # a snapshot, as at READ COMMITTED)
+    url = f"sqlite:///{tmp_path / 'race.db'}"
+    engine = create_engine(url)
+    Sample.__table__.create(engine)
+    other_engine = create_engine(url)
+    concurrent = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def insert_concurrently(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO sample") and not concurrent:
+            with other_engine.begin() as connection:
+                concurrent.append(connection.execute(insert(Sample)
+                    .values(name="A", external_id=1)).inserted_primary_key[0])
+
+    with Session(engine) as session:
+        sample = get_or_create(session, Sample, name="A", external_id=1)
+        assert concurrent and sample.id == concurrent[0]
+        assert _count(session, Sample) == 1
+    engine.dispose()
+    other_engine.dispose()
+
+
+def _locked():
+    return OperationalError("INSERT", {},
+            sqlite3.OperationalError("database is locked"))
+
+
+def _deadlock():
+    return OperationalError("INSERT", {},
+            Exception(1213, "Deadlock found when trying to get lock"))
+
+
+@pytest.mark.parametrize("error", [_locked, _deadlock])
+def test_run_transaction_retries_transient_errors(session, error):
+    assert is_transient_error(error())
+    attempts = []
+
+    def work(session):
+        attempts.append(len(attempts) + 1)
+        session.add(Sample(name=f"attempt {attempts[-1]}"))
+        session.flush()
+        if len(attempts) == 1:
+            raise error()
+        return "done"
+
+    assert run_transaction(session, work, backoff=0) == "done"
+    assert attempts == [1, 2]
+    # the first attempt was rolled back
+    assert list(session.execute(select(Sample.name)).scalars()) \
+            == ["attempt 2"]
+
+
+def test_run_transaction_raises_other_errors(session):
+    attempts = []
+
+    def work(session):
+        attempts.append(1)
+        session.add(Sample(name="failed"))
+        session.flush()
+        raise ValueError("not transient")
+
+    with pytest.raises(ValueError):
+        run_transaction(session, work, backoff=0)
+    assert len(attempts) == 1
+    assert _count(session, Sample) == 0
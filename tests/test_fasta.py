@@ -0,0 +1,53 @@
+import os
+
+from agesamrdb.fasta import FastaIndex
+
+SEQUENCES = {"contig_1": "ACGTACGTAC" * 7 + "GGA", "contig_2": "TTTTCCCCAA"}
+
+
+def _write(path, sequences, width):
+    with open(path, "w") as fh:
+        for name, sequence in sequences.items():
+            fh.write(f">{name} description\n")
+            for start in range(0, len(sequence), width):
+                fh.write(sequence[start:start+width] + "\n")
+
+
+def _check(index):
+    assert index.lengths == {name: len(s) for name, s in SEQUENCES.items()}
+    sequence = SEQUENCES["contig_1"]
+    assert index.fetch("contig_1") == sequence
+    assert index.fetch("contig_1", 1, 1) == sequence[0]
+    # regions across line ends, clipped to the length
+    assert index.fetch("contig_1", 18, 45) == sequence[17:45]
+    assert index.fetch("contig_1", 70, 100) == sequence[69:]
+    assert index.fetch("contig_1", 50, 40) == ""
+    assert index.fetch("contig_2", 3, 6) == "TTCC"
+
+
+def test_regular_fasta(tmp_path):
+    path = str(tmp_path / "assembly.fasta")
+    _write(path, SEQUENCES, 20)
+    index = FastaIndex(path)
+    assert index.sequences is None
+    assert os.path.exists(path + ".fai")
+    _check(index)
+    index.close()
+    # read from the .fai
+    index = FastaIndex(path)
+    _check(index)
+    index.close()
+
+
+def test_irregular_fasta(tmp_path):
+    path = str(tmp_path / "assembly.fasta")
+    with open(path, "w") as fh:
+        sequence = SEQUENCES["contig_1"]
+        fh.write(">contig_1\n" + sequence[:20] + "\n" + sequence[20:25] + "\n"
+                + sequence[25:] + "\n")
+        fh.write(">contig_2\n" + SEQUENCES["contig_2"] + "\n")
+    index = FastaIndex(path)
+    assert index.sequences is not None
+    assert not os.path.exists(path + ".fai")
+    _check(index)
+    index.close()
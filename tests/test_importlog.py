@@ -0,0 +1,65 @@
+import os
+
+from sqlalchemy import select, func
+
+from agesamrdb import importlog
+from agesamrdb.importlog import write_logged_import
+from agesamrdb.interfaces import read_import, tool_version_args
+from agesamrdb.models import Sample, ToolVersion, ImportLog, MlstResult
+from agesamrdb.util import get_or_create
+
+from conftest import TESTDATA
+
+MLST = os.path.join(TESTDATA, "mlst_output.csv")
+
+
+def _count(session, model):
+    return session.execute(select(func.count()).select_from(model)).scalar()
+
+
+def _import(session, fingerprint="a" * 32, **kwargs):
+    sample = get_or_create(session, Sample, name="test", external_id=1)
+    version = get_or_create(session, ToolVersion,
+            **tool_version_args("mlst", tool_version="test"))
+    imported = write_logged_import(read_import(MLST, "mlst"), sample, session,
+            version, "mlst", fingerprint, input_path=MLST, **kwargs)
+    session.commit()
+    return imported
+
+
+def test_same_input_skipped(session):
+    assert _import(session)
+    results = _count(session, MlstResult)
+    assert results > 0
+    assert not _import(session)
+    assert _count(session, MlstResult) == results
+    assert _count(session, ImportLog) == 1
+
+
+def test_other_input_added(session):
+    assert _import(session)
+    results = _count(session, MlstResult)
+    assert _import(session, fingerprint="b" * 32)
+    assert _count(session, MlstResult) == 2 * results
+    assert _count(session, ImportLog) == 2
+
+
+def test_replace(session):
+    assert _import(session)
+    assert _import(session, fingerprint="b" * 32)
+    results = _count(session, MlstResult) // 2
+    assert _import(session, replace=True)
+    assert _count(session, MlstResult) == results
+    assert session.execute(select(ImportLog.input_fingerprint))\
+            .scalars().all() == ["a" * 32]
+
+
+def test_concurrent_import_skipped(session, monkeypatch):
+    # import of a concurrent importer committed after the lookup: the claim
+    # of the ImportLog entry fails and nothing is written
+    assert _import(session)
+    results = _count(session, MlstResult)
+    monkeypatch.setattr(importlog, "find_import", lambda *args: None)
+    assert not _import(session)
+    assert _count(session, MlstResult) == results
+    assert _count(session, ImportLog) == 1
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from sqlalchemy import delete
+
+from agesamrdb.kmers import KmerIndex, translate
+from agesamrdb.models import ResfinderSequence
+
+from conftest import add_sequence
+
+
+def _random_sequence(rng, length):
+    return "".join(rng.choice(list("ACGT"), length))
+
+
+def _mutate(rng, sequence, n):
+    sequence = list(sequence)
+    for position in rng.choice(len(sequence), n, replace=False):
+        sequence[position] = "A" if sequence[position] != "A" else "C"
+    return "".join(sequence)
+
+
+@pytest.fixture
+def sequences():
+    rng = np.random.default_rng(1)
+    return [_random_sequence(rng, 900) for _ in range(5)]
+
+
+def test_add_search_remove(sequences):
+    index = KmerIndex()
+    index.add([(i + 1, i, s) for i, s in enumerate(sequences)])
+    assert len(index) == 5
+    query = _mutate(np.random.default_rng(2), sequences[2], 5)
+    hits = index.search(query, top_k=3)
+    assert hits["sequence_id"].iloc[0] == 3
+    assert hits["identity"].iloc[0] > 0.9
+    assert len(hits) <= 3
+    assert index.search(sequences[0])["identity"].iloc[0] == 1
+    assert index.search(query, min_identity=0.999).empty
+
+    index.remove([3])
+    assert len(index) == 4
+    assert 3 not in index.search(query)["sequence_id"].tolist()
+    # adding an indexed id replaces its sequence
+    index.add([(1, 5, sequences[2])])
+    assert len(index) == 4
+    assert index.search(query)["sequence_id"].iloc[0] == 1
+
+
+def test_protein_index(sequences):
+    index = KmerIndex("protein")
+    index.add([(i + 1, i, translate(s)) for i, s in enumerate(sequences)])
+    # nucleotide queries are translated
+    assert index.search(sequences[4])["sequence_id"].iloc[0] == 5
+    assert index.search(translate(sequences[4]))["identity"].iloc[0] == 1
+    with pytest.raises(ValueError):
+        KmerIndex().search(translate(sequences[0]))
+
+
+def test_sync(session, sequences):
+    for i, sequence in enumerate(sequences):
+        add_sequence(session, f"AB{i}", sequence)
+    session.commit()
+    index = KmerIndex()
+    assert index.sync(session, ResfinderSequence) == (5, 0)
+    assert index.sync(session, ResfinderSequence) == (0, 0)
+    session.execute(delete(ResfinderSequence)
+            .where(ResfinderSequence.accession == "AB0"))
+    session.commit()
+    assert index.sync(session, ResfinderSequence) == (0, 1)
+    assert len(index) == 4
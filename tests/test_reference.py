@@ -0,0 +1,48 @@
+from sqlalchemy.orm import Session
+
+from agesamrdb.engine import begin_write
+from agesamrdb.models import ResfinderSequence
+from agesamrdb.reference import ReferenceIndex
+from agesamrdb.util import calc_sequence_fingerprint
+
+from conftest import add_sequence
+
+
+def test_get_exact_fingerprint_else_first_id(session):
+    original = add_sequence(session, "AB123", "ATGAAA")
+    variant = add_sequence(session, "AB123", "ATGAAC", name="AGES_1_AB123")
+    other = add_sequence(session, "CD456", "ATGCCC")
+    index = ReferenceIndex(session, ResfinderSequence)
+    assert index.get("AB123", variant.seq_fingerprint) == variant.id
+    assert index.get("AB123", original.seq_fingerprint) == original.id
+    # unknown sequence of accession: original entry
+    assert index.get("AB123", calc_sequence_fingerprint("ATGGGG")) \
+            == original.id
+    # fingerprint of another accession is not used
+    assert index.get("AB123", other.seq_fingerprint) == original.id
+    assert index.get("XY000", original.seq_fingerprint) is None
+    assert variant.seq_fingerprint in index
+
+
+def test_sequences_of_concurrent_importers(engine, session):
+    add_sequence(session, "AB123", "ATGAAA")
+    session.commit()
+    index = ReferenceIndex(session, ResfinderSequence)
+    session.commit()
+    with Session(engine) as other:
+        variant = add_sequence(other, "AB123", "ATGAAC", name="AGES_1_AB123")
+        other.commit()
+        variant_id = variant.id
+        fingerprint = variant.seq_fingerprint
+        late = add_sequence(other, "CD456", "ATGCCC")
+        other.commit()
+        late_id, late_fingerprint = late.id, late.seq_fingerprint
+    assert fingerprint not in index
+    # write transaction of an import (sees all committed sequences)
+    begin_write(session)
+    assert index.is_stored(session, fingerprint)
+    assert index.get("AB123", fingerprint) == variant_id
+    assert not index.is_stored(session, calc_sequence_fingerprint("ATGGGG"))
+    session.commit()
+    index.refresh(session)
+    assert index.get("CD456", late_fingerprint) == late_id
@@ -0,0 +1,47 @@
+import os
+
+from sqlalchemy import select
+
+from agesamrdb.importlog import write_logged_import
+from agesamrdb.interfaces import read_import, tool_version_args
+from agesamrdb.models import Sample, ToolVersion, Phenotype, SamplePhenotype
+from agesamrdb.summary import refresh_sample_phenotypes
+from agesamrdb.util import get_or_create
+
+from conftest import TESTDATA
+
+
+def _import(session, out_dir, replace=False):
+    input_path = os.path.join(TESTDATA, out_dir)
+    results = read_import(input_path, "resfinder")
+    sample = get_or_create(session, Sample, name="test", external_id=1)
+    version = get_or_create(session, ToolVersion,
+            **tool_version_args("resfinder", "fastq", "test"))
+    assert write_logged_import(results, sample, session, version,
+            "resfinder", out_dir.ljust(32, "0"), replace=replace)
+    session.commit()
+    return results
+
+
+def _sample_phenotypes(session):
+    return sorted(session.execute(select(SamplePhenotype.sample_id,
+        Phenotype.phenotype, SamplePhenotype.tool,
+        SamplePhenotype.evidence_count, SamplePhenotype.best_identity)
+        .join(Phenotype)).all())
+
+
+def test_refresh_after_replace(session, resfinder_references):
+    _import(session, "resfinder_assembly_out")
+    assembly = _sample_phenotypes(session)
+    assert assembly
+    reads = _import(session, "resfinder_reads_out", replace=True)
+    replaced = _sample_phenotypes(session)
+    assert replaced != assembly
+    # entries written by the import equal a full rebuild
+    refresh_sample_phenotypes(session)
+    session.commit()
+    assert _sample_phenotypes(session) == replaced
+    # only phenotypes of the genes found in the reads
+    accessions = set(dict(reads)["resfinder"]["accession"])
+    assert {row.phenotype for row in replaced if row.tool == "resfinder"} \
+            == {resfinder_references[a] for a in accessions}
@@ -17,26 +17,26 @@ from agesamrdb.models import Base, ResfinderSequence, Phenotype, ResfinderResult
         SpeciesfinderResult, pointfinder_phenotype_association_table, ToolVersion, \
         AmrfinderSequence, AmrfinderResult, AmrfinderPointResult, MlstResult, \
         amrfinder_point_phenotype_association_table, \
-        amrfinder_phenotype_association_table, resfinder_phenotype_association_table
-
-from agesamrdb.util import calc_sequence_hash, get_or_create
-
-from sqlalchemy import create_engine, insert, text, inspect 
+        amrfinder_phenotype_association_table, resfinder_phenotype_association_table, \
+        ImportLog, SamplePhenotype, prepare_models
+
+from agesamrdb.util import calc_sequence_hash, calc_sequence_fingerprint, \
+        calc_natural_key, get_or_create
+from agesamrdb.cli import add_database_arguments
+from agesamrdb.engine import engine_from_args, write_engine
+from agesamrdb.summary import refresh_sample_phenotypes
+from agesamrdb.kmers import get_kmer_index
+
+from sqlalchemy import insert, update, delete, select, text, inspect, \
+        bindparam
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import Session, declarative_base
 from sqlalchemy.ext.automap import automap_base
 
 parser = argparse.ArgumentParser(description="Create and/or update Resistance" \
         + "-Gene-Database for ResFinder")
-parser.add_argument('-d','--database',dest='database',
-        help="mysql database name or path to sqlite-db [./agres.db]",
-        default="./agres.db")
-parser.add_argument('-H','--hostname',dest='hostname',
-        help="mysql hostname if not provided sqlite-db will be created",
-        required=False)
-parser.add_argument('-u','--user',dest='dbuser', help="mysql database username",
-        required=False)
-parser.add_argument('-p','--password',dest='mariadbpassword',
-        help="mysql password", required=False)
+# db definitions
+add_database_arguments(parser)
 parser.add_argument('--resfinder_db', dest='resfinder_db_dir',
         help="path to resfinder_db local git checkout", required=False,
         default="resfinder_db")
@@ -46,6 +46,12 @@ parser.add_argument('--resfinder_db', dest='resfinder_db_dir',
 parser.add_argument('--amrfinder_db', dest='amrfinder_db_dir',
         help="path to amrfinder_db previously downloaded",
         required=False, default='/db/amrfinder/latest')
+parser.add_argument('--upgrade_only', dest='upgrade_only', action='store_true',
+        help="only upgrade schema of existing database (add missing " \
+        + "columns and indexes), no sequence update")
+parser.add_argument('--kmer_index', dest='kmer_index', metavar="DIR",
+        help="directory of the k-mer index of the sequences (see " \
+        + "amrdb_nearest_sequences.py), updated with the changed sequences")
 
 
 table_initialization_order = [
@@ -54,6 +60,8 @@ table_initialization_order = [
         MobTyperResult, Phenotype, InVitroResult, PlasmidfinderResult,
         ISEScanResult, PhispyResults, SpeciesfinderResult, MlstResult,
 ]
+# tables added by later versions, created by upgrade_schema
+upgrade_tables = [ImportLog, SamplePhenotype]
 
 
 def read_resfinder_databases(resfinder_db_dir):
@@ -67,7 +75,8 @@ def read_resfinder_databases(resfinder_db_dir):
         table_name = os.path.basename(db_file).replace(".fsa","").replace("-","_")
         for seqrecord in SeqIO.parse(db_file, "fasta"):
             entry = {"name": seqrecord.id, "sequence":str(seqrecord.seq), 
-                    "crc32_hash":calc_sequence_hash(str(seqrecord.seq))}
+                    "crc32_hash":calc_sequence_hash(str(seqrecord.seq)),
+                    "seq_fingerprint":calc_sequence_fingerprint(str(seqrecord.seq))}
             entries.append(entry)
         
     return pd.DataFrame.from_records(entries)
@@ -83,6 +92,7 @@ def read_amrfinder_database(amrfinder_db_dir):
                 phenotype, class_name, long_name = seqrecord.description.split("|")
         entry = {"name": name, "sequence":str(seqrecord.seq),
                 "crc32_hash":calc_sequence_hash(str(seqrecord.seq)),
+                "seq_fingerprint":calc_sequence_fingerprint(str(seqrecord.seq)),
                 "short_name": short_name, "activity_type": activity_type,
                 "Phenotype": phenotype, "Class": class_name, "long_name": long_name,
                 "is_core": True if int(core_status) > 1 else False,
@@ -147,56 +157,293 @@ def identify_columns(df):
 def update_existing_sequences(df_new, session, tool_model):
     """
     Updates all sequence-names, numbering and accession in database:
-    not sequence, crc32_hash or internal identifier unless newly added
+    not sequence, hashes or internal identifier unless newly added
     bc. already found variants/alleles are added with internal identifier
     and closest accession (single acn. may have multiple sequences associated)
     this saves some recalculation for newly added variants which we already
     detected in our assemblies (just adding name)
+    entries are matched by sequence (seq_fingerprint), the current state
+    (without sequences) is loaded in a single query and only new and changed
+    entries are written (bulk insert/update)
+    returns dict with number of inserted, updated and unchanged entries
     """
     df_new.replace([np.nan], [None], inplace=True)
-    for i, row in df_new.iterrows():
-        entry = session.query(tool_model).filter_by(
-                crc32_hash=row["crc32_hash"])
-        if entry.count() > 1: # deal with collisions
-            entry = entry.filter_by(sequence=row["sequence"]).first()
-        else:
-            entry = entry.first()
-        if entry:
-            print(f"updating {entry} with {row}")
-            for key, value in row.items():
-                setattr(entry, key, value)
-        else:
-            #TODO: handle that samples should be reanalyzed
-            # potentially to be checked manually wheter required or not
-            # i.e. only in case a completely new type of sequence 
-            # not variant/allel is added
-            print(f"adding new {row}")
-            session.add(tool_model(**row))
-
+    columns = list(df_new.columns)
+    # same sequence listed multiple times -> last entry wins
+    df_new = df_new.drop_duplicates("seq_fingerprint", keep="last")
+
+    compared = [c for c in columns
+            if c not in ("seq_fingerprint", "crc32_hash", "sequence")]
+    existing = pd.DataFrame(session.execute(select(tool_model.id,
+        tool_model.seq_fingerprint, *[getattr(tool_model, c) for c in compared])
+        .order_by(tool_model.id)).all(),
+        columns=["id", "seq_fingerprint"] + compared)
+    # multiple entries with same sequence -> first entry is updated
+    existing = existing.drop_duplicates("seq_fingerprint", keep="first")
+    merged = df_new.merge(existing, on="seq_fingerprint", how="left",
+            suffixes=("", "_db"))
+
+    new_entries = merged[merged["id"].isna()][columns]
+    matched = merged[merged["id"].notna()]
+    changed = np.zeros(len(matched), dtype=bool)
+    for c in compared:
+        new_values = matched[c].astype(object)
+        db_values = matched[f"{c}_db"].astype(object)
+        changed |= ((new_values != db_values)
+                & ~(new_values.isna() & db_values.isna())).to_numpy()
+    updated_entries = matched[changed][["id"] + compared].copy()
+    updated_entries["id"] = updated_entries["id"].astype(int)
+
+    if not new_entries.empty:
+        session.execute(insert(tool_model),
+                new_entries.replace([np.nan], [None]).to_dict("records"))
+    if not updated_entries.empty:
+        session.execute(update(tool_model),
+                updated_entries.replace([np.nan], [None]).to_dict("records"))
     session.commit()
 
+    summary = {"inserted": len(new_entries), "updated": len(updated_entries),
+            "unchanged": len(matched) - len(updated_entries)}
+    print(f"{tool_model.__tablename__}: {summary['inserted']} inserted, "
+            + f"{summary['updated']} updated, {summary['unchanged']} unchanged")
+    return summary
+
+
+def _phenotype_ids(session):
+    """
+    dict phenotype name -> id (first entry if listed with multiple classes)
+    """
+    phenotype_ids = {}
+    for phenotype_id, name in session.execute(select(Phenotype.id,
+            Phenotype.phenotype).order_by(Phenotype.id)):
+        phenotype_ids.setdefault(name, phenotype_id)
+    return phenotype_ids
+
 
 def write_phenotypes(phenotypes_df, session, tool_model):
     """
     create entries for phenotypes adding links to sequence by accession
-    by recreating from scratch we update the phenotype associated with sequences
+    by synchronizing the association table with the reference database we
+    update the phenotype associated with sequences
     e.g. previously added internal sequence receives new phenotype association
     if they are published in database with official name
+    the desired (sequence_id, phenotype_id) pairs are compared to the existing
+    rows and only missing pairs are inserted and outdated pairs deleted (in a
+    single transaction), so the table is never empty during updates
+    returns dict with number of inserted, deleted and unchanged associations
     """
-    for groupname, sub_df in phenotypes_df.groupby("Phenotype"):
-        phenotype_name = groupname.title().replace("_"," ")
-        linked_sequences = session.query(tool_model).filter(
-                tool_model.accession.in_(
-                    sub_df["sequence_identifier"].to_list())).all()
-        phenotype = get_or_create(session, Phenotype, phenotype=phenotype_name)
-        for l in linked_sequences:
-            if tool_model.__name__.startswith("Resfinder"):
-                phenotype.resfinder_sequences.append(l)
-            elif tool_model.__name__.startswith("Amrfinder"):
-                phenotype.amrfinder_sequences.append(l)
-        session.add(phenotype)
+    association_table = tool_model.__mapper__.relationships["phenotypes"].secondary
+    df = phenotypes_df[["Phenotype","sequence_identifier"]].dropna().copy()
+    df["Phenotype"] = df["Phenotype"].str.title().str.replace("_"," ")
+
+    # create missing phenotypes (without class)
+    phenotype_ids = _phenotype_ids(session)
+    missing = [p for p in df["Phenotype"].unique() if p not in phenotype_ids]
+    if missing:
+        session.execute(insert(Phenotype), [{"phenotype": p} for p in missing])
+        phenotype_ids = _phenotype_ids(session)
+    df["phenotype_id"] = df["Phenotype"].map(phenotype_ids)
+
+    # link by accession, all sequences of an accession (incl. AGES_ variants)
+    sequences = pd.DataFrame(session.execute(select(tool_model.id,
+        tool_model.accession)).all(), columns=["sequence_id", "accession"])
+    desired = df.merge(sequences, left_on="sequence_identifier",
+            right_on="accession")[["sequence_id", "phenotype_id"]]\
+            .drop_duplicates()
+
+    existing = pd.DataFrame(session.execute(select(association_table.c.id,
+        association_table.c.sequence_id, association_table.c.phenotype_id)).all(),
+        columns=["id", "sequence_id", "phenotype_id"])
+    existing = existing.merge(desired.assign(desired=True), how="left",
+            on=["sequence_id", "phenotype_id"])
+    outdated = existing["desired"].isna() \
+            | existing.duplicated(["sequence_id", "phenotype_id"])
+    delete_ids = existing.loc[outdated, "id"].tolist()
+    new_pairs = desired.merge(existing[["sequence_id", "phenotype_id"]],
+            how="left", indicator=True)
+    new_pairs = new_pairs[new_pairs["_merge"] == "left_only"]\
+            [["sequence_id", "phenotype_id"]]
+
+    for start in range(0, len(delete_ids), 500):
+        session.execute(delete(association_table).where(
+            association_table.c.id.in_(delete_ids[start:start+500])))
+    if not new_pairs.empty:
+        session.execute(insert(association_table), new_pairs.to_dict("records"))
     session.commit()
 
+    summary = {"inserted": len(new_pairs), "deleted": len(delete_ids),
+            "unchanged": len(existing) - len(delete_ids)}
+    print(f"{association_table.name}: {summary['inserted']} inserted, "
+            + f"{summary['deleted']} deleted, {summary['unchanged']} unchanged")
+    return summary
+
+
+def add_missing_columns(engine):
+    """
+    idempotent upgrade of existing databases: adds columns declared in the
+    models which do not exist in the database yet (always nullable, values
+    of existing rows are filled by the corresponding backfill)
+    returns list of added (table, column) names
+    """
+    insp = inspect(engine)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {column["name"] for column in insp.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN "
+                    + f"{column.name} {column_type}"))
+            print(f"add new column: {table.name}.{column.name}")
+            added.append((table.name, column.name))
+    return added
+
+
+def backfill_sequence_fingerprints(engine, chunk_size=5000):
+    """
+    calculates seq_fingerprint of reference sequences stored before the
+    column existed (NULL), written in chunks via executemany
+    """
+    for table in (ResfinderSequence.__table__, AmrfinderSequence.__table__):
+        filled = 0
+        with engine.begin() as connection:
+            rows = connection.execute(select(table.c.id, table.c.sequence)
+                    .where(table.c.seq_fingerprint.is_(None))).all()
+            values = [{"_id": sequence_id,
+                "_fingerprint": calc_sequence_fingerprint(sequence)}
+                for sequence_id, sequence in rows]
+            statement = update(table).where(table.c.id == bindparam("_id"))\
+                    .values(seq_fingerprint=bindparam("_fingerprint"))
+            for start in range(0, len(values), chunk_size):
+                connection.execute(statement, values[start:start+chunk_size])
+                filled += len(values[start:start+chunk_size])
+        if filled:
+            print(f"{table.name}: seq_fingerprint calculated for {filled} entries")
+
+
+def backfill_natural_keys(engine, chunk_size=5000):
+    """
+    calculates natural_key of samples, tool versions and phenotypes stored
+    before the column existed (NULL), written in chunks via executemany
+    """
+    for model in (Sample, ToolVersion, Phenotype):
+        table = model.__table__
+        key_columns = [table.c[c] for c in model.natural_key_columns]
+        filled = 0
+        with engine.begin() as connection:
+            rows = connection.execute(select(table.c.id, *key_columns)
+                    .where(table.c.natural_key.is_(None))).all()
+            values = [{"_id": row[0], "_key": calc_natural_key(row[1:])}
+                    for row in rows]
+            values = [v for v in values if v["_key"] is not None]
+            statement = update(table).where(table.c.id == bindparam("_id"))\
+                    .values(natural_key=bindparam("_key"))
+            for start in range(0, len(values), chunk_size):
+                connection.execute(statement, values[start:start+chunk_size])
+                filled += len(values[start:start+chunk_size])
+        if filled:
+            print(f"{table.name}: natural_key calculated for {filled} entries")
+
+
+def upgrade_schema(engine):
+    """
+    idempotent upgrade of databases created by previous versions: missing
+    tables, columns (filled for existing rows) and indexes
+    """
+    insp = inspect(engine)
+    created = []
+    for table_class in upgrade_tables:
+        if not insp.has_table(table_class.__table__.name):
+            print(f"create new table: {table_class.__table__.name}")
+            table_class.__table__.create(engine)
+            created.append(table_class)
+    add_missing_columns(engine)
+    backfill_sequence_fingerprints(engine)
+    backfill_natural_keys(engine)
+    create_missing_indexes(engine)
+    if SamplePhenotype in created:
+        backfill_sample_phenotypes(engine)
+
+
+def backfill_sample_phenotypes(engine, tools=None):
+    """
+    (re)writes the sample x phenotype matrix (see
+    agesamrdb.summary.refresh_sample_phenotypes) of all samples, e.g. for
+    results imported before the table existed
+    """
+    prepare_models(engine)
+    with Session(write_engine(engine)) as session:
+        written = refresh_sample_phenotypes(session, tools=tools)
+        session.commit()
+    print(f"{SamplePhenotype.__tablename__}: {written} entries written")
+
+
+def create_missing_indexes(engine):
+    """
+    idempotent upgrade of existing databases: creates indexes declared in the
+    models which do not exist in the database yet (tables created before they
+    were declared). unique indexes fail on existing duplicates, these are
+    reported and skipped until duplicates are removed
+    """
+    insp = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {index["name"] for index in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(engine)
+                print(f"create new index: {index.name}")
+            except (IntegrityError, OperationalError) as e:
+                print(f"WARNING: could not create index {index.name} on "
+                        + f"{table.name}, remove duplicate entries and rerun: "
+                        + f"{e.orig}")
+            existing.add(index.name)
+
+
+def update_reference_sequences(session, resfinder_db_dir, amrfinder_db_dir):
+    """
+    reads resfinder_db and amrfinder database files and writes sequences and
+    phenotype associations of both to database (tables must exist and be
+    prepared)
+    """
+    # read database files:
+    records = read_resfinder_databases(resfinder_db_dir)
+    sequences_df = identify_columns(records)
+    phenotypes_df = read_phenotypes(resfinder_db_dir)
+    amrfinder_df = read_amrfinder_database(amrfinder_db_dir)
+    amrfinder_phenotype_df = amrfinder_df[["Phenotype","accession"]]\
+            .rename(columns={"accession":"sequence_identifier"})
+    amrfinder_phenotype_df["Phenotype"] = amrfinder_phenotype_df["Phenotype"].str.split("/")
+    amrfinder_phenotype_df = amrfinder_phenotype_df.explode("Phenotype")
+    amrfinder_phenotype_df["Phenotype"] = amrfinder_phenotype_df["Phenotype"].str.title()
+    amrfinder_df = amrfinder_df.drop(["Phenotype","Class"], axis=1)
+
+    print("start filling resfinder sequences to database")
+    update_existing_sequences(sequences_df, session, ResfinderSequence)
+    resfinder_summary = write_phenotypes(phenotypes_df, session, ResfinderSequence)
+    print("start filling amrfinder sequences to database")
+    update_existing_sequences(amrfinder_df, session, AmrfinderSequence)
+    amrfinder_summary = write_phenotypes(amrfinder_phenotype_df, session,
+            AmrfinderSequence)
+
+    # phenotypes of imported genes changed: sample x phenotype matrix of all
+    # samples is rewritten for the tools concerned
+    tools = [tool for tool, summary in [("resfinder", resfinder_summary),
+        ("amrfinder", amrfinder_summary)]
+        if summary["inserted"] or summary["deleted"]]
+    if tools:
+        written = refresh_sample_phenotypes(session, tools=tools)
+        session.commit()
+        print(f"{SamplePhenotype.__tablename__}: {written} entries of "
+                + f"{', '.join(tools)} written")
+
 
 def initialize_phenotype_classes(session):
     """
@@ -218,25 +465,13 @@ def main():
 
     args = parser.parse_args()
 
-    # read database files:
-    records = read_resfinder_databases(args.resfinder_db_dir)
-    sequences_df = identify_columns(records)
-    phenotypes_df = read_phenotypes(args.resfinder_db_dir)
-    amrfinder_df = read_amrfinder_database(args.amrfinder_db_dir)
-    amrfinder_phenotype_df = amrfinder_df[["Phenotype","accession"]]\
-            .rename(columns={"accession":"sequence_identifier"})
-    amrfinder_phenotype_df["Phenotype"] = amrfinder_phenotype_df["Phenotype"].str.split("/")
-    amrfinder_phenotype_df = amrfinder_phenotype_df.explode("Phenotype")
-    amrfinder_phenotype_df["Phenotype"] = amrfinder_phenotype_df["Phenotype"].str.title()
-    amrfinder_df = amrfinder_df.drop(["Phenotype","Class"], axis=1)
+    # establish connection to database (mysql or sqlite), all transactions
+    # write (sqlite: take the write lock when they begin)
+    engine = write_engine(engine_from_args(args))
 
-    # establish connection to database
-    if args.hostname:
-        engine = create_engine("mysql+mysqlconnector://%s:%s@%s:3306/%s" %
-                        (args.dbuser, args.mariadbpassword, args.hostname,
-                            args.database))
-    else:
-        engine = create_engine("sqlite:///%s" % args.database)
+    if args.upgrade_only:
+        upgrade_schema(engine)
+        return
 
     session = Session(engine)
 
@@ -252,33 +487,30 @@ def main():
 
     # prepare not yet existing association-tables:
     for table in [pointfinder_phenotype_association_table, 
-            amrfinder_point_phenotype_association_table]:
+            amrfinder_point_phenotype_association_table,
+            resfinder_phenotype_association_table,
+            amrfinder_phenotype_association_table]:
         if not insp.has_table(table.name):
             table.create(engine)
-    
-    # always drop phenotype association table and create newly
-    if insp.has_table(resfinder_phenotype_association_table.name):
-        resfinder_phenotype_association_table.drop(engine)
-    if insp.has_table(amrfinder_phenotype_association_table.name):
-        amrfinder_phenotype_association_table.drop(engine)
-
-    amrfinder_phenotype_association_table.create(engine)
-    resfinder_phenotype_association_table.create(engine)
     session.commit()
 
+    # add columns and indexes to tables created by previous versions
+    upgrade_schema(engine)
+
     # connect the defined classes to the data in db:
-    Base.prepare(engine)
+    prepare_models(engine)
 
     if install:
         initialize_phenotype_classes(session)
 
     # write database entries:
-    print("start filling resfinder sequences to database")
-    update_existing_sequences(sequences_df, session, ResfinderSequence)
-    write_phenotypes(phenotypes_df, session, ResfinderSequence)
-    print("start filling amrfinder sequences to database")
-    update_existing_sequences(amrfinder_df, session, AmrfinderSequence)
-    write_phenotypes(amrfinder_phenotype_df, session, AmrfinderSequence)
+    update_reference_sequences(session, args.resfinder_db_dir,
+            args.amrfinder_db_dir)
+
+    if args.kmer_index:
+        for model in (ResfinderSequence, AmrfinderSequence):
+            index = get_kmer_index(session, model, args.kmer_index)
+            print(f"k-mer index {model.__tablename__}: {len(index)} sequences")
 
     session.commit()
     session.close()